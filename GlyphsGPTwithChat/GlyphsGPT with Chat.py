@@ -13,17 +13,27 @@ A standalone Glyphs script with an HTML chat UI that uses Codex.
 """
 
 import builtins
+import collections
+import concurrent.futures
 import contextlib
 import copy
+import cProfile
+import gzip
+import hashlib
 import io
 import json
+import math
 import os
+import pstats
 import re
 import shutil
 import subprocess
+import sys
 import tempfile
 import threading
+import time
 import traceback
+import tracemalloc
 import uuid
 import ssl
 import urllib.request
@@ -139,21 +149,36 @@ def _build_opener(url, insecure_https):
     return urllib.request.build_opener(*handlers)
 
 def http_post_json(url, payload, headers=None, timeout=25):
-    body = json.dumps(payload).encode("utf-8")
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.exchange("POST", url, payload, headers, lambda: _http_post_json_live(url, payload, headers, timeout))
+    return _http_post_json_live(url, payload, headers, timeout)
+
+def _http_post_json_live(url, payload, headers=None, timeout=25):
+    with trace_span("http.encode"):
+        body = json.dumps(payload).encode("utf-8")
     headers = {"Content-Type": "application/json", **(headers or {})}
 
     if str(url or "").lower().startswith("https") and HAS_NSURLSESSION and PREFER_APPLE_TLS:
-        return _ns_request_json("POST", url, body, headers, timeout)
+        with trace_span("http.request (Apple TLS)"):
+            return _ns_request_json("POST", url, body, headers, timeout)
 
     req = urllib.request.Request(url, data=body, method="POST", headers=headers)
+    trace = current_trace()
     try:
+        started = time.monotonic()
         if _is_private_url(url):
             opener = _build_opener(url, insecure_https=str(url or "").lower().startswith("https"))
-            with opener.open(req, timeout=timeout) as r:
-                raw = r.read().decode("utf-8", "ignore")
+            r = opener.open(req, timeout=timeout)
         else:
-            with urllib.request.urlopen(req, timeout=timeout) as r:
-                raw = r.read().decode("utf-8", "ignore")
+            r = urllib.request.urlopen(req, timeout=timeout)
+        with r:
+            if trace is not None:
+                trace.add("http.connect+ttfb", started)
+            started = time.monotonic()
+            raw = r.read().decode("utf-8", "ignore")
+            if trace is not None:
+                trace.add("http.download", started)
     except urllib.error.HTTPError as e:
         try:
             body_txt = e.read().decode("utf-8", "ignore")
@@ -169,11 +194,18 @@ def http_post_json(url, payload, headers=None, timeout=25):
         raise RuntimeError("Request failed for %s\n%s" % (url, e))
 
     try:
-        return json.loads(raw) if raw else {}
+        with trace_span("json.parse"):
+            return json.loads(raw) if raw else {}
     except Exception:
         return {"_raw": raw}
 
 def http_get_json(url, headers=None, timeout=10):
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.exchange("GET", url, None, headers, lambda: _http_get_json_live(url, headers, timeout))
+    return _http_get_json_live(url, headers, timeout)
+
+def _http_get_json_live(url, headers=None, timeout=10):
     headers = headers or {}
 
     if str(url or "").lower().startswith("https") and HAS_NSURLSESSION and PREFER_APPLE_TLS:
@@ -229,6 +261,110 @@ STATE_PATH = os.path.join(STATE_DIR, "GlyphsGPTwithChat_state.json")
 SCRIPT_BUILD = "2026-05-23.glyphsgpt_with_chat_codex_mcp_bypass"
 DEFAULT_LMSTUDIO_PLUGIN = "mcp/glyphs-mcp"
 DEFAULT_GLYPHS_MCP_URL = "http://127.0.0.1:9680/mcp/"
+FONT_INDEX_DIR = os.path.join(STATE_DIR, "GlyphsGPTwithChat_index")
+TRACE_PATH = os.path.join(STATE_DIR, "GlyphsGPTwithChat_trace.jsonl")
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_PENDING_MAX = 16
+CASSETTE_MODE = os.environ.get("GLYPHSGPT_CASSETTE_MODE", "")  # "", "record" or "replay"
+CASSETTE_PATH = os.environ.get("GLYPHSGPT_CASSETTE", os.path.join(STATE_DIR, "GlyphsGPTwithChat_cassette.jsonl.gz"))
+CASSETTE_SPEED = float(os.environ.get("GLYPHSGPT_CASSETTE_SPEED", "1") or 1)  # replay speed-up; 0 = no delays
+USAGE_PATH = os.path.join(STATE_DIR, "GlyphsGPTwithChat_usage.json")
+PRICES_PATH = os.path.join(STATE_DIR, "GlyphsGPTwithChat_prices.json")
+USAGE_KEEP_DAYS = 90
+# USD per million tokens: (input, cached input, output). The longest matching model prefix wins;
+# GlyphsGPTwithChat_prices.json can override or add entries in the same shape.
+PRICE_TABLE = {
+    "gpt-5": (1.25, 0.125, 10.0),
+    "gpt-5-mini": (0.25, 0.025, 2.0),
+    "gpt-5-nano": (0.05, 0.005, 0.4),
+    "gpt-4.1": (2.0, 0.5, 8.0),
+    "gpt-4.1-mini": (0.4, 0.1, 1.6),
+    "gpt-4.1-nano": (0.1, 0.025, 0.4),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "o3": (2.0, 0.5, 8.0),
+    "o4-mini": (1.1, 0.275, 4.4),
+    "claude-opus-4": (15.0, 1.5, 75.0),
+    "claude-opus-4-5": (5.0, 0.5, 25.0),
+    "claude-sonnet-4": (3.0, 0.3, 15.0),
+    "claude-haiku-4": (1.0, 0.1, 5.0),
+    "claude-3-5-haiku": (0.8, 0.08, 4.0),
+}
+LATENCY_PATH = os.path.join(STATE_DIR, "GlyphsGPTwithChat_latency.json")
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS_MS = (50, 100, 200, 350, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000, 45000, 60000, 90000, 120000, 180000, 300000, 600000)
+LATENCY_DECAY = 0.99  # per sample, so older calls fade out (half-life ~70 calls)
+LATENCY_MIN_SAMPLES = 8
+LATENCY_SAVE_DELAY_S = 5.0  # coalesce bursts of calls into one write of the latency file
+ADAPTIVE_TIMEOUT_FACTOR = 3.0  # deadline = p99 x factor, once there are enough samples
+ADAPTIVE_TIMEOUT_MIN_S = 15.0
+ADAPTIVE_TIMEOUT_MAX_S = 900.0
+DEGRADED_FAILURE_RATE = 0.5
+SLOW_RUN_FACTOR = 1.5  # flag a run as slow once it passes p95 x factor
+ROUTER_MODEL = "auto"
+ROUTER_LONG_PROMPT_CHARS = 500
+ROUTER_LARGE_CONTEXT_CHARS = 12000
+# Expected latency (s) for a model with no history yet.
+ROUTER_DEFAULT_LATENCY_S = {"local": 3.0, "remote": 12.0}
+# Optional explicit candidates, e.g. [{"provider": "openai_compat", "apiBase": "http://127.0.0.1:1234/v1", "model": "qwen3-8b"}];
+# when empty, every API tab with a concrete model is a candidate.
+ROUTER_CANDIDATES = []
+ROUTER_COMPLEX_WORDS = (
+    "refactor", "all glyphs", "every glyph", "each glyph", "whole font", "entire font", "font-wide", "all masters",
+    "every master", "interpolat", "compatib", "kerning", "kern ", "spacing", "metrics", "rewrite", "optimi",
+    "algorithm", "design", "plan", "why", "debug", "traceback", "error", "fix", "script that", "batch",
+)
+ROUTER_SIMPLE_WORDS = (
+    "what is", "what's", "unicode", "codepoint", "name of", "how many", "count", "list", "show", "which", "where",
+    "select", "rename", "width of", "sidebearing", "lsb", "rsb",
+)
+CASSETTE_SECRET_HEADERS = ("authorization", "x-api-key", "api-key", "openai-api-key", "anthropic-api-key")
+FONT_INDEX_SUMMARY_CHARS = 1800
+GEOMETRY_CONTEXT_BYTES = 6000
+GEOMETRY_MAX_NODES = 400
+GEOMETRY_CACHE_SIZE = 256
+SNIPPET_TOP_K = 3
+SNIPPET_MAX_CHARS = 1500
+SUMMARY_WINDOW = 12
+SUMMARY_MIN_BATCH = 4
+SUMMARY_MAX_CHARS = 2400
+SUMMARY_ITEM_CHARS = 1500
+CODEX_SESSION_IDLE_S = 900.0
+CODEX_START_TIMEOUT_S = 45.0
+CODEX_TURN_TIMEOUT_S = 1800.0
+CODEX_STOP_GRACE_S = 10.0  # after this, a turn that ignored turn/interrupt is ended by closing its session
+CODEX_STDERR_LIMIT = 64 * 1024
+CODEX_PROGRESS_INTERVAL_S = 0.25
+MCP_PROBE_TIMEOUT_S = 1.5
+MCP_STATUS_TTL_S = 30.0
+MCP_POLL_UP_S = 10.0
+MCP_POLL_DOWN_S = 2.0
+MCP_POLL_MAX_S = 60.0
+MCP_CALL_TIMEOUT_S = 60.0
+MCP_PROTOCOL_VERSION = "2025-03-26"
+MCP_TOOL_MAX_STEPS = 12
+MCP_TOOL_MAX_PARALLEL = 8
+MCP_TOOL_RESULT_CHARS = 20000
+TOOL_CACHE_SIZE = 256
+EXEC_FILENAME = "<GlyphsGPT with Chat>"
+EXEC_SOFT_LIMIT_S = 600.0
+EXEC_YIELD_INTERVAL_S = 0.1
+EXEC_CHECK_LINES = 64
+EXEC_OUTPUT_HEAD_CHARS = 32 * 1024
+EXEC_OUTPUT_TAIL_CHARS = 32 * 1024
+EXEC_OUTPUT_PENDING_CHARS = 16 * 1024
+EXEC_LOG_DIR = os.path.join(STATE_DIR, "GlyphsGPTwithChat_logs")
+EXEC_LOG_KEEP_FILES = 20
+EXEC_LOG_PAGE_BYTES = 256 * 1024
+PROFILE_DIR = os.path.join(STATE_DIR, "GlyphsGPTwithChat_profiles")
+PROFILE_TOP_N = 25
+PROFILE_ALLOC_TOP_N = 10
+PROFILE_KEEP_FILES = 50
+CODE_CACHE_SIZE = 32
+PRECOMPILE_CODE_ANSWERS = True
+BATCH_CHUNK_SIZE = 50
+BATCH_MAX_ERRORS_SHOWN = 10
+MCP_READONLY_PREFIXES = ("get_", "list_", "read_", "find_", "search_", "describe_", "inspect_", "export_")
 
 SESSION_DEFAULTS = {
     "name": "Chat 1",
@@ -241,6 +377,9 @@ SESSION_DEFAULTS = {
     "theme": DEFAULT_THEME,
     "reasoning": DEFAULT_REASONING,
     "copyToMacro": False,
+    "geometryContext": False,
+    "summaryModel": "",
+    "summary": {},
     "history": [],
 }
 
@@ -286,6 +425,9 @@ HTML = r'''<!doctype html>
   .title{font-weight:700;letter-spacing:.15px;font-size:15px;line-height:1.2}
   .muted{color:var(--muted);font-size:12px}
   .subtitle{display:none}
+  .mcpDot{width:8px;height:8px;border-radius:50%;background:var(--muted);opacity:.7;flex:0 0 auto}
+  .mcpDot.up{background:var(--good);opacity:1}
+  .mcpDot.down{background:var(--bad);opacity:1}
   .topActions{display:flex;gap:6px;align-items:center;flex-wrap:wrap}
   .pillset{display:flex;gap:6px;align-items:center}
   .pill{border:1px solid var(--border);background:#111722;color:var(--text);border-radius:7px;padding:5px 10px;cursor:pointer}
@@ -345,6 +487,16 @@ HTML = r'''<!doctype html>
   .bubble p{margin:0 0 10px 0}
   .bubble p:last-child{margin-bottom:0}
   .user{background:var(--user)} .assistant{background:var(--assistant)} .system{background:var(--panel2);color:var(--text)}
+  .live .liveLog{font-size:12px;color:var(--muted);max-height:180px;overflow:auto}
+  .live .liveLog div.error{color:var(--bad)}
+  .live .livePartial{margin-top:8px}
+  .live .livePartial:empty{display:none}
+  .live .liveOut{margin:0;font:12px/1.4 ui-monospace,SFMono-Regular,Menlo,monospace;white-space:pre-wrap;max-height:240px;overflow:auto}
+  .live .liveOut:empty{display:none}
+  .profile{margin-top:10px;overflow:auto}
+  .profile table{border-collapse:collapse;font:12px/1.4 ui-monospace,SFMono-Regular,Menlo,monospace;margin:6px 0}
+  .profile th{text-align:left;color:var(--muted);font-weight:600}
+  .profile th,.profile td{padding:2px 10px 2px 0;white-space:nowrap}
 
   .bar{padding:10px 12px;border-top:1px solid var(--border);background:var(--panel);display:flex;flex-direction:column;gap:8px;align-items:stretch;position:relative;z-index:20}
   textarea#prompt{width:100%;min-height:138px;max-height:280px;resize:vertical;padding:12px;border:1px solid var(--border);border-radius:10px;background:#0f1320;color:var(--text)}
@@ -355,6 +507,8 @@ HTML = r'''<!doctype html>
   pre{background:var(--code);border:1px solid #1e2534;border-radius:10px;padding:12px;overflow:auto;margin:8px 0 0 0}
   body.light pre{border-color:#d6ddeb}
   code{font-family:ui-monospace,SFMono-Regular,Menlo,Consolas,monospace;font-size:13px}
+  .syntaxError{color:var(--bad);font-size:12px;margin-bottom:6px}
+  .syntaxError code{font:12px ui-monospace,SFMono-Regular,Menlo,monospace}
   .codeHeader{display:flex;gap:8px;justify-content:flex-end;margin-top:6px;flex-wrap:wrap}
   .codeBtn{border:1px solid var(--border);background:#1c2232;color:#cfe0ff;border-radius:6px;padding:3px 9px;font-size:12px;cursor:pointer}
   body.light .codeBtn{background:#eaf0ff;color:#14376f}
@@ -387,6 +541,21 @@ HTML = r'''<!doctype html>
   .modalGrid{display:grid;grid-template-columns:160px 1fr;gap:10px 12px;align-items:center}
   .modalGrid input,.modalGrid select{width:100%;height:36px;padding:0 10px;border:1px solid var(--border);border-radius:10px;background:#0f1320;color:var(--text)}
   .modalHint{font-size:12px;color:var(--muted);margin-top:10px}
+  .diagBody{max-height:60vh;overflow:auto}
+  details.timing{margin-top:4px;font-size:11px;color:var(--muted)}
+  .route{margin:-2px 0 6px;font-size:11px;color:var(--muted)}
+  details.timing summary{cursor:pointer;list-style:none;opacity:.8}
+  details.timing summary::-webkit-details-marker{display:none}
+  .timingRow{display:grid;grid-template-columns:150px 70px 1fr;gap:8px;align-items:center;padding:1px 0}
+  .timingRow .v{text-align:right;font-family:ui-monospace,SFMono-Regular,Menlo,monospace}
+  .timingRow .bar{position:relative;height:6px;background:var(--panel2);border-radius:3px}
+  .timingRow .bar i{position:absolute;top:0;bottom:0;background:var(--accent);border-radius:3px;opacity:.7}
+  .logText{max-height:60vh;overflow:auto;margin:0;font:12px/1.4 ui-monospace,SFMono-Regular,Menlo,monospace;white-space:pre-wrap;word-break:break-word}
+  .diagSection{font-weight:600;margin:12px 0 6px 0}
+  .diagSection:first-child{margin-top:0}
+  .diagRow{display:grid;grid-template-columns:160px 1fr;gap:12px;font-size:12px;padding:2px 0}
+  .diagRow .k{color:var(--muted)}
+  .diagRow .v{font-family:ui-monospace,SFMono-Regular,Menlo,monospace;white-space:pre-wrap;word-break:break-word}
   .modalActions{display:flex;justify-content:flex-end;gap:8px;margin-top:16px}
 </style>
 </head>
@@ -395,10 +564,12 @@ HTML = r'''<!doctype html>
   <div class="top">
     <div class="titleRow">
       <div class="title" title="Direct = Codex + Glyphs MCP / Code = return editable Glyphs Python">GlyphsGPT with Chat</div>
+      <span id="mcpDot" class="mcpDot" title="Glyphs MCP: checking…"></span>
       <div class="muted subtitle">Direct = Codex + Glyphs MCP / Code = return editable Glyphs Python</div>
     </div>
     <div class="spacer"></div>
     <div class="topActions">
+      <button id="diagBtn" class="btn icon" title="Diagnostics" aria-label="Diagnostics">ⓘ</button>
       <button id="settingsBtn" class="btn icon" title="Settings" aria-label="Settings">⚙︎</button>
       <button id="clearBtn" class="btn compact">Clear Tab</button>
       <button id="openMacroBtn" class="btn compact">Open Macro</button>
@@ -419,8 +590,9 @@ HTML = r'''<!doctype html>
     </div>
     <div class="advancedBar">
       <div class="field"><span class="muted">Server</span><input id="server" class="small" type="text"/></div>
-      <div class="field"><span class="muted">Model</span><input id="model" class="small" type="text" placeholder="default"/></div>
+      <div class="field"><span class="muted">Model</span><input id="model" class="small" type="text" placeholder="default · auto"/></div>
       <label class="check"><input id="copyToMacro" type="checkbox"/>Copy code to Macro</label>
+      <label class="check" title="Send outlines, components, anchors and metrics of the selected layers with each prompt"><input id="geometryContext" type="checkbox"/>Send selection outlines</label>
       <div class="muted" id="providerBadge"></div>
       <div class="spacer"></div>
       <button id="sendBtnTop" class="btn mini">Send</button>
@@ -437,6 +609,7 @@ HTML = r'''<!doctype html>
         <div id="status" class="status">Ready</div>
       </div>
       <div class="rightActions">
+        <button id="stopBtn" class="btn" style="display:none">Stop</button>
         <button id="sendBtn" class="btn">Send</button>
       </div>
     </div>
@@ -459,7 +632,7 @@ HTML = r'''<!doctype html>
       </select>
 
       <div class="muted">Model</div>
-      <input id="settingsModel" type="text" placeholder="Model name"/>
+      <input id="settingsModel" type="text" placeholder="Model name · &quot;auto&quot; = pick per prompt"/>
 
       <div class="muted" id="settingsReasoningLabel">Reasoning</div>
       <select id="settingsReasoning"></select>
@@ -475,6 +648,9 @@ HTML = r'''<!doctype html>
 
       <div class="muted">API Key</div>
       <input id="settingsApiKey" type="password" placeholder="Stored locally for this script" autocomplete="off"/>
+
+      <div class="muted">Summary Model</div>
+      <input id="settingsSummaryModel" type="text" placeholder="Same as Model · &quot;local&quot; = no API call"/>
     </div>
     <div class="modalHint" id="settingsHint">Codex uses the local CLI. OpenAI-compatible can point to LM Studio / Ollama-compatible gateways.</div>
     <div class="modalActions">
@@ -484,6 +660,34 @@ HTML = r'''<!doctype html>
   </div>
 </div>
 
+<div id="diagOverlay" class="modalOverlay">
+  <div class="modalCard">
+    <div class="modalHead">
+      <div class="modalTitle">Diagnostics</div>
+      <div class="muted">Since this window was opened.</div>
+    </div>
+    <div id="diagBody" class="diagBody"></div>
+    <div class="modalActions">
+      <button id="diagRefresh" class="btn">Refresh</button>
+      <button id="diagClose" class="btn">Close</button>
+    </div>
+  </div>
+</div>
+
+<div id="logOverlay" class="modalOverlay">
+  <div class="modalCard">
+    <div class="modalHead">
+      <div class="modalTitle">Execution log</div>
+      <div class="muted" id="logInfo"></div>
+    </div>
+    <pre id="logText" class="logText"></pre>
+    <div class="modalActions">
+      <button id="logMore" class="btn">Load more</button>
+      <button id="logClose" class="btn">Close</button>
+    </div>
+  </div>
+</div>
+
 <script>
 const chatEl = document.getElementById('chat');
 const promptEl = document.getElementById('prompt');
@@ -493,7 +697,9 @@ const modeCodeEl = document.getElementById('modeCode');
 const serverEl = document.getElementById('server');
 const modelEl = document.getElementById('model');
 const copyToMacroEl = document.getElementById('copyToMacro');
+const geometryContextEl = document.getElementById('geometryContext');
 const sendBtn = document.getElementById('sendBtn');
+const stopBtn = document.getElementById('stopBtn');
 const sendBtnTop = document.getElementById('sendBtnTop');
 const blankSnippetBtn = document.getElementById('blankSnippetBtn');
 const tabbar = document.getElementById('tabbar');
@@ -506,9 +712,13 @@ const settingsReasoningEl = document.getElementById('settingsReasoning');
 const settingsThemeEl = document.getElementById('settingsTheme');
 const settingsApiBaseEl = document.getElementById('settingsApiBase');
 const settingsApiKeyEl = document.getElementById('settingsApiKey');
+const settingsSummaryModelEl = document.getElementById('settingsSummaryModel');
 const settingsHintEl = document.getElementById('settingsHint');
 const advancedLabelEl = document.getElementById('advancedLabel');
-let state = {mode:'direct', server:'glyphs-mcp-server', model:'', copyToMacro:false, provider:'codex', apiBase:'', apiKey:'', theme:'dark', reasoning:'auto'};
+const mcpDotEl = document.getElementById('mcpDot');
+const diagOverlay = document.getElementById('diagOverlay');
+const diagBodyEl = document.getElementById('diagBody');
+let state = {mode:'direct', server:'glyphs-mcp-server', model:'', copyToMacro:false, geometryContext:false, provider:'codex', apiBase:'', apiKey:'', summaryModel:'', theme:'dark', reasoning:'auto'};
 let tabInfo = {names:['Chat 1'], active:0};
 let __clickTimer = null;
 
@@ -696,6 +906,7 @@ function codeBlockHtml(code){
   return ''
     + '<div class="codeHeader" data-raw="'+encoded+'">'
     +   '<button class="codeBtn" data-run="1">Run</button>'
+    +   '<button class="codeBtn" data-profile="1" title="Run under cProfile · Option-click to also trace memory">Profile</button>'
     +   '<button class="codeBtn" data-copy="1">Copy</button>'
     +   '<button class="codeBtn" data-copy-macro="1">Copy to Macro</button>'
     + '</div>'
@@ -717,6 +928,7 @@ function mdToHtml(md){
       html += ''
         + '<div class="codeHeader" data-raw="'+encoded+'">'
         +   '<button class="codeBtn" data-run="1">Run</button>'
+        +   '<button class="codeBtn" data-profile="1" title="Run under cProfile · Option-click to also trace memory">Profile</button>'
         +   '<button class="codeBtn" data-copy="1">Copy</button>'
         +   '<button class="codeBtn" data-copy-macro="1">Copy to Macro</button>'
         + '</div>'
@@ -755,12 +967,120 @@ function addBubbleHtml(role, html, id){
 }
 function addUser(text, id){ addBubbleHtml('user', esc(text), id); }
 function addText(role, text, id){ const t = String(text || '').trim(); if (!t) return; if (role === 'assistant') addBubbleHtml('assistant', mdToHtml(t), id); else addBubbleHtml(role, esc(t).replace(/\n/g,'<br>'), id); }
-function addCode(role, code, id){ addBubbleHtml(role, codeBlockHtml(code || ''), id); }
+function addCode(role, code, id, syntaxError){
+  let html = codeBlockHtml(code || '');
+  if (syntaxError) html = '<div class="syntaxError">Syntax error' + (syntaxError.line ? ' on line ' + syntaxError.line : '') + ': ' + esc(syntaxError.message || '') + (syntaxError.text ? '<br><code>' + esc(syntaxError.text) + '</code>' : '') + '</div>' + html;
+  addBubbleHtml(role, html, id);
+}
+function fmtBytes(n){ n = Number(n || 0); return n >= 1048576 ? (n / 1048576).toFixed(1) + ' MB' : (n / 1024).toFixed(1) + ' KB'; }
+function profileTableHtml(p){
+  let html = '<div class="profile"><div class="muted">Profile · ' + Number(p.totalTime || 0).toFixed(3) + ' s · ' + (p.functionCount || 0) + ' functions'
+    + (p.peakMemory !== undefined ? ' · peak ' + fmtBytes(p.peakMemory) : '') + '</div>'
+    + '<table><tr><th>cumtime</th><th>tottime</th><th>calls</th><th>function</th></tr>';
+  (p.functions || []).forEach(function(r){ html += '<tr><td>' + Number(r.cumtime).toFixed(4) + '</td><td>' + Number(r.tottime).toFixed(4) + '</td><td>' + esc(String(r.calls)) + '</td><td>' + esc(r.function) + '</td></tr>'; });
+  html += '</table>';
+  if (p.allocations && p.allocations.length) {
+    html += '<table><tr><th>size</th><th>blocks</th><th>allocation site</th></tr>';
+    p.allocations.forEach(function(a){ html += '<tr><td>' + fmtBytes(a.size) + '</td><td>' + a.count + '</td><td>' + esc(a.site) + '</td></tr>'; });
+    html += '</table>';
+  }
+  if (p.statsFile) html += '<div class="muted">Raw stats: ' + esc(p.statsFile) + '</div>';
+  return html + '</div>';
+}
+function addSystemItem(text, id, meta){
+  let html = esc(String(text || '').trim()).replace(/\n/g,'<br>');
+  if (meta && meta.log && meta.log.path) html += '<div class="codeHeader"><button class="codeBtn" data-open-log="' + esc(meta.log.path) + '">Open full log (' + fmtTokens(meta.log.chars) + ' characters)</button></div>';
+  if (meta && meta.profile) html += profileTableHtml(meta.profile);
+  addBubbleHtml('system', html, id);
+}
+let liveEl = null;
+function liveProgress(data){
+  if (!liveEl) {
+    liveEl = createMsgShell('progress', '');
+    const close = liveEl.querySelector('.msgClose'); if (close) close.remove();
+    const bubble = document.createElement('div');
+    bubble.className = 'bubble system live';
+    bubble.innerHTML = '<div class="liveLog"></div><pre class="liveOut"></pre><div class="livePartial"></div>';
+    liveEl.appendChild(bubble);
+    chatEl.appendChild(liveEl);
+  }
+  const kind = data.kind || 'tool', text = String(data.text || '');
+  if (kind === 'partial') liveEl.querySelector('.livePartial').textContent = text;
+  else if (kind === 'output') {
+    const out = liveEl.querySelector('.liveOut');
+    out.textContent = (out.textContent + text).slice(-20000);
+    out.scrollTop = out.scrollHeight;
+  }
+  else if (text) {
+    const log = liveEl.querySelector('.liveLog');
+    const line = document.createElement('div');
+    line.className = kind;
+    line.textContent = text;
+    log.appendChild(line);
+    while (log.childNodes.length > 200) log.removeChild(log.firstChild);
+    log.scrollTop = log.scrollHeight;
+    if (kind === 'tool' || kind === 'batch') statusEl.textContent = 'Running… ' + text;
+  }
+  chatEl.scrollTop = chatEl.scrollHeight;
+}
+function endProgress(){ if (liveEl) liveEl.remove(); liveEl = null; }
+function setMcpStatus(data){
+  const alive = data.alive;
+  mcpDotEl.classList.toggle('up', alive === true);
+  mcpDotEl.classList.toggle('down', alive === false);
+  let title = 'Glyphs MCP: ' + (alive === true ? 'running' : (alive === false ? 'not responding' : 'checking…'));
+  if (data.url) title += '\n' + data.url;
+  if (alive === true && data.latencyMs !== null && data.latencyMs !== undefined) title += '\n' + data.latencyMs + ' ms';
+  mcpDotEl.title = title;
+}
+function timedRender(traceId, render){
+  const t0 = performance.now();
+  render();
+  if (!traceId) return;
+  requestAnimationFrame(function(){
+    const ms = performance.now() - t0;
+    if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'rendered', traceId:traceId, ms:ms});
+  });
+}
+function fmtMs(ms){ ms = Number(ms || 0); return ms >= 1000 ? (ms / 1000).toFixed(2) + ' s' : ms.toFixed(ms < 10 ? 1 : 0) + ' ms'; }
+function setRoute(id, route){
+  if (!id || !route) return;
+  const wrap = chatEl.querySelector('.msg[data-msg-id="' + id + '"]');
+  if (!wrap || wrap.querySelector('.route')) return;
+  const role = wrap.querySelector('.msgRole');
+  if (role) role.textContent = 'assistant · ' + (route.model || '');
+  const el = document.createElement('div');
+  el.className = 'route';
+  el.textContent = 'auto: ' + (route.reason || '');
+  const head = wrap.querySelector('.msgHead');
+  if (head && head.nextSibling) wrap.insertBefore(el, head.nextSibling); else wrap.appendChild(el);
+}
+function fmtTokens(n){ n = Number(n || 0); return n >= 1e6 ? (n / 1e6).toFixed(1) + 'M' : n >= 1000 ? (n / 1000).toFixed(1) + 'k' : String(n); }
+function setTiming(id, timing, u){
+  if (!id || !timing) return;
+  const wrap = chatEl.querySelector('.msg[data-msg-id="' + id + '"]');
+  if (!wrap) return;
+  const old = wrap.querySelector('details.timing'); if (old) old.remove();
+  const total = Number(timing.total || 0) || 1;
+  let rows = '';
+  (timing.spans || []).forEach(function(s){
+    const left = Math.min(100, 100 * s.start / total), width = Math.max(0.5, Math.min(100 - left, 100 * s.ms / total));
+    rows += '<div class="timingRow"><span class="k">' + esc(s.name) + '</span><span class="v">' + fmtMs(s.ms) + '</span><span class="bar"><i style="left:' + left.toFixed(2) + '%;width:' + width.toFixed(2) + '%"></i></span></div>';
+  });
+  const details = document.createElement('details');
+  details.className = 'timing';
+  const tokens = u ? ' · ' + fmtTokens(u.input) + '→' + fmtTokens(u.output) + ' tokens' + (u.cost == null ? '' : ' · $' + Number(u.cost).toFixed(u.cost < 1 ? 4 : 2)) : '';
+  details.innerHTML = '<summary>' + fmtMs(timing.total) + ' · ' + esc(timing.provider || '') + esc(tokens) + '</summary>' + rows;
+  wrap.appendChild(details);
+}
 function hydrateHistory(items){
   chatEl.innerHTML = '';
+  liveEl = null;
   (items || []).forEach(item => {
     const role = item.role || 'assistant', kind = item.kind || 'text', content = item.content || '', id = item.id || '';
-    if (role === 'user') addUser(content, id); else if (kind === 'code') addCode(role, content, id); else addText(role, content, id);
+    if (role === 'user') addUser(content, id); else if (kind === 'code') addCode(role, content, id, item.meta && item.meta.syntaxError); else if (role === 'system' && item.meta) addSystemItem(content, id, item.meta); else addText(role, content, id);
+    if (item.meta && item.meta.route) setRoute(id, item.meta.route);
+    if (item.meta && item.meta.timing) setTiming(id, item.meta.timing, item.meta.usage);
   });
 }
 function syncProviderFields(selectedReasoning){
@@ -781,6 +1101,7 @@ function syncUI(){
   serverEl.value = state.server || 'glyphs-mcp-server';
   modelEl.value = state.model || '';
   copyToMacroEl.checked = !!state.copyToMacro;
+  geometryContextEl.checked = !!state.geometryContext;
   serverEl.disabled = !(state.mode === 'direct' && (state.provider === 'codex' || state.provider === 'openai_compat'));
   providerBadge.textContent = 'Provider: ' + providerLabel(state.provider || 'codex');
   if (advancedLabelEl) advancedLabelEl.textContent = 'Controls · ' + providerLabel(state.provider || 'codex');
@@ -791,13 +1112,13 @@ function renderTabs(info){
   names.forEach((name, i) => { const t = document.createElement('div'); t.className = 'tab' + (i === active ? ' active' : ''); t.setAttribute('data-idx', i); t.innerHTML = '<span class="tabLabel">'+esc(name || ('Chat ' + (i+1)))+'</span><span class="x" title="Close" data-close="'+i+'">×</span>'; tabbar.appendChild(t); });
   const plus = document.createElement('button'); plus.id = 'btnPlusTab'; plus.className = 'plus'; plus.textContent = '＋'; tabbar.appendChild(plus);
 }
-function openSettings(){ settingsProviderEl.value = state.provider || 'codex'; settingsModelEl.value = state.model || ''; settingsThemeEl.value = state.theme || 'dark'; settingsApiBaseEl.value = state.apiBase || ''; settingsApiKeyEl.value = state.apiKey || ''; syncProviderFields(state.reasoning || 'auto'); settingsOverlay.classList.add('open'); }
+function openSettings(){ settingsProviderEl.value = state.provider || 'codex'; settingsModelEl.value = state.model || ''; settingsThemeEl.value = state.theme || 'dark'; settingsApiBaseEl.value = state.apiBase || ''; settingsApiKeyEl.value = state.apiKey || ''; settingsSummaryModelEl.value = state.summaryModel || ''; syncProviderFields(state.reasoning || 'auto'); settingsOverlay.classList.add('open'); }
 function closeSettings(){ settingsOverlay.classList.remove('open'); }
 function sendAsk(){
   const prompt = (promptEl.value || '').trim(); if (!prompt) return;
-  state.server = serverEl.value.trim() || 'glyphs-mcp-server'; state.model = modelEl.value.trim(); state.copyToMacro = copyToMacroEl.checked;
+  state.server = serverEl.value.trim() || 'glyphs-mcp-server'; state.model = modelEl.value.trim(); state.copyToMacro = copyToMacroEl.checked; state.geometryContext = geometryContextEl.checked;
   promptEl.value = '';
-  if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'ask', prompt:prompt, mode:state.mode, server:state.server, model:state.model, copyToMacro:state.copyToMacro, provider:state.provider, apiBase:state.apiBase, apiKey:state.apiKey, theme:state.theme});
+  if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'ask', prompt:prompt, mode:state.mode, server:state.server, model:state.model, copyToMacro:state.copyToMacro, geometryContext:state.geometryContext, provider:state.provider, apiBase:state.apiBase, apiKey:state.apiKey, theme:state.theme});
 }
 function postBlankSnippet(){
   if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'blankSnippet'});
@@ -806,16 +1127,52 @@ modeDirectEl.onclick = function(){ state.mode = 'direct'; syncUI(); };
 modeCodeEl.onclick = function(){ state.mode = 'code'; syncUI(); };
 sendBtn.onclick = sendAsk; sendBtnTop.onclick = sendAsk;
 blankSnippetBtn.onclick = postBlankSnippet;
+stopBtn.onclick = function(){ if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'stop'}); };
 document.getElementById('clearBtn').onclick = function(){ if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'clearChat'}); };
 document.getElementById('openMacroBtn').onclick = function(){ if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'openMacro'}); };
 document.getElementById('settingsBtn').onclick = openSettings;
 document.getElementById('settingsCancel').onclick = closeSettings;
 document.getElementById('settingsSave').onclick = function(){
-  state.provider = settingsProviderEl.value; state.model = settingsModelEl.value.trim(); state.reasoning = settingsReasoningEl.value || 'auto'; state.theme = settingsThemeEl.value; state.apiBase = settingsApiBaseEl.value.trim(); state.apiKey = settingsApiKeyEl.value; modelEl.value = state.model || ''; syncUI(); closeSettings();
-  if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'saveSettings', settings:{provider:state.provider, model:state.model, reasoning:state.reasoning, theme:state.theme, apiBase:state.apiBase, apiKey:state.apiKey}});
+  state.provider = settingsProviderEl.value; state.model = settingsModelEl.value.trim(); state.reasoning = settingsReasoningEl.value || 'auto'; state.theme = settingsThemeEl.value; state.apiBase = settingsApiBaseEl.value.trim(); state.apiKey = settingsApiKeyEl.value; state.summaryModel = settingsSummaryModelEl.value.trim(); modelEl.value = state.model || ''; syncUI(); closeSettings();
+  if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'saveSettings', settings:{provider:state.provider, model:state.model, reasoning:state.reasoning, theme:state.theme, apiBase:state.apiBase, apiKey:state.apiKey, summaryModel:state.summaryModel}});
 };
 settingsProviderEl.onchange = syncProviderFields;
 settingsOverlay.addEventListener('click', function(e){ if (e.target === settingsOverlay) closeSettings(); });
+function requestDiagnostics(){ if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'getDiagnostics'}); }
+function renderDiagnostics(data){
+  diagBodyEl.innerHTML = '';
+  (data.sections || []).forEach(function(section){
+    const head = document.createElement('div'); head.className = 'diagSection'; head.textContent = section.title || ''; diagBodyEl.appendChild(head);
+    (section.rows || []).forEach(function(row){
+      const line = document.createElement('div'); line.className = 'diagRow';
+      const k = document.createElement('div'); k.className = 'k'; k.textContent = row[0];
+      const v = document.createElement('div'); v.className = 'v'; v.textContent = row[1];
+      line.appendChild(k); line.appendChild(v); diagBodyEl.appendChild(line);
+    });
+  });
+}
+const logOverlay = document.getElementById('logOverlay');
+const logTextEl = document.getElementById('logText');
+const logInfoEl = document.getElementById('logInfo');
+const logMoreEl = document.getElementById('logMore');
+let logState = {path:'', next:0};
+function requestLogPage(path, offset){ if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'readLog', path:path, offset:offset}); }
+function openLog(path){ logState = {path:path, next:0}; logTextEl.textContent = ''; logInfoEl.textContent = 'Loading…'; logMoreEl.disabled = true; logOverlay.classList.add('open'); requestLogPage(path, 0); }
+function showLogPage(data){
+  if (data.error) { logInfoEl.textContent = data.error; logMoreEl.disabled = true; return; }
+  if (data.offset === 0) logTextEl.textContent = '';
+  logTextEl.textContent += data.text || '';
+  logState.next = data.next || 0;
+  logInfoEl.textContent = fmtBytes(logState.next) + ' of ' + fmtBytes(data.size) + ' · ' + data.path;
+  logMoreEl.disabled = logState.next >= (data.size || 0);
+}
+logMoreEl.onclick = function(){ if (logState.path) requestLogPage(logState.path, logState.next); };
+document.getElementById('logClose').onclick = function(){ logOverlay.classList.remove('open'); logTextEl.textContent = ''; };
+logOverlay.addEventListener('click', function(e){ if (e.target === logOverlay) { logOverlay.classList.remove('open'); logTextEl.textContent = ''; } });
+document.getElementById('diagBtn').onclick = function(){ diagOverlay.classList.add('open'); requestDiagnostics(); };
+document.getElementById('diagRefresh').onclick = requestDiagnostics;
+document.getElementById('diagClose').onclick = function(){ diagOverlay.classList.remove('open'); };
+diagOverlay.addEventListener('click', function(e){ if (e.target === diagOverlay) diagOverlay.classList.remove('open'); });
 promptEl.addEventListener('keydown', function(e){ if ((e.metaKey || e.ctrlKey) && e.shiftKey && e.key === 'Enter') { e.preventDefault(); postBlankSnippet(); return; } if ((e.metaKey || e.ctrlKey) && e.key === 'Enter') sendAsk(); });
 
 tabbar.addEventListener('click', function(e){
@@ -854,10 +1211,12 @@ chatEl.addEventListener('click', function(e){
   }
 
   let t = e.target; while (t && !t.classList.contains('codeBtn')) t = t.parentNode; if (!t) return;
+  if (t.getAttribute('data-open-log') !== null) { openLog(t.getAttribute('data-open-log')); return; }
   const header = t.closest('.codeHeader'); const next = header ? header.nextElementSibling : null; const raw = decodeURIComponent((header && header.getAttribute('data-raw')) || '');
   if (t.getAttribute('data-copy') !== null) { copyText(getCodeFromRendered(header)); return; }
   if (t.getAttribute('data-copy-macro') !== null) { const code = getCodeFromRendered(header); if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'copyToMacro', code:code}); return; }
   if (t.getAttribute('data-run') !== null) { const code = getCodeFromRendered(header); if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'exec', code:code}); return; }
+  if (t.getAttribute('data-profile') !== null) { const code = getCodeFromRendered(header); if (window.webkit && window.webkit.messageHandlers && window.webkit.messageHandlers.bridge) window.webkit.messageHandlers.bridge.postMessage({type:'exec', code:code, profile:true, traceMemory:!!e.altKey}); return; }
 });
 
 window.__fromNative = function(msg){
@@ -865,12 +1224,17 @@ window.__fromNative = function(msg){
   if (type === 'state') { state = Object.assign({}, state, data || {}); syncUI(); }
   else if (type === 'tabs') renderTabs(data);
   else if (type === 'hydrate') hydrateHistory(data.history || []);
-  else if (type === 'busy') { sendBtn.disabled = !!data.busy; sendBtnTop.disabled = !!data.busy; blankSnippetBtn.disabled = !!data.busy; statusEl.textContent = data.message || (data.busy ? 'Running…' : 'Ready'); }
-  else if (type === 'answerText') addText('assistant', data.text || '', data.id || '');
-  else if (type === 'answerCode') addCode('assistant', data.code || '', data.id || '');
+  else if (type === 'progress') liveProgress(data);
+  else if (type === 'mcpStatus') setMcpStatus(data);
+  else if (type === 'diagnostics') renderDiagnostics(data);
+  else if (type === 'logPage') showLogPage(data);
+  else if (type === 'busy') { if (!data.busy) endProgress(); stopBtn.style.display = data.stoppable ? '' : 'none'; sendBtn.disabled = !!data.busy; sendBtnTop.disabled = !!data.busy; blankSnippetBtn.disabled = !!data.busy; statusEl.textContent = data.message || (data.busy ? 'Running…' : 'Ready'); }
+  else if (type === 'answerText') timedRender(data.traceId, function(){ addText('assistant', data.text || '', data.id || ''); setRoute(data.id, data.route); });
+  else if (type === 'answerCode') timedRender(data.traceId, function(){ addCode('assistant', data.code || '', data.id || '', data.syntaxError); setRoute(data.id, data.route); });
+  else if (type === 'timing') setTiming(data.id, data.timing, data.usage);
   else if (type === 'system') addText('system', data.text || '', data.id || '');
   else if (type === 'error') addText('assistant', 'ERROR\n' + (data.message || ''), data.id || '');
-  else if (type === 'execResult') { const out = String(data.output || '').trim(); if (out) addText('system', 'Execution output\n' + out, data.id || ''); }
+  else if (type === 'execResult') { const out = String(data.output || '').trim(); if (out) addSystemItem('Execution output\n' + out, data.id || '', data.meta); }
 };
 
 syncUI();
@@ -890,6 +1254,48 @@ def ensure_dir(path):
         os.makedirs(path)
 
 
+class BackgroundJsonWriter(object):
+    """Rewrites one JSON file atomically off the calling thread.
+
+    schedule() marks the file stale; a background write (after `delay`
+    seconds) calls dump() for the current text, so several changes in a row
+    cost one serialization and one write.
+    """
+
+    def __init__(self, path, dump, delay=0.0):
+        self.path = path
+        self.dump = dump
+        self.delay = float(delay or 0.0)
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self._scheduled = False
+
+    def schedule(self):
+        with self.lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        worker = threading.Timer(self.delay, self.flush) if self.delay else threading.Thread(target=self.flush)
+        worker.daemon = True
+        worker.start()
+
+    def flush(self):
+        with self.writeLock:
+            with self.lock:
+                if not self._scheduled:
+                    return
+                self._scheduled = False
+            try:
+                text = self.dump()
+                ensure_dir(os.path.dirname(self.path))
+                tmp = self.path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp, self.path)
+            except Exception:
+                pass
+
+
 def objc_to_py(x):
     if x is None or isinstance(x, NSNull):
         return None
@@ -951,6 +1357,2855 @@ def extract_code_block(text):
     return text.strip()
 
 
+# --- run tracing ------------------------------------------------------------
+_TRACE_LOCAL = threading.local()
+
+
+class RunTrace(object):
+    """Monotonic spans for one ask, from handle_ask to the rendered answer.
+
+    Span starts are milliseconds since the trace began, so spans recorded on
+    the worker thread, the main thread and in JS line up on one time axis.
+    """
+
+    def __init__(self, provider="", mode=""):
+        self.id = uuid.uuid4().hex[:12]
+        self.provider = provider
+        self.mode = mode
+        self.t0 = time.monotonic()
+        self.wall = time.time()
+        self.spans = []
+        self.worker_done = None
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end=None):
+        end = time.monotonic() if end is None else end
+        with self.lock:
+            self.spans.append({"name": name, "start": round((start - self.t0) * 1000.0, 2), "ms": round((end - start) * 1000.0, 2)})
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        total = max([s["start"] + s["ms"] for s in spans] or [0.0])
+        return {"id": self.id, "provider": self.provider, "mode": self.mode, "started": self.wall, "total": round(total, 2), "spans": spans}
+
+
+class AskRun(object):
+    """Per-ask state handed from handle_ask to the worker thread and on to _finish_run.
+
+    Kept off the app instance so a late _finish_run from an earlier ask can
+    never pick up the trace, route or usage of the ask that followed it.
+    """
+
+    def __init__(self, ses, trace=None, route=None):
+        self.ses = ses
+        self.trace = trace
+        self.route = route
+        self.meter = RunUsage()
+        self.note = ""
+        self.stopped = False
+        self.sessionTurn = False
+
+
+def current_run():
+    return getattr(_TRACE_LOCAL, "run", None)
+
+
+def set_current_run(run):
+    _TRACE_LOCAL.run = run
+    _TRACE_LOCAL.trace = run.trace if run is not None else None
+    set_current_usage(run.meter if run is not None else None)
+
+
+def current_trace():
+    return getattr(_TRACE_LOCAL, "trace", None)
+
+
+def set_current_trace(trace):
+    _TRACE_LOCAL.trace = trace
+
+
+@contextlib.contextmanager
+def trace_span(name):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+_TRACE_WRITE_LOCK = threading.Lock()
+
+
+def append_trace_record(record, path=TRACE_PATH):
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    # Closes from several threads must not interleave lines or append to a file being rotated.
+    with _TRACE_WRITE_LOCK:
+        try:
+            ensure_dir(os.path.dirname(path))
+            if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_BYTES:
+                os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except Exception:
+            pass
+
+
+# --- record / replay cassettes -----------------------------------------------
+class Cassette(object):
+    """Records HTTP, MCP and Codex exchanges to a gzipped JSONL file and plays them back.
+
+    Each line is one exchange: kind, URL, redacted request, response (or error
+    text), and how long it took. Replay matches on kind, URL and request body;
+    when nothing matches exactly (the prompt carries font context that may
+    differ), the next unplayed exchange for the same kind and URL is used.
+    """
+
+    def __init__(self, path, mode, speed=1.0):
+        self.path = path
+        self.mode = mode
+        self.speed = float(speed or 0.0)
+        self.lock = threading.Lock()
+        self.t0 = time.monotonic()
+        self.recorded = 0
+        self.played = 0
+        self.misses = 0
+        self._byKey = {}
+        self._byUrl = {}
+        self._used = set()
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "rt", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                entry["_n"] = index
+                self._byKey.setdefault(entry["key"], []).append(entry)
+                self._byUrl.setdefault((entry["kind"], entry["url"]), []).append(entry)
+
+    @staticmethod
+    def _secrets(headers):
+        out = []
+        for name, value in (headers or {}).items():
+            if str(name).lower() in CASSETTE_SECRET_HEADERS and value:
+                value = str(value)
+                out.append(value)
+                if value.lower().startswith("bearer "):
+                    out.append(value[7:].strip())
+        return sorted(set(v for v in out if len(v) >= 8), key=len, reverse=True)
+
+    @staticmethod
+    def _scrub(obj, secrets):
+        if not secrets:
+            return obj
+        text = json.dumps(obj, ensure_ascii=False)
+        for secret in secrets:
+            text = text.replace(json.dumps(secret)[1:-1], "REDACTED")
+        return json.loads(text)
+
+    @staticmethod
+    def _key(kind, url, request):
+        body = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(("%s %s\n%s" % (kind, url, body)).encode("utf-8")).hexdigest()
+
+    def exchange(self, kind, url, request, headers, live, error_cls=RuntimeError):
+        secrets = self._secrets(headers)
+        url = self._scrub(url, secrets)
+        request = self._scrub(request, secrets)
+        key = self._key(kind, url, request)
+        if self.mode == "replay":
+            return self._play(kind, url, key, error_cls)
+        started = time.monotonic()
+        error = None
+        response = None
+        try:
+            response = live()
+            return response
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._record({
+                "kind": kind, "url": url, "key": key, "request": request,
+                "headers": self._scrub({k: ("REDACTED" if str(k).lower() in CASSETTE_SECRET_HEADERS else v) for k, v in (headers or {}).items()}, secrets),
+                "response": self._scrub(response, secrets) if error is None else None,
+                "error": self._scrub(error, secrets) if error is not None else None,
+                "at": round((started - self.t0) * 1000.0, 1),
+                "ms": round((time.monotonic() - started) * 1000.0, 1),
+            })
+
+    def _record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self.lock:
+            ensure_dir(os.path.dirname(self.path))
+            opener = gzip.open if self.path.endswith(".gz") else open
+            with opener(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            self.recorded += 1
+
+    def _play(self, kind, url, key, error_cls):
+        with self.lock:
+            entry = None
+            for candidate in self._byKey.get(key, []):
+                if candidate["_n"] not in self._used:
+                    entry = candidate
+                    break
+            if entry is None:
+                for candidate in self._byUrl.get((kind, url), []):
+                    if candidate["_n"] not in self._used:
+                        entry = candidate
+                        break
+            if entry is None:
+                # Exhausted: repeat the last recording for this request, if any.
+                entry = (self._byKey.get(key) or self._byUrl.get((kind, url)) or [None])[-1]
+            if entry is None:
+                self.misses += 1
+                raise error_cls("Cassette %s has no recording for %s %s" % (os.path.basename(self.path), kind, url))
+            self._used.add(entry["_n"])
+            self.played += 1
+        if self.speed > 0:
+            time.sleep(float(entry.get("ms") or 0.0) / 1000.0 / self.speed)
+        if entry.get("error") is not None:
+            raise error_cls(entry["error"])
+        return copy.deepcopy(entry.get("response"))
+
+    def snapshot(self):
+        return {"mode": self.mode, "path": self.path, "speed": self.speed, "recorded": self.recorded, "played": self.played, "misses": self.misses,
+                "available": sum(len(v) for v in self._byKey.values())}
+
+
+_CASSETTE = None
+_CASSETTE_LOCK = threading.Lock()
+
+
+def active_cassette():
+    global _CASSETTE
+    if CASSETTE_MODE not in ("record", "replay"):
+        return None
+    if _CASSETTE is None:
+        with _CASSETTE_LOCK:
+            if _CASSETTE is None:
+                _CASSETTE = Cassette(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_SPEED)
+    return _CASSETTE
+
+
+# --- token usage ------------------------------------------------------------
+_USAGE_LOCAL = threading.local()
+_USAGE_FIELDS = ("input", "cached", "output", "reasoning")
+
+
+def normalize_usage(res):
+    """Token counts from a Responses, Chat Completions, Anthropic, LM Studio or Codex payload.
+
+    `input` always includes cached prompt tokens, so cost is
+    (input - cached) * input price + cached * cached price + output * output price.
+    """
+    if not isinstance(res, dict):
+        return None
+    u = res.get("usage") or res.get("stats") or res.get("tokenUsage") or {}
+    if isinstance(u, dict) and isinstance(u.get("last"), dict):
+        u = u["last"]
+    if not isinstance(u, dict) or not u:
+        return None
+
+    def _n(*keys, src=None):
+        src = u if src is None else src
+        for key in keys:
+            try:
+                if src.get(key) is not None:
+                    return int(src.get(key) or 0)
+            except Exception:
+                pass
+        return 0
+
+    inDetails = u.get("input_tokens_details") or u.get("prompt_tokens_details") or {}
+    outDetails = u.get("output_tokens_details") or u.get("completion_tokens_details") or {}
+    cacheRead = _n("cache_read_input_tokens")
+    out = {
+        "input": _n("input_tokens", "prompt_tokens", "inputTokens"),
+        "cached": _n("cached_tokens", src=inDetails) or cacheRead or _n("cached_input_tokens", "cachedInputTokens"),
+        "output": _n("output_tokens", "completion_tokens", "total_output_tokens", "outputTokens"),
+        "reasoning": _n("reasoning_tokens", src=outDetails) or _n("reasoning_output_tokens", "reasoningOutputTokens"),
+    }
+    if "cache_read_input_tokens" in u or "cache_creation_input_tokens" in u:
+        # Anthropic reports cache reads and writes separately from input_tokens.
+        out["input"] += cacheRead + _n("cache_creation_input_tokens")
+    return out if any(out.values()) else None
+
+
+class RunUsage(object):
+    """Sums token usage over every provider call made for one ask."""
+
+    def __init__(self):
+        self.calls = 0
+        self.totals = dict.fromkeys(_USAGE_FIELDS, 0)
+        self.lock = threading.Lock()
+
+    def add(self, usage):
+        if not usage:
+            return
+        with self.lock:
+            self.calls += 1
+            for key in _USAGE_FIELDS:
+                self.totals[key] += int(usage.get(key) or 0)
+
+    def to_dict(self):
+        with self.lock:
+            return dict(self.totals, calls=self.calls) if self.calls else None
+
+
+def current_usage():
+    return getattr(_USAGE_LOCAL, "usage", None)
+
+
+def set_current_usage(usage):
+    _USAGE_LOCAL.usage = usage
+
+
+def record_usage(res):
+    meter = current_usage()
+    if meter is not None:
+        meter.add(normalize_usage(res))
+
+
+_PRICES = None
+
+
+def load_prices(path=PRICES_PATH):
+    global _PRICES
+    prices = dict(PRICE_TABLE)
+    try:
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for model, row in (json.load(f) or {}).items():
+                    if isinstance(row, (list, tuple)) and len(row) == 3:
+                        prices[str(model).lower()] = tuple(float(v) for v in row)
+    except Exception:
+        pass
+    _PRICES = prices
+    return prices
+
+
+def price_for(model):
+    prices = _PRICES if _PRICES is not None else load_prices()
+    name = str(model or "").strip().lower()
+    best = None
+    for prefix in prices:
+        if name.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return prices[best] if best is not None else None
+
+
+def usage_cost(usage, model, local=False):
+    """USD for `usage`, 0.0 for local servers, None when the model has no price."""
+    if not usage:
+        return 0.0
+    if local:
+        return 0.0
+    price = price_for(model)
+    if price is None:
+        return None
+    fresh = max(0, usage["input"] - usage["cached"])
+    return (fresh * price[0] + usage["cached"] * price[1] + usage["output"] * price[2]) / 1e6
+
+
+def fmt_tokens(n):
+    n = int(n or 0)
+    if n >= 1000000:
+        return "%.1fM" % (n / 1e6)
+    if n >= 1000:
+        return "%.1fk" % (n / 1e3)
+    return str(n)
+
+
+def fmt_cost(cost):
+    if cost is None:
+        return "no price"
+    return "$%.4f" % cost if cost < 1 else "$%.2f" % cost
+
+
+class UsageLedger(object):
+    """Running token and cost totals per tab, per provider/model and per day, kept in a small JSON file."""
+
+    def __init__(self, path=USAGE_PATH):
+        self.path = path
+        self.data = {"tabs": {}, "models": {}, "days": {}}
+        self.lock = threading.Lock()
+        self.writer = BackgroundJsonWriter(path, self._dump)
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.isfile(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f) or {}
+                for key in self.data:
+                    if isinstance(data.get(key), dict):
+                        self.data[key] = data[key]
+        except Exception:
+            pass
+
+    def _dump(self):
+        with self.lock:
+            return json.dumps(self.data, ensure_ascii=False)
+
+    @staticmethod
+    def _bump(bucket, usage, cost):
+        for key in _USAGE_FIELDS + ("calls",):
+            bucket[key] = int(bucket.get(key) or 0) + int(usage.get(key) or 0)
+        bucket["asks"] = int(bucket.get("asks") or 0) + 1
+        if cost is None:
+            bucket["unpriced"] = int(bucket.get("unpriced") or 0) + 1
+        else:
+            bucket["cost"] = float(bucket.get("cost") or 0.0) + cost
+
+    def add(self, tab_sid, tab_name, provider, model, usage, cost):
+        day = time.strftime("%Y-%m-%d")
+        with self.lock:
+            tab = self.data["tabs"].setdefault(tab_sid, {})
+            tab["name"] = tab_name
+            self._bump(tab, usage, cost)
+            model_key = "%s · %s" % (provider, model or "(default)")
+            self._bump(self.data["models"].setdefault(model_key, {}), usage, cost)
+            self._bump(self.data["days"].setdefault(day, {}), usage, cost)
+            for old in sorted(self.data["days"])[:-USAGE_KEEP_DAYS]:
+                self.data["days"].pop(old, None)
+        self.writer.schedule()
+
+    def snapshot(self):
+        with self.lock:
+            return copy.deepcopy(self.data)
+
+
+def usage_summary(bucket):
+    text = "%d ask(s) · %s in (%s cached) / %s out" % (
+        int(bucket.get("asks") or 0), fmt_tokens(bucket.get("input")), fmt_tokens(bucket.get("cached")), fmt_tokens(bucket.get("output")))
+    if bucket.get("reasoning"):
+        text += " (%s reasoning)" % fmt_tokens(bucket.get("reasoning"))
+    text += " · %s" % fmt_cost(float(bucket.get("cost") or 0.0))
+    if bucket.get("unpriced"):
+        text += " + %d unpriced" % int(bucket["unpriced"])
+    return text
+
+
+# --- provider latency stats ------------------------------------------------
+class LatencyHistogram(object):
+    """Decaying histogram of call latencies plus recent failure rate for one endpoint.
+
+    Timeouts are kept as samples at the time waited, so a deadline that was too
+    short pushes the quantiles up instead of hiding the slow calls.
+    """
+
+    def __init__(self):
+        self.counts = [0.0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.failRate = 0.0
+        self.failStreak = 0
+        self.calls = 0
+        self.last = None
+
+    def add(self, ms, ok, timedOut=False):
+        self.calls += 1
+        self.failRate = self.failRate * 0.8 + (0.0 if ok else 0.2)
+        self.failStreak = 0 if ok else self.failStreak + 1
+        if not ok and not timedOut:
+            return
+        self.last = ms
+        self.counts = [c * LATENCY_DECAY for c in self.counts]
+        index = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1.0
+
+    def samples(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        total = self.samples()
+        if total <= 0:
+            return None
+        target = q * total
+        seen = 0.0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                lo = LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0.0
+                hi = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else LATENCY_BUCKETS_MS[-1] * 2.0
+                return lo + (hi - lo) * (target - seen) / count
+            seen += count
+        return float(LATENCY_BUCKETS_MS[-1])
+
+    def degraded(self):
+        if self.failStreak >= 2 or (self.calls >= 3 and self.failRate >= DEGRADED_FAILURE_RATE):
+            return "%d recent failure(s)" % max(self.failStreak, 1)
+        p99 = self.quantile(0.99)
+        if self.samples() >= LATENCY_MIN_SAMPLES and self.last is not None and p99 and self.last > p99:
+            return "last call took %.1f s (p99 %.1f s)" % (self.last / 1000.0, p99 / 1000.0)
+        return ""
+
+    def to_dict(self):
+        return {"counts": [round(c, 3) for c in self.counts], "failRate": round(self.failRate, 4), "failStreak": self.failStreak, "calls": self.calls, "last": self.last}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        counts = data.get("counts") or []
+        if len(counts) == len(hist.counts):
+            hist.counts = [float(c) for c in counts]
+        hist.failRate = float(data.get("failRate") or 0.0)
+        hist.failStreak = int(data.get("failStreak") or 0)
+        hist.calls = int(data.get("calls") or 0)
+        hist.last = data.get("last")
+        return hist
+
+
+def endpoint_origin(url):
+    parts = urllib.parse.urlsplit(str(url or ""))
+    return "%s://%s" % (parts.scheme, parts.netloc) if parts.netloc else str(url or "")
+
+
+def latency_key(url, payload=None):
+    """(origin, API kind, model, reasoning level) for a provider request."""
+    payload = payload if isinstance(payload, dict) else {}
+    path = urllib.parse.urlsplit(str(url or "")).path.rstrip("/")
+    kind = path.rsplit("/", 1)[-1] or "root"
+    if path.endswith("/chat/completions"):
+        kind = "chat"
+    elif path.endswith("/api/v1/chat"):
+        kind = "lmstudio"
+    reasoning = (payload.get("reasoning") or {}).get("effort") if isinstance(payload.get("reasoning"), dict) else None
+    if reasoning is None and isinstance(payload.get("thinking"), dict):
+        reasoning = (payload.get("output_config") or {}).get("effort") or payload["thinking"].get("budget_tokens") or payload["thinking"].get("type")
+    return "%s %s %s %s" % (endpoint_origin(url), kind, payload.get("model") or "-", reasoning or "auto")
+
+
+class LatencyStats(object):
+    """Per-endpoint latency histograms, persisted across sessions, used for adaptive timeouts."""
+
+    def __init__(self, path=LATENCY_PATH):
+        self.path = path
+        self.hists = {}
+        self.lock = threading.Lock()
+        self.writer = BackgroundJsonWriter(path, self._dump, delay=LATENCY_SAVE_DELAY_S)
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.isfile(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f) or {}
+                self.hists = {str(k): LatencyHistogram.from_dict(v) for k, v in data.items() if isinstance(v, dict)}
+        except Exception:
+            self.hists = {}
+
+    def _dump(self):
+        with self.lock:
+            return json.dumps({k: h.to_dict() for k, h in self.hists.items()})
+
+    def record(self, key, ms, ok, timedOut=False, persist=True):
+        with self.lock:
+            self.hists.setdefault(key, LatencyHistogram()).add(float(ms), bool(ok), bool(timedOut))
+        if persist:
+            self.writer.schedule()
+
+    def timeout_for(self, key, default, minimum=ADAPTIVE_TIMEOUT_MIN_S, maximum=ADAPTIVE_TIMEOUT_MAX_S):
+        with self.lock:
+            hist = self.hists.get(key)
+            if hist is None or hist.samples() < LATENCY_MIN_SAMPLES or hist.failStreak >= 2:
+                return default
+            p99 = hist.quantile(0.99)
+        return max(minimum, min(maximum, p99 / 1000.0 * ADAPTIVE_TIMEOUT_FACTOR))
+
+    def matching(self, origin, model=None):
+        """Histograms for an origin (and model), busiest first."""
+        with self.lock:
+            items = [(k, h) for k, h in self.hists.items() if k.startswith(origin + " ") and (not model or k.split(" ")[2] == model)]
+        return sorted(items, key=lambda kv: -kv[1].samples())
+
+    def outlook(self, origin, model=None):
+        """(p50 ms, p95 ms, degraded reason) for the busiest matching endpoint, or None."""
+        items = self.matching(origin, model)
+        if not items:
+            return None
+        with self.lock:
+            reasons = [h.degraded() for _, h in items]
+            key, hist = items[0]
+            p50, p95 = hist.quantile(0.5), hist.quantile(0.95)
+        return p50, p95, next((r for r in reasons if r), "")
+
+    def snapshot(self):
+        with self.lock:
+            rows = []
+            for key, hist in sorted(self.hists.items(), key=lambda kv: -kv[1].samples()):
+                rows.append({"key": key, "samples": hist.samples(), "calls": hist.calls, "p50": hist.quantile(0.5), "p99": hist.quantile(0.99), "degraded": hist.degraded()})
+            return rows
+
+
+_LATENCY = None
+_LATENCY_LOCK = threading.Lock()
+
+
+def latency_stats():
+    global _LATENCY
+    if _LATENCY is None:
+        with _LATENCY_LOCK:
+            if _LATENCY is None:
+                _LATENCY = LatencyStats()
+    return _LATENCY
+
+
+def timed_call(key, fn):
+    """Runs fn() and records its latency under key; timeouts, 429s and 5xx count as failures."""
+    started = time.monotonic()
+    try:
+        result = fn()
+    except Exception as e:
+        text = str(e).lower()
+        timedOut = "timed out" in text or "timeout" in text
+        if timedOut or re.search(r"http (429|5\d\d)\b", text) or "request failed for" in text:
+            latency_stats().record(key, (time.monotonic() - started) * 1000.0, False, timedOut)
+        raise
+    latency_stats().record(key, (time.monotonic() - started) * 1000.0, True)
+    return result
+
+
+# --- model router -----------------------------------------------------------
+def classify_prompt(prompt, mode, context_chars=0, history_len=0):
+    """Cheap ("fast" or "strong", [reasons]) guess at how much model a prompt needs."""
+    text = " ".join(str(prompt or "").lower().split())
+    score = 0
+    reasons = []
+    # Words are matched from the start of a word, so "plan" does not hit "explain"
+    # and "list" does not hit "stylistic"; stems like "interpolat" still work.
+    complex_hits = [w.strip() for w in ROUTER_COMPLEX_WORDS if re.search(r"\b" + re.escape(w), text)]
+    simple_hits = [w for w in ROUTER_SIMPLE_WORDS if re.search(r"\b" + re.escape(w), text)]
+    if len(text) > ROUTER_LONG_PROMPT_CHARS:
+        score += 2
+        reasons.append("long prompt")
+    elif len(text) < 120:
+        score -= 1
+        reasons.append("short prompt")
+    if complex_hits:
+        score += 1 + min(2, len(complex_hits) - 1)
+        reasons.append("mentions %s" % ", ".join(complex_hits[:3]))
+    if simple_hits and not complex_hits:
+        score -= 1
+        reasons.append("looks like a lookup")
+    if "```" in text or "traceback" in text:
+        score += 1
+        reasons.append("includes code")
+    if context_chars > ROUTER_LARGE_CONTEXT_CHARS:
+        score += 1
+        reasons.append("large context")
+    if mode == "code":
+        score += 1
+        reasons.append("code mode")
+    if history_len > 30:
+        score += 1
+        reasons.append("long conversation")
+    return ("strong" if score >= 2 else "fast"), reasons
+
+
+def route_candidates(sessions):
+    """API model settings the router may pick from: ROUTER_CANDIDATES, or every API tab with a concrete model."""
+    raw = list(ROUTER_CANDIDATES) or [s for s in sessions if isinstance(s, dict)]
+    out = []
+    seen = set()
+    for item in raw:
+        provider = str(item.get("provider") or "").strip().lower()
+        model = str(item.get("model") or "").strip()
+        if provider not in ("openai", "anthropic", "openai_compat") or not model or model.lower() == ROUTER_MODEL:
+            continue
+        base = str(item.get("apiBase") or "").strip()
+        key = (provider, base, model)
+        if key in seen:
+            continue
+        seen.add(key)
+        local = provider == "openai_compat" and (not base or bool(_is_private_url(base)))
+        out.append({
+            "provider": provider, "apiBase": base, "apiKey": str(item.get("apiKey") or ""), "model": model,
+            "reasoning": normalize_reasoning_value(provider, item.get("reasoning") or DEFAULT_REASONING), "local": local,
+        })
+    return out
+
+
+def choose_route(tier, candidates, origin_for, stats=None):
+    """Picks a candidate for `tier` using runtime latency and failure stats; returns (candidate, why) or (None, why)."""
+    stats = stats or latency_stats()
+    scored = []
+    for cand in candidates:
+        outlook = stats.outlook(origin_for(cand), cand["model"])
+        p50 = outlook[0] / 1000.0 if outlook and outlook[0] is not None else None
+        degraded = outlook[2] if outlook else ""
+        expected = p50 if p50 is not None else ROUTER_DEFAULT_LATENCY_S["local" if cand["local"] else "remote"]
+        if tier == "strong":
+            # Prefer remote models, then the faster one among them.
+            rank = (bool(degraded), cand["local"], expected)
+        else:
+            rank = (bool(degraded), expected, not cand["local"])
+        scored.append((rank, cand, p50, degraded))
+    if not scored:
+        return None, "no API tab with a concrete model to route to"
+    scored.sort(key=lambda row: row[0])
+    _, cand, p50, degraded = scored[0]
+    why = "%s %s model" % ("fast" if tier == "fast" else "strong", "local" if cand["local"] else "remote")
+    why += " (p50 %.1f s)" % p50 if p50 is not None else " (no latency history yet)"
+    if degraded:
+        why += ", all candidates degraded"
+    skipped = [row[1]["model"] for row in scored[1:] if row[3]]
+    if skipped:
+        why += ", skipped degraded %s" % ", ".join(skipped[:2])
+    return cand, why
+
+
+# --- font index -------------------------------------------------------------
+def _font_index_key(font):
+    path = ""
+    try:
+        path = str(font.filepath or "")
+    except Exception:
+        path = ""
+    return path or ("unsaved:%d" % id(font))
+
+
+def _font_file_mtime(path):
+    try:
+        return float(os.path.getmtime(path)) if path and os.path.exists(path) else 0.0
+    except Exception:
+        return 0.0
+
+
+def _glyph_change_stamp(glyph):
+    try:
+        stamp = glyph.lastChange
+    except Exception:
+        stamp = None
+    return str(stamp) if stamp is not None else ""
+
+
+def _index_glyph_entry(glyph, master_ids):
+    unicodes = []
+    try:
+        unicodes = [str(u).upper() for u in (glyph.unicodes or []) if u]
+    except Exception:
+        unicodes = []
+    anchors = set()
+    components = set()
+    layer_count = 0
+    try:
+        layers = list(glyph.layers)
+    except Exception:
+        layers = []
+    for layer in layers:
+        layer_count += 1
+        try:
+            if master_ids and str(layer.layerId) not in master_ids:
+                continue
+        except Exception:
+            pass
+        try:
+            for anchor in layer.anchors:
+                if anchor.name:
+                    anchors.add(str(anchor.name))
+        except Exception:
+            pass
+        try:
+            for comp in layer.components:
+                if comp.componentName:
+                    components.add(str(comp.componentName))
+        except Exception:
+            pass
+    return {
+        "unicodes": unicodes,
+        "category": str(getattr(glyph, "category", None) or ""),
+        "subCategory": str(getattr(glyph, "subCategory", None) or ""),
+        "script": str(getattr(glyph, "script", None) or ""),
+        "export": bool(getattr(glyph, "export", True)),
+        "layers": layer_count,
+        "anchors": sorted(anchors),
+        "components": sorted(components),
+    }
+
+
+class FontIndex(object):
+
+    def __init__(self, key):
+        self.key = key
+        self.mtime = 0.0
+        self.masters = []
+        self.glyphs = {}
+        self.order = []
+        self.stamps = {}
+        self.dirty = True
+        self._lock = threading.Lock()
+        self._reset_lookups()
+
+    def _reset_lookups(self):
+        self._by_anchor = None
+        self._by_component = None
+        self._by_unicode = None
+        self._by_category = None
+
+    # ---------- build ----------
+    def refresh(self, font):
+        with self._lock:
+            # Until a document callback or a Run marks the index dirty, the font
+            # has not changed and the per-glyph walk can be skipped.
+            if not self.dirty:
+                return False
+            self.dirty = False
+            masters = []
+            try:
+                for master in font.masters:
+                    masters.append({"id": str(master.id), "name": str(master.name or "")})
+            except Exception:
+                pass
+            master_ids = set(m["id"] for m in masters)
+            order = []
+            seen = set()
+            masters_changed = masters != self.masters
+            changed = masters_changed
+            for glyph in font.glyphs:
+                try:
+                    name = str(glyph.name)
+                except Exception:
+                    continue
+                order.append(name)
+                seen.add(name)
+                stamp = _glyph_change_stamp(glyph)
+                if stamp and name in self.glyphs and self.stamps.get(name) == stamp and not masters_changed:
+                    continue
+                self.glyphs[name] = _index_glyph_entry(glyph, master_ids)
+                self.stamps[name] = stamp
+                changed = True
+            for name in [n for n in self.glyphs if n not in seen]:
+                self.glyphs.pop(name, None)
+                self.stamps.pop(name, None)
+                changed = True
+            if order != self.order:
+                changed = True
+            self.order = order
+            self.masters = masters
+            if changed:
+                self._reset_lookups()
+            return changed
+
+    def to_json(self):
+        return {"key": self.key, "mtime": self.mtime, "masters": self.masters, "order": self.order, "glyphs": self.glyphs, "stamps": self.stamps}
+
+    @classmethod
+    def from_json(cls, data):
+        idx = cls(str(data.get("key") or ""))
+        idx.mtime = float(data.get("mtime") or 0.0)
+        idx.masters = list(data.get("masters") or [])
+        idx.order = [str(n) for n in (data.get("order") or [])]
+        idx.glyphs = dict(data.get("glyphs") or {})
+        idx.stamps = dict(data.get("stamps") or {})
+        return idx
+
+    # ---------- queries ----------
+    def _lookups(self):
+        with self._lock:
+            if self._by_anchor is None:
+                by_anchor, by_component, by_unicode, by_category = {}, {}, {}, {}
+                for name in self.order:
+                    entry = self.glyphs.get(name) or {}
+                    for a in entry.get("anchors") or []:
+                        by_anchor.setdefault(a, set()).add(name)
+                    for c in entry.get("components") or []:
+                        by_component.setdefault(c, set()).add(name)
+                    for u in entry.get("unicodes") or []:
+                        by_unicode[u] = name
+                    by_category.setdefault(entry.get("category") or "", []).append(name)
+                self._by_anchor, self._by_component, self._by_unicode, self._by_category = by_anchor, by_component, by_unicode, by_category
+            return self._by_anchor, self._by_component, self._by_unicode, self._by_category
+
+    def glyph(self, name):
+        return self.glyphs.get(str(name))
+
+    def glyph_for_unicode(self, code):
+        code = str(code or "").upper().replace("U+", "").replace("UNI", "")
+        return self._lookups()[2].get(code)
+
+    def glyphs_with_anchor(self, anchor):
+        found = self._lookups()[0].get(str(anchor)) or set()
+        return [n for n in self.order if n in found]
+
+    def glyphs_missing_anchor(self, anchor, category=None):
+        found = self._lookups()[0].get(str(anchor)) or set()
+        names = self._lookups()[3].get(category, []) if category else self.order
+        return [n for n in names if n not in found]
+
+    def glyphs_using_component(self, base):
+        found = self._lookups()[1].get(str(base)) or set()
+        return [n for n in self.order if n in found]
+
+    def glyphs_in_category(self, category, subCategory=None):
+        names = self._lookups()[3].get(str(category or ""), [])
+        if subCategory:
+            names = [n for n in names if (self.glyphs.get(n) or {}).get("subCategory") == subCategory]
+        return list(names)
+
+    # ---------- prompt ----------
+    def summary(self, selected=None, budget=FONT_INDEX_SUMMARY_CHARS):
+        by_anchor, by_component, _, by_category = self._lookups()
+        total_layers = sum(int((e or {}).get("layers") or 0) for e in self.glyphs.values())
+        unencoded = sum(1 for e in self.glyphs.values() if not (e or {}).get("unicodes"))
+        lines = [
+            "Font index: %d glyphs, %d layers, %d unencoded" % (len(self.order), total_layers, unencoded),
+            "Masters: %s" % (", ".join(m.get("name") or m.get("id") for m in self.masters) or "(none)"),
+        ]
+        cats = sorted(((k or "Uncategorized", len(v)) for k, v in by_category.items()), key=lambda kv: -kv[1])
+        if cats:
+            lines.append("Categories: %s" % ", ".join("%s %d" % kv for kv in cats[:12]))
+        anchors = sorted(((k, len(v)) for k, v in by_anchor.items()), key=lambda kv: (-kv[1], kv[0]))
+        if anchors:
+            lines.append("Anchors (glyph count): %s" % ", ".join("%s %d" % kv for kv in anchors[:16]))
+        comps = sorted(((k, len(v)) for k, v in by_component.items()), key=lambda kv: (-kv[1], kv[0]))
+        if comps:
+            lines.append("Most used components: %s" % ", ".join("%s %d" % kv for kv in comps[:16]))
+        for name in (selected or [])[:20]:
+            entry = self.glyphs.get(name)
+            if not entry:
+                continue
+            lines.append("- %s: unicode=%s category=%s/%s layers=%d anchors=[%s] components=[%s]" % (
+                name,
+                ",".join(entry.get("unicodes") or []) or "-",
+                entry.get("category") or "-",
+                entry.get("subCategory") or "-",
+                int(entry.get("layers") or 0),
+                ",".join(entry.get("anchors") or []),
+                ",".join(entry.get("components") or []),
+            ))
+        out = []
+        used = 0
+        for line in lines:
+            if used + len(line) + 1 > budget:
+                out.append("… (index summary truncated)")
+                break
+            out.append(line)
+            used += len(line) + 1
+        return "\n".join(out)
+
+
+_FONT_INDEXES = {}
+_FONT_INDEXES_LOCK = threading.Lock()
+
+
+def _font_index_cache_path(key):
+    return os.path.join(FONT_INDEX_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+
+def _load_font_index_from_disk(key, mtime):
+    try:
+        path = _font_index_cache_path(key)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f) or {}
+        if str(data.get("key") or "") != key or float(data.get("mtime") or 0.0) != mtime:
+            return None
+        return FontIndex.from_json(data)
+    except Exception:
+        return None
+
+
+def _save_font_index_to_disk(idx):
+    try:
+        ensure_dir(FONT_INDEX_DIR)
+        path = _font_index_cache_path(idx.key)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(idx.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def font_change_token(font):
+    """(font identity, glyph count, newest glyph lastChange): moves when the font is edited, not when it is redrawn."""
+    if font is None:
+        return None
+    newest = ""
+    count = 0
+    for glyph in font.glyphs:
+        count += 1
+        stamp = _glyph_change_stamp(glyph)
+        if stamp > newest:
+            newest = stamp
+    return (_font_index_key(font), count, newest)
+
+
+def mark_font_indexes_dirty():
+    """Make the next font_index_for() re-check every glyph's change stamp."""
+    with _FONT_INDEXES_LOCK:
+        for idx in _FONT_INDEXES.values():
+            idx.dirty = True
+
+
+def font_index_for(font):
+    if font is None:
+        return None
+    key = _font_index_key(font)
+    saved = not key.startswith("unsaved:")
+    mtime = _font_file_mtime(key) if saved else 0.0
+    with _FONT_INDEXES_LOCK:
+        idx = _FONT_INDEXES.get(key)
+        if idx is None and saved:
+            idx = _load_font_index_from_disk(key, mtime)
+        if idx is None:
+            idx = FontIndex(key)
+        _FONT_INDEXES[key] = idx
+    idx.refresh(font)
+    if saved and idx.mtime != mtime:
+        idx.mtime = mtime
+        _save_font_index_to_disk(idx)
+    return idx
+
+
+# --- selected layer geometry ------------------------------------------------
+_NODE_CODES = {"line": "L", "curve": "C", "qcurve": "Q", "offcurve": "o"}
+_GEOMETRY_CACHE = collections.OrderedDict()
+_GEOMETRY_CACHE_LOCK = threading.Lock()
+
+
+def _fmt_num(v):
+    try:
+        f = float(v)
+    except Exception:
+        return "?"
+    r = round(f)
+    return "%d" % r if abs(f - r) < 0.005 else ("%.2f" % f).rstrip("0").rstrip(".")
+
+
+def _layer_geometry_signature(layer):
+    """Content hash of everything serialize_layer_geometry() prints, or None if the layer can't be read.
+
+    Node coordinates, anchor positions and component transforms are hashed
+    directly: glyph.lastChange only has one-second resolution, so an edit
+    right after a serialization would otherwise return the old outline.
+    """
+    glyph = getattr(layer, "parent", None)
+    h = hashlib.sha1()
+    try:
+        h.update(repr((str(getattr(glyph, "name", "") or ""), str(layer.layerId), str(layer.name or ""), float(layer.width))).encode("utf-8"))
+        for path in layer.paths:
+            h.update(b"P1" if getattr(path, "closed", True) else b"P0")
+            h.update(repr([(str(n.type), float(n.position.x), float(n.position.y)) for n in path.nodes]).encode("utf-8"))
+        for comp in layer.components:
+            h.update(repr((str(comp.componentName), float(comp.position.x), float(comp.position.y), str(getattr(comp, "transform", "")), str(getattr(comp, "scale", "")))).encode("utf-8"))
+        for anchor in layer.anchors:
+            h.update(repr((str(anchor.name), float(anchor.position.x), float(anchor.position.y))).encode("utf-8"))
+    except Exception:
+        return None
+    return h.hexdigest()
+
+
+def _serialize_path(path, stride):
+    try:
+        nodes = list(path.nodes)
+    except Exception:
+        return ""
+    tokens = []
+    oncurve = 0
+    for node in nodes:
+        code = _NODE_CODES.get(str(getattr(node, "type", "") or ""), "L")
+        if stride > 1:
+            if code == "o":
+                continue
+            oncurve += 1
+            if (oncurve - 1) % stride:
+                continue
+            code = "L"
+        try:
+            pos = node.position
+            tokens.append("%s%s,%s" % (code, _fmt_num(pos.x), _fmt_num(pos.y)))
+        except Exception:
+            continue
+    closed = bool(getattr(path, "closed", True))
+    return " ".join(tokens) + (" Z" if closed else "")
+
+
+def serialize_layer_geometry(layer, max_nodes=GEOMETRY_MAX_NODES):
+    glyph = getattr(layer, "parent", None)
+    name = str(getattr(glyph, "name", "") or "?")
+    head = "%s [%s] width=%s" % (name, str(getattr(layer, "name", "") or ""), _fmt_num(getattr(layer, "width", 0)))
+    for attr in ("LSB", "RSB"):
+        try:
+            head += " %s=%s" % (attr, _fmt_num(getattr(layer, attr)))
+        except Exception:
+            pass
+    lines = [head]
+    try:
+        paths = list(layer.paths)
+    except Exception:
+        paths = []
+    total = 0
+    for p in paths:
+        try:
+            total += len(p.nodes)
+        except Exception:
+            pass
+    stride = 1
+    if total > max_nodes > 0:
+        stride = int((total + max_nodes - 1) // max_nodes)
+        lines.append("  (dense outline: %d nodes, downsampled to every %d on-curve point; off-curves dropped)" % (total, stride))
+    for i, p in enumerate(paths):
+        lines.append("  path%d: %s" % (i, _serialize_path(p, stride)))
+    try:
+        for comp in layer.components:
+            pos = comp.position
+            line = "  component %s @%s,%s" % (comp.componentName, _fmt_num(pos.x), _fmt_num(pos.y))
+            try:
+                scale = comp.scale
+                if (float(scale[0]), float(scale[1])) != (1.0, 1.0):
+                    line += " scale=%s,%s" % (_fmt_num(scale[0]), _fmt_num(scale[1]))
+            except Exception:
+                pass
+            lines.append(line)
+    except Exception:
+        pass
+    try:
+        anchors = ["%s@%s,%s" % (a.name, _fmt_num(a.position.x), _fmt_num(a.position.y)) for a in layer.anchors]
+        if anchors:
+            lines.append("  anchors: %s" % " ".join(anchors))
+    except Exception:
+        pass
+    return "\n".join(lines)
+
+
+def cached_layer_geometry(layer, max_nodes=GEOMETRY_MAX_NODES):
+    key = _layer_geometry_signature(layer)
+    if key is None:
+        return serialize_layer_geometry(layer, max_nodes=max_nodes)
+    with _GEOMETRY_CACHE_LOCK:
+        text = _GEOMETRY_CACHE.get(key)
+        if text is not None:
+            _GEOMETRY_CACHE.move_to_end(key)
+            return text
+    text = serialize_layer_geometry(layer, max_nodes=max_nodes)
+    with _GEOMETRY_CACHE_LOCK:
+        _GEOMETRY_CACHE[key] = text
+        while len(_GEOMETRY_CACHE) > GEOMETRY_CACHE_SIZE:
+            _GEOMETRY_CACHE.popitem(last=False)
+    return text
+
+
+def selection_geometry_context(layers, budget=GEOMETRY_CONTEXT_BYTES):
+    out = []
+    used = 0
+    layers = [l for l in (layers or []) if l is not None]
+    for i, layer in enumerate(layers):
+        try:
+            text = cached_layer_geometry(layer)
+        except Exception:
+            continue
+        size = len(text.encode("utf-8")) + 1
+        if not out and size > budget:
+            out.append(text.encode("utf-8")[:budget].decode("utf-8", "ignore") + " …")
+            used = budget
+            continue
+        if used + size > budget:
+            out.append("… %d more selected layer(s) omitted (geometry budget %d bytes)" % (len(layers) - i, budget))
+            break
+        out.append(text)
+        used += size
+    return "\n".join(out)
+
+
+# --- code snippet index -----------------------------------------------------
+_SNIPPET_TOKEN = re.compile(r"[A-Za-z]+|\d+")
+_SNIPPET_CAMEL = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+
+def snippet_tokens(text):
+    out = []
+    for tok in _SNIPPET_TOKEN.findall(_SNIPPET_CAMEL.sub(" ", str(text or ""))):
+        tok = tok.lower()
+        if len(tok) > 1:
+            out.append(tok)
+    return out
+
+
+class SnippetIndex(object):
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.postings = {}
+        self.total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, prompt, code):
+        doc_id = str(doc_id)
+        code = str(code or "").strip()
+        if not code:
+            return
+        tf = collections.Counter(snippet_tokens(prompt) + snippet_tokens(code))
+        with self._lock:
+            self._remove_locked(doc_id)
+            length = sum(tf.values())
+            self.docs[doc_id] = {"prompt": str(prompt or ""), "code": code, "len": length, "tf": tf}
+            self.total_len += length
+            for tok, n in tf.items():
+                self.postings.setdefault(tok, {})[doc_id] = n
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove_locked(str(doc_id))
+
+    def _remove_locked(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_len -= doc["len"]
+        for tok in doc["tf"]:
+            posting = self.postings.get(tok)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[tok]
+
+    def clear(self):
+        with self._lock:
+            self.docs = {}
+            self.postings = {}
+            self.total_len = 0
+
+    def search(self, query, k=SNIPPET_TOP_K, exclude=None):
+        terms = set(snippet_tokens(query))
+        exclude = exclude or ()
+        with self._lock:
+            n = len(self.docs)
+            if not n or not terms:
+                return []
+            avg = float(self.total_len) / n or 1.0
+            scores = {}
+            for tok in terms:
+                posting = self.postings.get(tok)
+                if not posting:
+                    continue
+                idf = math.log(1.0 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    if doc_id in exclude:
+                        continue
+                    dl = self.docs[doc_id]["len"]
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avg))
+            ranked = sorted(scores.items(), key=lambda kv: -kv[1])[:max(0, int(k))]
+            return [(doc_id, score, self.docs[doc_id]["prompt"], self.docs[doc_id]["code"]) for doc_id, score in ranked]
+
+
+# --- rolling summaries ------------------------------------------------------
+def _summary_item_line(item, limit=160):
+    role = str(item.get("role") or "assistant")
+    kind = str(item.get("kind") or "text")
+    content = str(item.get("content") or "").strip()
+    if not content or (role == "system" and (content.startswith("Execution output") or content == "Stopped.")):
+        return ""
+    if kind == "code":
+        body = [l.strip() for l in content.splitlines() if l.strip() and not l.strip().startswith(("import ", "from "))]
+        text = "(code) " + " / ".join(body[:3])
+    else:
+        text = " ".join(content.split())
+    if len(text) > limit:
+        text = text[:limit].rstrip() + "…"
+    return "- %s: %s" % (role, text)
+
+
+def trim_summary(text, limit=SUMMARY_MAX_CHARS):
+    text = str(text or "").strip()
+    if len(text) <= limit:
+        return text
+    lines = text.splitlines()
+    while lines and len("\n".join(lines)) > limit:
+        lines.pop(0)
+    return "\n".join(lines) if lines else text[-limit:]
+
+
+def extractive_summary(previous, items):
+    lines = [l for l in str(previous or "").splitlines() if l.strip()]
+    for item in items:
+        line = _summary_item_line(item)
+        if line:
+            lines.append(line)
+    return trim_summary("\n".join(lines))
+
+
+# --- codex app-server -------------------------------------------------------
+class TailBuffer(object):
+
+    def __init__(self, limit=CODEX_STDERR_LIMIT):
+        self.limit = int(limit)
+        self.parts = collections.deque()
+        self.size = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def append(self, text):
+        text = str(text or "")
+        if not text:
+            return
+        with self._lock:
+            if len(text) > self.limit:
+                self.dropped += len(text) - self.limit
+                text = text[-self.limit:]
+            self.parts.append(text)
+            self.size += len(text)
+            while self.size > self.limit and self.parts:
+                old = self.parts.popleft()
+                self.size -= len(old)
+                self.dropped += len(old)
+
+    def text(self):
+        with self._lock:
+            body = "".join(self.parts)
+            dropped = self.dropped
+        return ("… (%d earlier characters dropped)\n" % dropped + body) if dropped else body
+
+
+def codex_event_progress(kind, data):
+    kind = str(kind or "")
+    data = data if isinstance(data, dict) else {}
+    if kind == "item/agentMessage/delta":
+        return "delta", str(data.get("delta") or "")
+    if kind in ("error", "turn.failed", "turn/failed"):
+        return "error", _codex_error_message(data.get("error") or data.get("message"), "Codex reported an error.")
+    item = data.get("item") if isinstance(data.get("item"), dict) else {}
+    itype = str(item.get("type") or "")
+    started = kind in ("item.started", "item/started")
+    completed = kind in ("item.completed", "item/completed")
+    if itype in ("mcp_tool_call", "mcpToolCall"):
+        name = "%s.%s" % (item.get("server") or "mcp", item.get("tool") or "?")
+        if started:
+            return "tool", "→ %s" % name
+        if completed:
+            status = str(item.get("status") or "")
+            return "tool", "✓ %s%s" % (name, (" (%s)" % status) if status and status != "completed" else "")
+    if itype in ("command_execution", "commandExecution") and started:
+        return "tool", "$ %s" % str(item.get("command") or "")[:200]
+    if itype == "reasoning" and completed:
+        text = item.get("text") or item.get("summary") or ""
+        if isinstance(text, list):
+            text = " ".join(str(t.get("text") if isinstance(t, dict) else t) for t in text)
+        text = " ".join(str(text).split())
+        return ("reasoning", text[:300] + ("…" if len(text) > 300 else "")) if text else None
+    if itype in ("agent_message", "agentMessage") and completed:
+        return "message", str(item.get("text") or "")
+    return None
+
+
+def _codex_error_message(err, default):
+    if isinstance(err, dict):
+        err = err.get("message")
+    return str(err or default)
+
+
+class CodexAppServerError(RuntimeError):
+
+    def __init__(self, message, started=False):
+        RuntimeError.__init__(self, message)
+        self.started = started
+
+
+class CodexAppServer(object):
+
+    def __init__(self, cmd, cwd, env, model=""):
+        self.cmd = list(cmd)
+        self.cwd = cwd
+        self.env = env
+        self.model = model
+        self.proc = None
+        self.thread_id = ""
+        self.turn_id = ""
+        self.busy = False
+        self.turns = 0
+        self.startup_s = 0.0
+        self.last_used = time.monotonic()
+        self._next_id = 0
+        self._pending = {}
+        self._turn = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stderr_tail = TailBuffer()
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None and bool(self.thread_id)
+
+    def start(self):
+        t0 = time.monotonic()
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            env=self.env,
+            text=True,
+            bufsize=1,
+        )
+        for target in (self._read_stdout, self._read_stderr):
+            t = threading.Thread(target=target, args=(self.proc,))
+            t.daemon = True
+            t.start()
+        try:
+            self.request("initialize", {"clientInfo": {"name": "glyphsgpt_with_chat", "title": "GlyphsGPT with Chat", "version": SCRIPT_BUILD}}, timeout=CODEX_START_TIMEOUT_S)
+            self.notify("initialized")
+            params = {"cwd": self.cwd, "approvalPolicy": "never", "sandbox": "danger-full-access"}
+            if self.model:
+                params["model"] = self.model
+            res = self.request("thread/start", params, timeout=CODEX_START_TIMEOUT_S) or {}
+        except Exception:
+            self.close()
+            raise
+        self.thread_id = str((res.get("thread") or {}).get("id") or res.get("threadId") or "")
+        if not self.thread_id:
+            self.close()
+            raise CodexAppServerError("Codex app-server did not return a thread id.")
+        self.startup_s = time.monotonic() - t0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        proc = self.proc
+        self.thread_id = ""
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            proc.terminate()
+            proc.wait(timeout=2)
+        except Exception:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+    # ---------- protocol ----------
+    def _send(self, msg):
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            raise CodexAppServerError("Codex app-server is not running.")
+        line = json.dumps(msg, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            proc.stdin.write(line)
+            proc.stdin.flush()
+
+    def notify(self, method, params=None):
+        msg = {"method": method}
+        if params is not None:
+            msg["params"] = params
+        self._send(msg)
+
+    def request(self, method, params=None, timeout=60.0):
+        waiter = {"event": threading.Event()}
+        with self._lock:
+            self._next_id += 1
+            rid = self._next_id
+            self._pending[rid] = waiter
+        try:
+            self._send({"id": rid, "method": method, "params": params or {}})
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(rid, None)
+            raise CodexAppServerError("Could not send %s to Codex app-server: %s" % (method, e))
+        if not waiter["event"].wait(timeout):
+            with self._lock:
+                self._pending.pop(rid, None)
+            raise CodexAppServerError("Codex app-server timed out on %s." % method)
+        if waiter.get("error") is not None:
+            raise CodexAppServerError("%s failed: %s" % (method, _codex_error_message(waiter["error"], "unknown error")))
+        return waiter.get("result")
+
+    def _read_stdout(self, proc):
+        try:
+            for line in proc.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    msg = json.loads(line)
+                except Exception:
+                    continue
+                if isinstance(msg, dict):
+                    self._dispatch(msg)
+        except Exception:
+            pass
+        if proc is self.proc:
+            try:
+                code = proc.wait(timeout=1.0)
+            except Exception:
+                code = proc.poll()
+            self._fail_all("Codex app-server exited (code %s).\n%s" % (code, self.stderr_tail()))
+
+    def _read_stderr(self, proc):
+        try:
+            for line in proc.stderr:
+                self._stderr_tail.append(line)
+        except Exception:
+            pass
+
+    def stderr_tail(self, n=40):
+        return "\n".join(self._stderr_tail.text().splitlines()[-n:]).strip()
+
+    def _fail_all(self, message):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+        for waiter in pending:
+            waiter["error"] = message
+            waiter["event"].set()
+        turn = self._turn
+        if turn is not None and not turn["event"].is_set():
+            turn["error"] = message
+            turn["event"].set()
+
+    def _dispatch(self, msg):
+        if "id" in msg and ("result" in msg or "error" in msg) and "method" not in msg:
+            with self._lock:
+                waiter = self._pending.pop(msg.get("id"), None)
+            if waiter is not None:
+                if msg.get("error") is not None:
+                    waiter["error"] = msg.get("error")
+                waiter["result"] = msg.get("result")
+                waiter["event"].set()
+            return
+        method = str(msg.get("method") or "")
+        params = msg.get("params") or {}
+        if "id" in msg:
+            self._answer_server_request(msg.get("id"), method)
+            return
+        self._on_notification(method, params)
+
+    def _answer_server_request(self, rid, method):
+        try:
+            if "requestApproval" in method or "approval" in method.lower():
+                self._send({"id": rid, "result": {"decision": "accept"}})
+            else:
+                self._send({"id": rid, "error": {"code": -32601, "message": "Unsupported request: %s" % method}})
+        except Exception:
+            pass
+
+    def _on_notification(self, method, params):
+        turn = self._turn
+        if turn is None:
+            return
+        if method == "item/agentMessage/delta":
+            turn["delta"].append(str(params.get("delta") or ""))
+        elif method == "item/completed":
+            item = params.get("item") or {}
+            if str(item.get("type") or "") == "agentMessage" and str(item.get("text") or "").strip():
+                turn["messages"].append(str(item.get("text") or ""))
+        elif method == "error":
+            turn["error"] = _codex_error_message(params.get("error"), "Codex reported an error.")
+        elif method == "turn/completed":
+            info = params.get("turn") or {}
+            status = str(info.get("status") or "")
+            if status == "failed" and not turn.get("error"):
+                turn["error"] = _codex_error_message(info.get("error"), "Codex turn failed.")
+            elif status == "interrupted":
+                turn["interrupted"] = True
+            turn["event"].set()
+        callback = turn.get("on_event")
+        if callback is not None:
+            try:
+                callback(method, params)
+            except Exception:
+                pass
+
+    # ---------- turns ----------
+    def run_turn(self, prompt, on_event=None, timeout=CODEX_TURN_TIMEOUT_S):
+        turn = {"event": threading.Event(), "messages": [], "delta": [], "error": None, "on_event": on_event}
+        self._turn = turn
+        self.busy = True
+        try:
+            try:
+                res = self.request("turn/start", {"threadId": self.thread_id, "input": [{"type": "text", "text": prompt}]}) or {}
+            except CodexAppServerError as e:
+                raise CodexAppServerError(str(e), started=False)
+            self.turn_id = str((res.get("turn") or {}).get("id") or "")
+            if not turn["event"].wait(timeout):
+                self.interrupt()
+                raise CodexAppServerError("Codex turn timed out after %d s." % int(timeout), started=True)
+        finally:
+            self._turn = None
+            self.turn_id = ""
+            self.busy = False
+            self.turns += 1
+            self.last_used = time.monotonic()
+        text = turn["messages"][-1] if turn["messages"] else "".join(turn["delta"])
+        if turn["error"] and not text.strip():
+            raise CodexAppServerError(turn["error"], started=True)
+        return text, bool(turn.get("interrupted"))
+
+    def interrupt(self):
+        if not (self.thread_id and self.turn_id):
+            return
+        try:
+            self.request("turn/interrupt", {"threadId": self.thread_id, "turnId": self.turn_id}, timeout=5.0)
+        except Exception:
+            pass
+
+
+class CodexSessionPool(object):
+
+    def __init__(self, idle_s=CODEX_SESSION_IDLE_S):
+        self.idle_s = float(idle_s)
+        self.entries = {}
+        self.synced = {}  # key -> id of the last tab history item the pooled session has seen
+        self.stats = {"cold": 0, "warm": 0, "restarts": 0, "startup_s": 0.0}
+        self.unavailable = ""
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def live(self, key, config):
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] == config and entry[1].alive()
+
+    def acquire(self, key, config, factory):
+        self._ensure_reaper()
+        with self._lock:
+            entry = self.entries.pop(key, None)
+        if entry is not None:
+            if entry[0] == config and entry[1].alive():
+                with self._lock:
+                    self.entries[key] = entry
+                    self.stats["warm"] += 1
+                return entry[1], False
+            if entry[0] == config:
+                self.stats["restarts"] += 1
+            entry[1].close()
+        self.synced.pop(key, None)
+        server = factory()
+        server.start()
+        with self._lock:
+            self.entries[key] = (config, server)
+            self.stats["cold"] += 1
+            self.stats["startup_s"] += server.startup_s
+        return server, True
+
+    def average_startup_s(self):
+        cold = self.stats["cold"]
+        return self.stats["startup_s"] / cold if cold else 0.0
+
+    def saved_s(self):
+        return self.stats["warm"] * self.average_startup_s()
+
+    def mark_synced(self, key, item_id):
+        if key in self.entries and item_id:
+            self.synced[key] = item_id
+
+    def close(self, key):
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            self.synced.pop(key, None)
+        if entry is not None:
+            entry[1].close()
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self.entries.values())
+            self.entries = {}
+            self.synced = {}
+        for _, server in entries:
+            server.close()
+
+    def reap(self):
+        now = time.monotonic()
+        with self._lock:
+            stale = [k for k, (_, srv) in self.entries.items() if not srv.busy and now - srv.last_used > self.idle_s]
+            entries = [self.entries.pop(k) for k in stale]
+            for k in stale:
+                self.synced.pop(k, None)
+        for _, server in entries:
+            server.close()
+
+    def _ensure_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+
+        def _loop():
+            while True:
+                time.sleep(min(60.0, max(5.0, self.idle_s / 4.0)))
+                try:
+                    self.reap()
+                except Exception:
+                    pass
+
+        self._reaper = threading.Thread(target=_loop)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+
+# --- MCP health monitor -----------------------------------------------------
+class McpHealthMonitor(object):
+
+    def __init__(self, url=DEFAULT_GLYPHS_MCP_URL, on_change=None):
+        self.url = url
+        self.on_change = on_change
+        self.alive = None
+        self.checked = 0.0
+        self.latency_ms = None
+        self.failures = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def poke(self):
+        self._wake.set()
+
+    def probe(self):
+        t0 = time.monotonic()
+        key = "%s mcp-probe - -" % endpoint_origin(self.url)
+        timeout = latency_stats().timeout_for(key, MCP_PROBE_TIMEOUT_S, minimum=0.5, maximum=MCP_PROBE_TIMEOUT_S * 2)
+        raw = http_get(self.url, headers={"Accept": "application/json"}, timeout=timeout)
+        alive = raw is not None
+        # Polled every few seconds for as long as the window is open: keep the
+        # samples in memory; they reach disk with the next provider call's save.
+        latency_stats().record(key, (time.monotonic() - t0) * 1000.0, alive, persist=False)
+        changed = alive != self.alive
+        self.alive = alive
+        self.checked = time.monotonic()
+        self.latency_ms = (self.checked - t0) * 1000.0 if alive else None
+        self.failures = 0 if alive else self.failures + 1
+        if changed and self.on_change is not None:
+            try:
+                self.on_change(self.snapshot())
+            except Exception:
+                pass
+        return alive
+
+    def cached(self, ttl=MCP_STATUS_TTL_S):
+        if self.alive is None or time.monotonic() - self.checked > ttl:
+            return None
+        return self.alive
+
+    def snapshot(self):
+        return {
+            "alive": self.alive,
+            "url": self.url,
+            "latencyMs": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "failures": self.failures,
+        }
+
+    def next_delay(self):
+        if self.alive:
+            return MCP_POLL_UP_S
+        return min(MCP_POLL_MAX_S, MCP_POLL_DOWN_S * (2 ** min(max(self.failures - 1, 0), 6)))
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception:
+                pass
+            self._wake.wait(self.next_delay())
+            self._wake.clear()
+
+
+# --- MCP client -------------------------------------------------------------
+class McpError(RuntimeError):
+    pass
+
+
+def _mcp_tool_function_name(name):
+    return re.sub(r"[^a-zA-Z0-9_-]+", "_", str(name or ""))[:64] or "tool"
+
+
+def _mcp_result_text(result):
+    result = result if isinstance(result, dict) else {}
+    parts = []
+    for part in result.get("content") or []:
+        if not isinstance(part, dict):
+            continue
+        ptype = str(part.get("type") or "")
+        if ptype == "text":
+            parts.append(str(part.get("text") or ""))
+        elif ptype == "resource":
+            res = part.get("resource") or {}
+            parts.append(str(res.get("text") or res.get("uri") or ""))
+        else:
+            parts.append("[%s content]" % (ptype or "unknown"))
+    if not parts and result.get("structuredContent") is not None:
+        parts.append(json.dumps(result.get("structuredContent"), ensure_ascii=False))
+    text = "\n".join(p for p in parts if p)
+    if len(text) > MCP_TOOL_RESULT_CHARS:
+        text = text[:MCP_TOOL_RESULT_CHARS] + "\n… (truncated %d characters)" % (len(text) - MCP_TOOL_RESULT_CHARS)
+    return text
+
+
+class McpClient(object):
+
+    def __init__(self, url=DEFAULT_GLYPHS_MCP_URL, timeout=MCP_CALL_TIMEOUT_S):
+        self.url = url
+        self.timeout = float(timeout)
+        self.session_id = ""
+        self.protocol = MCP_PROTOCOL_VERSION
+        self.tools = None
+        self._initialized = False
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _post(self, payload, timeout=None):
+        headers = {"Content-Type": "application/json", "Accept": "application/json, text/event-stream"}
+        if self.session_id:
+            headers["Mcp-Session-Id"] = self.session_id
+        if self._initialized:
+            headers["MCP-Protocol-Version"] = self.protocol
+        cassette = active_cassette()
+        if cassette is None:
+            return self._post_live(payload, headers, timeout)
+        # JSON-RPC ids depend on how many calls came before, so they are left out of the match.
+        keyed = dict(payload)
+        keyed.pop("id", None)
+        msg = cassette.exchange("MCP", self.url, keyed, headers, lambda: self._post_live(payload, headers, timeout), error_cls=McpError)
+        if isinstance(msg, dict) and "id" in payload:
+            msg = dict(msg, id=payload["id"])
+        return msg
+
+    def _post_live(self, payload, headers, timeout=None):
+        req = urllib.request.Request(self.url, data=json.dumps(payload).encode("utf-8"), method="POST", headers=headers)
+        opener = _build_opener(self.url, insecure_https=False)
+        try:
+            with opener.open(req, timeout=timeout or self.timeout) as r:
+                sid = r.headers.get("Mcp-Session-Id")
+                if sid:
+                    self.session_id = sid
+                ctype = str(r.headers.get("Content-Type") or "").lower()
+                raw = r.read().decode("utf-8", "ignore")
+        except urllib.error.HTTPError as e:
+            try:
+                body_txt = e.read().decode("utf-8", "ignore")
+            except Exception:
+                body_txt = ""
+            raise McpError("HTTP %s %s from %s\n%s" % (e.code, e.reason, self.url, body_txt or e.reason))
+        except Exception as e:
+            raise McpError("MCP request to %s failed: %s" % (self.url, e))
+        if "id" not in payload:
+            return None
+        for msg in self._parse_messages(raw, ctype):
+            if isinstance(msg, dict) and msg.get("id") == payload["id"]:
+                return msg
+        raise McpError("MCP server returned no response for %s." % payload.get("method"))
+
+    def _parse_messages(self, raw, ctype):
+        if "text/event-stream" not in ctype:
+            try:
+                data = json.loads(raw) if raw.strip() else None
+            except Exception:
+                raise McpError("Invalid JSON from MCP server: %s" % raw[:500])
+            return data if isinstance(data, list) else [data]
+        out = []
+        buf = []
+        for line in raw.splitlines() + [""]:
+            if line.startswith("data:"):
+                buf.append(line[5:].lstrip())
+            elif not line.strip() and buf:
+                try:
+                    out.append(json.loads("\n".join(buf)))
+                except Exception:
+                    pass
+                buf = []
+        return out
+
+    def _message(self, method, params=None, notify=False):
+        msg = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            msg["params"] = params
+        if not notify:
+            with self._lock:
+                self._next_id += 1
+                msg["id"] = self._next_id
+        return msg
+
+    def initialize(self):
+        self.session_id = ""
+        self._initialized = False
+        res = self._post(self._message("initialize", {
+            "protocolVersion": MCP_PROTOCOL_VERSION,
+            "capabilities": {},
+            "clientInfo": {"name": "GlyphsGPTwithChat", "version": SCRIPT_BUILD},
+        }), timeout=min(self.timeout, 15.0))
+        if res.get("error"):
+            raise McpError("MCP initialize failed: %s" % _codex_error_message(res.get("error"), "unknown error"))
+        self.protocol = str((res.get("result") or {}).get("protocolVersion") or MCP_PROTOCOL_VERSION)
+        self._initialized = True
+        try:
+            self._post(self._message("notifications/initialized", notify=True), timeout=5.0)
+        except McpError:
+            pass
+
+    def request(self, method, params=None, timeout=None):
+        for attempt in (0, 1):
+            if not self._initialized:
+                self.initialize()
+            try:
+                res = self._post(self._message(method, params), timeout=timeout)
+            except McpError as e:
+                if attempt == 0 and self.session_id and ("HTTP 404" in str(e) or "HTTP 400" in str(e)):
+                    self._initialized = False
+                    continue
+                raise
+            if res.get("error"):
+                raise McpError("%s failed: %s" % (method, _codex_error_message(res.get("error"), "unknown error")))
+            return res.get("result") or {}
+        raise McpError("MCP session could not be re-established.")
+
+    def list_tools(self, refresh=False):
+        if self.tools is not None and not refresh:
+            return self.tools
+        tools = []
+        cursor = None
+        while True:
+            res = self.request("tools/list", {"cursor": cursor} if cursor else {})
+            tools.extend(t for t in (res.get("tools") or []) if isinstance(t, dict) and t.get("name"))
+            cursor = res.get("nextCursor")
+            if not cursor:
+                break
+        self.tools = tools
+        return tools
+
+    def call_tool(self, name, arguments=None):
+        t0 = time.monotonic()
+        try:
+            res = self.request("tools/call", {"name": name, "arguments": arguments or {}})
+            text = _mcp_result_text(res)
+            is_error = bool(res.get("isError"))
+        except McpError as e:
+            text = str(e)
+            is_error = True
+        return text, is_error, (time.monotonic() - t0) * 1000.0
+
+    def reset(self):
+        self.session_id = ""
+        self._initialized = False
+        self.tools = None
+
+
+# --- tool result cache -------------------------------------------------------
+def mcp_tool_is_read_only(tool):
+    hints = tool.get("annotations") if isinstance(tool.get("annotations"), dict) else {}
+    if "readOnlyHint" in hints:
+        return bool(hints.get("readOnlyHint"))
+    return str(tool.get("name") or "").lower().startswith(MCP_READONLY_PREFIXES)
+
+
+class ToolResultCache(object):
+    """Memoizes read-only tool results for one font revision.
+
+    The revision moves forward on every mutating tool call and on Glyphs
+    document-change callbacks; results fetched under an older revision are
+    never stored.
+    """
+
+    def __init__(self, size=TOOL_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.revision = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+        self.by_tool = {}
+        self.last_invalidation = ""
+
+    def key(self, source, tool, arguments):
+        return (source, tool, json.dumps(arguments or {}, sort_keys=True, default=str))
+
+    def get(self, key):
+        with self.lock:
+            counts = self.by_tool.setdefault(key[1], [0, 0])
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                counts[0] += 1
+                return self.entries[key]
+            self.stats["misses"] += 1
+            counts[1] += 1
+            return None
+
+    def put(self, key, value, revision):
+        with self.lock:
+            if revision != self.revision:
+                return False
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            return True
+
+    def invalidate(self, reason=""):
+        with self.lock:
+            self.revision += 1
+            if self.entries:
+                self.stats["invalidations"] += 1
+            self.entries.clear()
+            self.last_invalidation = reason
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return (self.stats["hits"] / float(total)) if total else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            tools = sorted(self.by_tool.items(), key=lambda kv: -(kv[1][0] + kv[1][1]))
+            return {
+                "revision": self.revision,
+                "entries": len(self.entries),
+                "hitRate": self.hit_rate(),
+                "stats": dict(self.stats),
+                "tools": [{"tool": k, "hits": v[0], "misses": v[1]} for k, v in tools],
+                "lastInvalidation": self.last_invalidation,
+            }
+
+
+# --- native Glyphs tools -----------------------------------------------------
+NATIVE_TOOLS = collections.OrderedDict()
+
+
+def native_tool(name, description, properties=None, required=None, mutates=False):
+    def _register(fn):
+        NATIVE_TOOLS[name] = {
+            "name": name,
+            "description": description,
+            "schema": {"type": "object", "properties": properties or {}, "required": list(required or [])},
+            "fn": fn,
+            "mutates": mutates,
+        }
+        return fn
+    return _register
+
+
+_MASTER_PROP = {"type": "string", "description": "Master name or id. Defaults to the selected master."}
+
+
+def _tool_font(env):
+    font = env.get("font")
+    if font is None:
+        raise ValueError("No font is open in Glyphs.")
+    return font
+
+
+def _tool_master(font, master=None):
+    if master not in (None, ""):
+        for m in font.masters:
+            if str(m.id) == str(master) or str(m.name) == str(master):
+                return m
+        raise ValueError("No master named %r." % master)
+    return font.selectedFontMaster or font.masters[0]
+
+
+def _tool_layer(font, glyph, master=None):
+    g = font.glyphs[str(glyph)]
+    if g is None:
+        raise ValueError("No glyph named %r." % glyph)
+    m = _tool_master(font, master)
+    return g, g.layers[m.id], m
+
+
+def _kern_value(value):
+    try:
+        value = float(value)
+    except Exception:
+        return None
+    return None if abs(value) > 1e9 else value
+
+
+@native_tool("get_font_info", "Family name, path, units per em, masters with vertical metrics, instances, glyph count and the current selection.")
+def _tool_get_font_info(env):
+    font = _tool_font(env)
+    masters = []
+    for m in font.masters:
+        masters.append({
+            "id": str(m.id), "name": str(m.name or ""),
+            "ascender": m.ascender, "capHeight": m.capHeight, "xHeight": m.xHeight, "descender": m.descender,
+        })
+    selected = []
+    for layer in env.get("selectedLayers") or []:
+        try:
+            selected.append(str(layer.parent.name))
+        except Exception:
+            pass
+    return {
+        "familyName": str(font.familyName or ""),
+        "filepath": str(font.filepath or ""),
+        "unitsPerEm": font.upm,
+        "glyphCount": len(font.glyphs),
+        "masters": masters,
+        "instances": [str(i.name or "") for i in font.instances],
+        "selectedMaster": str(getattr(env.get("selectedFontMaster"), "name", "") or ""),
+        "selectedGlyphs": selected,
+    }
+
+
+@native_tool("list_glyphs", "List glyphs from the cached font index, optionally filtered.", {
+    "category": {"type": "string", "description": "Glyph category such as Letter, Mark, Number."},
+    "missingAnchor": {"type": "string", "description": "Only glyphs whose master layers lack this anchor."},
+    "hasAnchor": {"type": "string", "description": "Only glyphs with this anchor."},
+    "usesComponent": {"type": "string", "description": "Only glyphs that use this glyph as a component."},
+    "prefix": {"type": "string", "description": "Only glyph names starting with this text."},
+    "limit": {"type": "integer", "description": "Maximum number of glyphs (default 200)."},
+    "offset": {"type": "integer"},
+})
+def _tool_list_glyphs(env, category=None, missingAnchor=None, hasAnchor=None, usesComponent=None, prefix=None, limit=200, offset=0):
+    idx = font_index_for(_tool_font(env))
+    if missingAnchor:
+        names = idx.glyphs_missing_anchor(missingAnchor, category=category)
+    elif hasAnchor:
+        names = idx.glyphs_with_anchor(hasAnchor)
+    elif usesComponent:
+        names = idx.glyphs_using_component(usesComponent)
+    elif category:
+        names = idx.glyphs_in_category(category)
+    else:
+        names = list(idx.order)
+    if category and (hasAnchor or usesComponent):
+        names = [n for n in names if (idx.glyph(n) or {}).get("category") == category]
+    if prefix:
+        names = [n for n in names if n.startswith(prefix)]
+    offset = max(0, int(offset or 0))
+    page = names[offset:offset + max(1, int(limit or 200))]
+    return {
+        "total": len(names),
+        "offset": offset,
+        "glyphs": [{"name": n, "unicodes": (idx.glyph(n) or {}).get("unicodes") or [], "category": (idx.glyph(n) or {}).get("category") or ""} for n in page],
+    }
+
+
+@native_tool("select_glyphs", "Select glyphs in the font view and optionally open them in a new Edit tab.", {
+    "names": {"type": "array", "items": {"type": "string"}},
+    "openTab": {"type": "boolean", "description": "Open the glyphs in a new Edit tab."},
+}, required=["names"], mutates=True)
+def _tool_select_glyphs(env, names, openTab=False):
+    font = _tool_font(env)
+    wanted = [str(n) for n in names or []]
+    found = [n for n in wanted if font.glyphs[n] is not None]
+    lookup = set(found)
+    for g in font.glyphs:
+        g.selected = g.name in lookup
+    if openTab and found:
+        font.newTab("".join("/" + n for n in found))
+    return {"selected": found, "missing": [n for n in wanted if n not in lookup]}
+
+
+@native_tool("get_layer", "Outline, components, anchors and metrics of one glyph layer in compact text form.", {
+    "glyph": {"type": "string"},
+    "master": _MASTER_PROP,
+}, required=["glyph"])
+def _tool_get_layer(env, glyph, master=None):
+    font = _tool_font(env)
+    _, layer, m = _tool_layer(font, glyph, master)
+    return {"master": str(m.name or ""), "geometry": serialize_layer_geometry(layer)}
+
+
+@native_tool("set_metrics", "Set width, LSB/RSB or metrics keys of one glyph layer.", {
+    "glyph": {"type": "string"},
+    "master": _MASTER_PROP,
+    "width": {"type": "number"},
+    "LSB": {"type": "number"},
+    "RSB": {"type": "number"},
+    "leftMetricsKey": {"type": "string"},
+    "rightMetricsKey": {"type": "string"},
+}, required=["glyph"], mutates=True)
+def _tool_set_metrics(env, glyph, master=None, width=None, LSB=None, RSB=None, leftMetricsKey=None, rightMetricsKey=None):
+    font = _tool_font(env)
+    g, layer, _ = _tool_layer(font, glyph, master)
+    g.beginUndo()
+    try:
+        if width is not None:
+            layer.width = float(width)
+        if LSB is not None:
+            layer.LSB = float(LSB)
+        if RSB is not None:
+            layer.RSB = float(RSB)
+        if leftMetricsKey is not None:
+            layer.leftMetricsKey = leftMetricsKey or None
+        if rightMetricsKey is not None:
+            layer.rightMetricsKey = rightMetricsKey or None
+        if leftMetricsKey is not None or rightMetricsKey is not None:
+            layer.syncMetrics()
+    finally:
+        g.endUndo()
+    return {"glyph": g.name, "width": layer.width, "LSB": layer.LSB, "RSB": layer.RSB}
+
+
+@native_tool("modify_layer", "Edit anchors and components of one glyph layer, or shift / decompose / clear it.", {
+    "glyph": {"type": "string"},
+    "master": _MASTER_PROP,
+    "setAnchors": {"type": "array", "items": {"type": "object", "properties": {"name": {"type": "string"}, "x": {"type": "number"}, "y": {"type": "number"}}, "required": ["name", "x", "y"]}},
+    "removeAnchors": {"type": "array", "items": {"type": "string"}},
+    "addComponents": {"type": "array", "items": {"type": "object", "properties": {"name": {"type": "string"}, "x": {"type": "number"}, "y": {"type": "number"}}, "required": ["name"]}},
+    "removeComponents": {"type": "array", "items": {"type": "string"}},
+    "shift": {"type": "array", "items": {"type": "number"}, "description": "[dx, dy] applied to paths, components and anchors."},
+    "decomposeComponents": {"type": "boolean"},
+    "clearPaths": {"type": "boolean"},
+}, required=["glyph"], mutates=True)
+def _tool_modify_layer(env, glyph, master=None, setAnchors=None, removeAnchors=None, addComponents=None, removeComponents=None, shift=None, decomposeComponents=False, clearPaths=False):
+    import GlyphsApp as GA
+    font = _tool_font(env)
+    g, layer, _ = _tool_layer(font, glyph, master)
+    g.beginUndo()
+    try:
+        if clearPaths:
+            layer.shapes = [s for s in layer.shapes if isinstance(s, GA.GSComponent)]
+        for name in removeComponents or []:
+            layer.shapes = [s for s in layer.shapes if not (isinstance(s, GA.GSComponent) and s.componentName == name)]
+        for spec in addComponents or []:
+            comp = GA.GSComponent(str(spec.get("name")))
+            comp.position = FN.NSMakePoint(float(spec.get("x") or 0), float(spec.get("y") or 0))
+            layer.shapes.append(comp)
+        if decomposeComponents:
+            layer.decomposeComponents()
+        for name in removeAnchors or []:
+            if layer.anchors[name] is not None:
+                del layer.anchors[name]
+        for spec in setAnchors or []:
+            layer.anchors[str(spec.get("name"))] = GA.GSAnchor(str(spec.get("name")), FN.NSMakePoint(float(spec.get("x")), float(spec.get("y"))))
+        if shift:
+            dx = float(shift[0]) if len(shift) > 0 else 0.0
+            dy = float(shift[1]) if len(shift) > 1 else 0.0
+            layer.applyTransform((1, 0, 0, 1, dx, dy))
+    finally:
+        g.endUndo()
+    return {"glyph": g.name, "geometry": serialize_layer_geometry(layer)}
+
+
+@native_tool("get_kerning", "Read kerning of one master: a single pair, or all pairs involving a glyph or group.", {
+    "master": _MASTER_PROP,
+    "left": {"type": "string", "description": "Left glyph name or @MMK_L_ group."},
+    "right": {"type": "string", "description": "Right glyph name or @MMK_R_ group."},
+    "limit": {"type": "integer"},
+})
+def _tool_get_kerning(env, master=None, left=None, right=None, limit=200):
+    font = _tool_font(env)
+    m = _tool_master(font, master)
+    if left and right:
+        return {"master": str(m.name or ""), "left": left, "right": right, "value": _kern_value(font.kerningForPair(m.id, left, right))}
+    table = font.kerning.get(m.id) or {}
+    pairs = []
+    for l, rights in table.items():
+        for r, value in rights.items():
+            if (left and str(l) != left) or (right and str(r) != right):
+                continue
+            pairs.append([str(l), str(r), _kern_value(value)])
+            if len(pairs) >= int(limit or 200):
+                return {"master": str(m.name or ""), "pairs": pairs, "truncated": True}
+    return {"master": str(m.name or ""), "pairs": pairs, "truncated": False}
+
+
+@native_tool("set_kerning", "Set or remove one kerning pair in one master. Use value null to remove the pair.", {
+    "master": _MASTER_PROP,
+    "left": {"type": "string"},
+    "right": {"type": "string"},
+    "value": {"type": ["number", "null"]},
+}, required=["left", "right"], mutates=True)
+def _tool_set_kerning(env, left, right, value=None, master=None):
+    font = _tool_font(env)
+    m = _tool_master(font, master)
+    if value is None:
+        font.removeKerningForPair(m.id, left, right)
+    else:
+        font.setKerningForPair(m.id, left, right, float(value))
+    return {"master": str(m.name or ""), "left": left, "right": right, "value": _kern_value(font.kerningForPair(m.id, left, right))}
+
+
+def run_native_tool(name, env, arguments):
+    spec = NATIVE_TOOLS.get(name)
+    if spec is None:
+        raise ValueError("Unknown tool: %s" % name)
+    return spec["fn"](env, **dict(arguments or {}))
+
+
+# --- exec namespace -----------------------------------------------------------
+_EXEC_NAMES = {}
+_EXEC_NAMES_MISSING = set()
+_EXEC_NAMES_LOCK = threading.Lock()
+
+
+def _resolve_exec_name(name):
+    """Look a name up in Foundation, AppKit, then GlyphsApp, memoized for the session."""
+    if name in _EXEC_NAMES:
+        return _EXEC_NAMES[name]
+    if name in _EXEC_NAMES_MISSING or name.startswith("_"):
+        raise KeyError(name)
+    import GlyphsApp as GA
+    for module in (FN, AK, GA):
+        try:
+            value = getattr(module, name)
+        except Exception:
+            continue
+        with _EXEC_NAMES_LOCK:
+            _EXEC_NAMES[name] = value
+        return value
+    with _EXEC_NAMES_LOCK:
+        _EXEC_NAMES_MISSING.add(name)
+    raise KeyError(name)
+
+
+def code_names(code):
+    """Every global-ish name a code object and its nested functions/classes refer to."""
+    names = set()
+    stack = [code]
+    while stack:
+        co = stack.pop()
+        names.update(co.co_names)
+        stack.extend(c for c in co.co_consts if hasattr(c, "co_names"))
+    return names
+
+
+class ExecNamespace(dict):
+    """Globals for Run: GlyphsApp / AppKit / Foundation names resolve on first use.
+
+    Builtins and module names are copied into the namespace when first looked
+    up, so later lookups in loops stay plain dict hits. Class bodies look
+    globals up without calling __missing__, so preload() resolves every name
+    the compiled script mentions before it runs.
+    """
+
+    def preload(self, code):
+        for name in code_names(code):
+            if name not in self:
+                try:
+                    self[name]
+                except KeyError:
+                    pass
+
+    def __missing__(self, name):
+        builtins_ns = dict.get(self, "__builtins__", builtins)
+        if not isinstance(builtins_ns, dict):
+            builtins_ns = builtins_ns.__dict__
+        if name in builtins_ns:
+            value = builtins_ns[name]
+        else:
+            value = _resolve_exec_name(name)
+        dict.__setitem__(self, name, value)
+        return value
+
+
+# --- compiled code cache ------------------------------------------------------
+_CODE_CACHE = collections.OrderedDict()
+_CODE_CACHE_LOCK = threading.Lock()
+_CODE_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def normalize_exec_source(code):
+    return str(code or "").replace("\r\n", "\n").strip()
+
+
+def compile_cached(code):
+    """compile() for Run, memoized by source hash; raises SyntaxError like compile()."""
+    key = hashlib.sha1(code.encode("utf-8", "surrogatepass")).hexdigest()
+    with _CODE_CACHE_LOCK:
+        compiled = _CODE_CACHE.get(key)
+        if compiled is not None:
+            _CODE_CACHE.move_to_end(key)
+            _CODE_CACHE_STATS["hits"] += 1
+            return compiled
+        _CODE_CACHE_STATS["misses"] += 1
+    compiled = compile(code, EXEC_FILENAME, "exec")
+    with _CODE_CACHE_LOCK:
+        _CODE_CACHE[key] = compiled
+        while len(_CODE_CACHE) > CODE_CACHE_SIZE:
+            _CODE_CACHE.popitem(last=False)
+    return compiled
+
+
+def precompile_code(code):
+    """Compile a code answer ahead of Run; returns None or a dict describing the syntax error."""
+    code = normalize_exec_source(code)
+    if not code:
+        return None
+    try:
+        compile_cached(code)
+    except SyntaxError as e:
+        return {"line": e.lineno or 0, "offset": e.offset or 0, "message": str(e.msg or "invalid syntax"), "text": str(e.text or "").rstrip()}
+    except Exception as e:
+        return {"line": 0, "offset": 0, "message": "%s: %s" % (type(e).__name__, e), "text": ""}
+    return None
+
+
+# --- script runner ------------------------------------------------------------
+class ScriptCancelled(KeyboardInterrupt):
+    """Raised inside a running script when Stop is pressed or the soft time limit passes.
+
+    It derives from KeyboardInterrupt so a script's own ``except Exception``
+    blocks do not swallow it.
+    """
+
+
+class ScriptOutput(io.TextIOBase):
+    """Captured script output with a memory cap.
+
+    The first ``head`` and the last ``tail`` characters stay in memory. Once
+    the output outgrows the head, everything is also streamed to a log file
+    in EXEC_LOG_DIR, so getvalue() returns a preview and the full text can be
+    paged in later. Text waiting for the live bubble is capped the same way.
+    """
+
+    def __init__(self, head=EXEC_OUTPUT_HEAD_CHARS, tail=EXEC_OUTPUT_TAIL_CHARS, pending=EXEC_OUTPUT_PENDING_CHARS, log_dir=EXEC_LOG_DIR):
+        self.head_limit = head
+        self.tail_limit = tail
+        self.pending_limit = pending
+        self.log_dir = log_dir
+        self.head = []
+        self.head_size = 0
+        self.tail = []
+        self.tail_size = 0
+        self.pending = []
+        self.pending_size = 0
+        self.pending_dropped = False
+        self.total = 0
+        self.spilled = False
+        self.log = None
+        self.log_path = ""
+        self.lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def _spill(self):
+        self.spilled = True
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self.log_path = os.path.join(self.log_dir, "%s-%s.log" % (time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:6]))
+            self.log = open(self.log_path, "w", encoding="utf-8", errors="replace")
+            self.log.write("".join(self.head))
+            files = sorted(f for f in os.listdir(self.log_dir) if f.endswith(".log"))
+            for old in files[:-EXEC_LOG_KEEP_FILES]:
+                os.remove(os.path.join(self.log_dir, old))
+        except Exception:
+            self.log = None
+            self.log_path = ""
+
+    def write(self, text):
+        text = str(text)
+        size = len(text)
+        with self.lock:
+            self.total += size
+            self.pending.append(text)
+            self.pending_size += size
+            if self.pending_size > 2 * self.pending_limit:
+                kept = "".join(self.pending)[-self.pending_limit:]
+                self.pending = [kept]
+                self.pending_size = len(kept)
+                self.pending_dropped = True
+            if not self.spilled and self.head_size + size <= self.head_limit:
+                self.head.append(text)
+                self.head_size += size
+                return size
+            if not self.spilled:
+                take = self.head_limit - self.head_size
+                self.head.append(text[:take])
+                self.head_size += take
+                self._spill()
+                if self.log is not None:
+                    self.log.write(text[take:])
+                text = text[take:]
+            elif self.log is not None:
+                self.log.write(text)
+            self.tail.append(text)
+            self.tail_size += len(text)
+            if self.tail_size > 2 * self.tail_limit:
+                kept = "".join(self.tail)[-self.tail_limit:]
+                self.tail = [kept]
+                self.tail_size = len(kept)
+        return size
+
+    def take_pending(self):
+        with self.lock:
+            text = "".join(self.pending)
+            if self.pending_dropped:
+                text = "…\n" + text[-self.pending_limit:]
+            self.pending = []
+            self.pending_size = 0
+            self.pending_dropped = False
+        return text
+
+    def getvalue(self):
+        with self.lock:
+            head = "".join(self.head)
+            if not self.spilled:
+                return head
+            tail = "".join(self.tail)[-self.tail_limit:]
+            omitted = self.total - len(head) - len(tail)
+            if omitted <= 0:
+                return head + tail
+            return "%s\n… %d characters omitted (open the full log) …\n%s" % (head, omitted, tail)
+
+    def finish(self):
+        with self.lock:
+            if self.log is not None:
+                try:
+                    self.log.close()
+                except Exception:
+                    pass
+                self.log = None
+        if self.log_path:
+            return {"path": self.log_path, "chars": self.total}
+        return None
+
+
+class ScriptRunner(object):
+    """Runs compiled code on the calling thread and calls on_tick between lines.
+
+    A line trace limited to frames compiled from ``filename`` checks the clock
+    every EXEC_CHECK_LINES lines; on_tick (flush output, pump the run loop)
+    runs at most every ``interval`` seconds, and a pending cancel or an
+    exceeded soft limit raises ScriptCancelled inside the script.
+    """
+
+    def __init__(self, filename=EXEC_FILENAME, on_tick=None, soft_limit=EXEC_SOFT_LIMIT_S, interval=EXEC_YIELD_INTERVAL_S):
+        self.filename = filename
+        self.on_tick = on_tick
+        self.soft_limit = soft_limit
+        self.interval = interval
+        self.cancelled = None
+        self.started = 0.0
+        self._lines = 0
+        self._next_tick = 0.0
+
+    def cancel(self, reason="stopped by user"):
+        self.cancelled = reason
+
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0.0
+
+    def _global_trace(self, frame, event, arg):
+        if frame.f_code.co_filename != self.filename:
+            return None
+        return self._local_trace
+
+    def _local_trace(self, frame, event, arg):
+        if event == "line":
+            self._lines += 1
+            if self._lines >= EXEC_CHECK_LINES:
+                self._lines = 0
+                self.check()
+        return self._local_trace
+
+    def check(self):
+        now = time.monotonic()
+        if now >= self._next_tick:
+            self._next_tick = now + self.interval
+            if self.on_tick is not None:
+                self.on_tick(self)
+        if self.cancelled is None and self.soft_limit and now - self.started > self.soft_limit:
+            self.cancelled = "soft time limit of %.0f s reached" % self.soft_limit
+        if self.cancelled is not None:
+            raise ScriptCancelled(self.cancelled)
+
+    def run(self, compiled, env, profiler=None):
+        previous = sys.gettrace()
+        self.started = time.monotonic()
+        self._next_tick = self.started + self.interval
+        sys.settrace(self._global_trace)
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                exec(compiled, env, env)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            sys.settrace(previous)
+
+
+class GlyphBatchRunner(object):
+    """Applies a per-glyph function to many glyphs in chunks.
+
+    Each chunk runs with the interface updates disabled. Every glyph is
+    wrapped in its own beginUndo()/endUndo(), so undo works per glyph, on
+    that glyph's undo manager. A failing glyph is recorded and the batch
+    moves on. Progress and an ETA go to ``report`` after every chunk.
+    """
+
+    def __init__(self, font, report=None, chunk_size=BATCH_CHUNK_SIZE):
+        self.font = font
+        self.report = report
+        self.chunk_size = max(1, int(chunk_size or BATCH_CHUNK_SIZE))
+
+    def _glyph_of(self, item):
+        parent = getattr(item, "parent", None)
+        return parent if getattr(item, "layerId", None) is not None and parent is not None else item
+
+    def run(self, fn, items=None, name="Batch edit"):
+        if self.font is None:
+            raise ValueError("runBatch needs an open font; no font is open in Glyphs.")
+        items = list(self.font.glyphs if items is None else items)
+        total = len(items)
+        done = 0
+        failed = []
+        errors = []
+        started = time.monotonic()
+        for offset in range(0, total, self.chunk_size):
+            chunk = items[offset:offset + self.chunk_size]
+            self.font.disableUpdateInterface()
+            try:
+                for item in chunk:
+                    glyph = self._glyph_of(item)
+                    glyph.beginUndo()
+                    try:
+                        fn(item)
+                    except Exception as e:
+                        failed.append(item)
+                        errors.append("%s: %s: %s" % (getattr(glyph, "name", "?"), type(e).__name__, e))
+                    finally:
+                        glyph.endUndo()
+                        done += 1
+            finally:
+                self.font.enableUpdateInterface()
+            if self.report is not None:
+                elapsed = time.monotonic() - started
+                eta = elapsed / done * (total - done) if done else 0.0
+                self.report("%s · %d/%d · %d error(s) · ETA %.0f s" % (name, done, total, len(failed), eta))
+        result = {"done": done, "total": total, "failed": failed, "errors": errors, "seconds": time.monotonic() - started}
+        if self.report is not None:
+            self.report("%s finished · %d/%d in %.1f s · %d error(s)" % (name, done - len(failed), total, result["seconds"], len(failed)))
+        if errors:
+            print("%s: %d glyph(s) failed; rerun with runBatch(fn, result['failed']):\n  %s" % (
+                name, len(failed), "\n  ".join(errors[:BATCH_MAX_ERRORS_SHOWN]) + ("\n  …" if len(errors) > BATCH_MAX_ERRORS_SHOWN else "")))
+        return result
+
+
+# --- outline arrays -----------------------------------------------------------
+_NUMPY = None
+
+
+def _numpy():
+    global _NUMPY
+    if _NUMPY is None:
+        try:
+            import numpy
+            _NUMPY = numpy
+        except Exception:
+            _NUMPY = False
+    return _NUMPY or None
+
+
+def require_numpy():
+    np = _numpy()
+    if np is None:
+        raise ImportError(
+            "The outline array helpers need NumPy. Install it for the Python that Glyphs uses "
+            "(Glyphs → Settings → Addons → Modules, or pip install --target into its site-packages) and restart Glyphs."
+        )
+    return np
+
+
+class OutlineArrays(object):
+    """All node coordinates of one layer as an (N, 2) float array, read in one pass.
+
+    ``starts`` holds the first node index of every path plus the total count,
+    so path ``i`` is ``xy[starts[i]:starts[i + 1]]``. Edit ``xy`` with array
+    operations and call ``write()``; only nodes whose coordinates changed are
+    written back.
+    """
+
+    def __init__(self, layer):
+        np = require_numpy()
+        self.layer = layer
+        self.nodes = []
+        starts = [0]
+        for path in layer.paths:
+            self.nodes.extend(path.nodes)
+            starts.append(len(self.nodes))
+        positions = [n.position for n in self.nodes]
+        self.xy = np.array([(p.x, p.y) for p in positions], dtype=float).reshape(-1, 2)
+        self.original = self.xy.copy()
+        self.oncurve = np.array([str(n.type) != "offcurve" for n in self.nodes], dtype=bool)
+        self.starts = np.array(starts, dtype=int)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def path(self, index):
+        return self.xy[self.starts[index]:self.starts[index + 1]]
+
+    def bounds(self, oncurve_only=False):
+        pts = self.xy[self.oncurve] if oncurve_only else self.xy
+        if not len(pts):
+            return None
+        lo, hi = pts.min(axis=0), pts.max(axis=0)
+        return float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1])
+
+    def signed_areas(self):
+        """Shoelace area of every path's control polygon; positive = counter-clockwise."""
+        np = require_numpy()
+        count = len(self.starts) - 1
+        if not len(self.nodes):
+            return np.zeros(count)
+        nxt = np.arange(1, len(self.nodes) + 1)
+        ends = self.starts[1:] - 1
+        nonempty = self.starts[1:] > self.starts[:-1]
+        nxt[ends[nonempty]] = self.starts[:-1][nonempty]
+        x, y = self.xy[:, 0], self.xy[:, 1]
+        cross = x * y[nxt] - x[nxt] * y
+        areas = np.zeros(count)
+        areas[nonempty] = 0.5 * np.add.reduceat(cross, self.starts[:-1][nonempty])
+        return areas
+
+    def clockwise(self):
+        return self.signed_areas() < 0
+
+    def near_misses(self, value, tolerance=2.0, axis=1):
+        """Indices of on-curve nodes within ``tolerance`` of ``value`` but not on it (overshoot / alignment checks)."""
+        np = require_numpy()
+        delta = np.abs(self.xy[:, axis] - float(value))
+        return np.nonzero(self.oncurve & (delta > 0) & (delta <= tolerance))[0]
+
+    def snap(self, grid=1.0):
+        np = require_numpy()
+        grid = float(grid) or 1.0
+        self.xy = np.round(self.xy / grid) * grid
+        return self
+
+    def translate(self, dx=0.0, dy=0.0):
+        self.xy = self.xy + (float(dx), float(dy))
+        return self
+
+    def changed(self):
+        np = require_numpy()
+        return np.nonzero((self.xy != self.original).any(axis=1))[0]
+
+    def write(self):
+        """Write changed coordinates back to the layer inside one change block; returns the number of nodes written."""
+        indices = self.changed()
+        if not len(indices):
+            return 0
+        try:
+            self.layer.beginChanges()
+        except Exception:
+            pass
+        try:
+            for i in indices.tolist():
+                self.nodes[i].position = FN.NSMakePoint(float(self.xy[i, 0]), float(self.xy[i, 1]))
+        finally:
+            try:
+                self.layer.endChanges()
+            except Exception:
+                pass
+        self.original = self.xy.copy()
+        return len(indices)
+
+
+def outline_arrays(layers):
+    if getattr(layers, "paths", None) is not None:
+        return OutlineArrays(layers)
+    return [OutlineArrays(layer) for layer in layers]
+
+
+def benchmark_outline_helpers(layers, repeat=3):
+    """Times a per-node PyObjC loop against OutlineArrays for bounds, path direction and near-miss checks."""
+    layers = list(layers)
+
+    def _naive(layer, y):
+        xmin = ymin = float("inf")
+        xmax = ymax = float("-inf")
+        areas = []
+        misses = []
+        for path in layer.paths:
+            nodes = list(path.nodes)
+            area = 0.0
+            for i, node in enumerate(nodes):
+                p = node.position
+                q = nodes[(i + 1) % len(nodes)].position
+                xmin, ymin, xmax, ymax = min(xmin, p.x), min(ymin, p.y), max(xmax, p.x), max(ymax, p.y)
+                area += p.x * q.y - q.x * p.y
+                if str(node.type) != "offcurve" and 0 < abs(p.y - y) <= 2.0:
+                    misses.append(node)
+            areas.append(area * 0.5)
+        return (xmin, ymin, xmax, ymax), areas, misses
+
+    def _vectorized(layer, y):
+        arrays = OutlineArrays(layer)
+        return arrays.bounds(), arrays.signed_areas(), arrays.near_misses(y)
+
+    timings = {}
+    for label, fn in (("per-node loop", _naive), ("OutlineArrays", _vectorized)):
+        best = float("inf")
+        for _ in range(max(1, int(repeat))):
+            started = time.perf_counter()
+            for layer in layers:
+                fn(layer, 0.0)
+            best = min(best, time.perf_counter() - started)
+        timings[label] = best * 1000.0
+    nodes = sum(len(p.nodes) for layer in layers for p in layer.paths)
+    speedup = timings["per-node loop"] / timings["OutlineArrays"] if timings["OutlineArrays"] else 0.0
+    return {"layers": len(layers), "nodes": nodes, "ms": timings, "speedup": speedup}
+
+
+_PROFILE_SKIP = ("<built-in method builtins.exec>", "<method 'disable' of '_lsprof.Profiler' objects>")
+
+
+def profile_report(profiler, snapshot=None, peak=None, top=PROFILE_TOP_N, alloc_top=PROFILE_ALLOC_TOP_N):
+    """Top functions by cumulative time and, with a tracemalloc snapshot, the largest allocation sites."""
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+        if name in _PROFILE_SKIP:
+            continue
+        label = name if filename == "~" else "%s:%d(%s)" % (os.path.basename(filename), line, name)
+        rows.append({"function": label, "calls": nc if nc == cc else "%d/%d" % (nc, cc), "tottime": tt, "cumtime": ct})
+    rows.sort(key=lambda r: -r["cumtime"])
+    report = {"totalTime": stats.total_tt, "functions": rows[:top], "functionCount": len(rows)}
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+        sites = []
+        for stat in snapshot.statistics("lineno")[:alloc_top]:
+            frame = stat.traceback[0]
+            sites.append({"site": "%s:%d" % (os.path.basename(frame.filename), frame.lineno), "size": stat.size, "count": stat.count})
+        report["allocations"] = sites
+        if peak is not None:
+            report["peakMemory"] = peak
+    return report
+
+
+def save_profile_stats(profiler):
+    """Dump raw pstats data so runs can be compared later with pstats; keeps the newest files only."""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, "%s-%s.prof" % (time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:6]))
+        profiler.dump_stats(path)
+        files = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+        for old in files[:-PROFILE_KEEP_FILES]:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        return path
+    except Exception:
+        return ""
+
+
 BRIDGE_CLASS_NAME = "GlyphsGPTwithChatBridge"
 try:
     GlyphsGPTwithChatBridge = objc.lookUpClass(BRIDGE_CLASS_NAME)
@@ -973,12 +4228,13 @@ except objc.nosuchclass_error:
                     self.owner.send_state()
                     self.owner.send_tabs()
                     self.owner.send_hydrate()
+                    self.owner.send_mcp_status()
                 elif msgType == "ask":
                     self.owner.handle_ask(payload)
                 elif msgType == "stop":
                     self.owner.stop_run()
                 elif msgType == "exec":
-                    self.owner.handle_exec(payload.get("code", ""))
+                    self.owner.handle_exec(payload.get("code", ""), profile=bool(payload.get("profile")), traceMemory=bool(payload.get("traceMemory")))
                 elif msgType == "copyToMacro":
                     self.owner.copy_to_macro(payload.get("code", ""))
                 elif msgType == "openMacro":
@@ -999,6 +4255,12 @@ except objc.nosuchclass_error:
                     self.owner.post_blank_snippet()
                 elif msgType == "deleteMessage":
                     self.owner.delete_message(str(payload.get("id") or ""))
+                elif msgType == "rendered":
+                    self.owner.on_rendered(payload.get("traceId", ""), payload.get("ms", 0))
+                elif msgType == "readLog":
+                    self.owner.read_log(payload.get("path", ""), payload.get("offset", 0))
+                elif msgType == "getDiagnostics":
+                    self.owner.send_diagnostics()
             except Exception as e:
                 try:
                     self.owner.send_error("Bridge error: %s\n%s" % (e, traceback.format_exc()))
@@ -1008,24 +4270,50 @@ except objc.nosuchclass_error:
 
 class GlyphsGPTwithChat(object):
 
-    def __init__(self):
+    def __init__(self, headless=False):
+        # headless (benchmarks/headless.py): no window, no MCP polling, no Glyphs callbacks.
         self._script_build = SCRIPT_BUILD
         self.window = None
         self.web = None
         self.bridge = None
         self.codexProcess = None
+        self.codexSession = None
+        self.codexPool = CodexSessionPool()
+        self.mcpClient = McpClient()
+        self.mcpMonitor = McpHealthMonitor(on_change=self._on_mcp_status)
+        if not headless:
+            self.mcpMonitor.start()
+        self.toolCache = ToolResultCache()
+        self._execRunner = None
+        self._execEnvMs = None
+        self._macroViewRef = None
+        self._macroObserver = None
+        self._macroWalkFailed = False
+        self._macroStats = {"hits": 0, "lookups": 0, "walks": 0}
+        self._activeRun = None
+        self._pendingTraces = collections.OrderedDict()
+        self._fontToken = None
+        self._fontMaybeChanged = True
+        if not headless:
+            self._watch_document_changes(True)
+        self.usageLedger = UsageLedger()
         self._busy = False
         self.active = 0
         self.sessions = []
         self._pageReady = False
         self._pendingMessages = []
+        self.snippets = SnippetIndex()
+        self._summarizing = set()
         self._load_store()
-        self._build_ui()
+        self._rebuild_snippet_index()
+        if not headless:
+            self._build_ui()
 
     # ---------- persistence ----------
     def _default_session(self, index=1):
         ses = copy.deepcopy(SESSION_DEFAULTS)
         ses["name"] = "Chat %d" % index
+        ses["sid"] = uuid.uuid4().hex
         ses["history"] = []
         return ses
 
@@ -1034,6 +4322,7 @@ class GlyphsGPTwithChat(object):
         if isinstance(s, dict):
             out.update({
                 "name": str(s.get("name") or out["name"]),
+                "sid": str(s.get("sid") or out["sid"]),
                 "mode": str(s.get("mode") or out["mode"]).lower(),
                 "server": str(s.get("server") or out["server"]),
                 "model": str(s.get("model") or out["model"]),
@@ -1043,7 +4332,12 @@ class GlyphsGPTwithChat(object):
                 "theme": str(s.get("theme") or out["theme"]),
                 "reasoning": normalize_reasoning_value(str(s.get("provider") or out["provider"]), s.get("reasoning") or out["reasoning"]),
                 "copyToMacro": bool(s.get("copyToMacro", out["copyToMacro"])),
+                "geometryContext": bool(s.get("geometryContext", out["geometryContext"])),
+                "summaryModel": str(s.get("summaryModel") or out["summaryModel"]),
             })
+            summary = objc_to_py(s.get("summary") or {})
+            if isinstance(summary, dict) and str(summary.get("text") or "").strip():
+                out["summary"] = {"text": str(summary.get("text") or ""), "upto": str(summary.get("upto") or "")}
             if out["mode"] not in ("direct", "code"):
                 out["mode"] = DEFAULT_MODE
             if out["provider"] not in ("codex", "openai", "anthropic", "openai_compat"):
@@ -1053,12 +4347,15 @@ class GlyphsGPTwithChat(object):
             hist = []
             for item in objc_to_py(s.get("history") or []):
                 if isinstance(item, dict):
-                    hist.append({
+                    entry = {
                         "id": str(item.get("id") or uuid.uuid4().hex),
                         "role": str(item.get("role") or "assistant"),
                         "kind": str(item.get("kind") or "text"),
                         "content": str(item.get("content") or ""),
-                    })
+                    }
+                    if isinstance(item.get("meta"), dict) and item.get("meta"):
+                        entry["meta"] = item.get("meta")
+                    hist.append(entry)
             out["history"] = hist
         return out
 
@@ -1081,6 +4378,10 @@ class GlyphsGPTwithChat(object):
         self.active = max(0, min(self.active, len(self.sessions) - 1))
 
     def _save_store(self):
+        with trace_span("store.save"):
+            self._write_store()
+
+    def _write_store(self):
         try:
             ensure_dir(STATE_DIR)
             tmp = STATE_PATH + '.tmp'
@@ -1095,17 +4396,46 @@ class GlyphsGPTwithChat(object):
     def cur(self):
         return self.sessions[self.active]
 
-    def _record(self, role, content, kind="text"):
+    def _record(self, role, content, kind="text", meta=None):
         item_id = uuid.uuid4().hex
-        self.cur().setdefault("history", []).append({
+        item = {
             "id": item_id,
             "role": str(role),
             "kind": str(kind or "text"),
             "content": str(content or ""),
-        })
+        }
+        if meta:
+            item["meta"] = meta
+        self.cur().setdefault("history", []).append(item)
+        if kind == "code" and role == "assistant" and str(content or "").strip():
+            self.snippets.add(item_id, self._last_user_prompt(), content)
         self._save_store()
         return item_id
 
+    # ---------- snippet index ----------
+    def _rebuild_snippet_index(self):
+        self.snippets.clear()
+        for ses in self.sessions:
+            prompt = ""
+            for item in ses.get("history", []):
+                if not isinstance(item, dict):
+                    continue
+                role = str(item.get("role") or "")
+                if role == "user":
+                    prompt = str(item.get("content") or "")
+                elif role == "assistant" and str(item.get("kind") or "") == "code":
+                    self.snippets.add(str(item.get("id") or ""), prompt, item.get("content"))
+
+    def _snippet_context(self, query, exclude_limit=12):
+        exclude = set(str(item.get("id") or "") for item in self.cur().get("history", [])[-exclude_limit:] if isinstance(item, dict))
+        out = []
+        for _, _, prompt, code in self.snippets.search(query, k=SNIPPET_TOP_K, exclude=exclude):
+            if len(code) > SNIPPET_MAX_CHARS:
+                code = code[:SNIPPET_MAX_CHARS].rstrip() + "\n# …"
+            prompt = " ".join(str(prompt or "").split())[:200]
+            out.append("Request: %s\n```python\n%s\n```" % (prompt or "(unknown)", code))
+        return "\n\n".join(out)
+
     # ---------- session / tab UI ----------
     def _session_ui_state(self):
         s = self.cur()
@@ -1119,6 +4449,8 @@ class GlyphsGPTwithChat(object):
             "theme": s.get("theme", DEFAULT_THEME),
             "reasoning": s.get("reasoning", DEFAULT_REASONING),
             "copyToMacro": bool(s.get("copyToMacro", False)),
+            "geometryContext": bool(s.get("geometryContext", False)),
+            "summaryModel": s.get("summaryModel", ""),
         }
 
     def send_tabs(self):
@@ -1151,6 +4483,8 @@ class GlyphsGPTwithChat(object):
         ses["apiKey"] = src.get("apiKey", "")
         ses["theme"] = src.get("theme", DEFAULT_THEME)
         ses["copyToMacro"] = bool(src.get("copyToMacro", False))
+        ses["geometryContext"] = bool(src.get("geometryContext", False))
+        ses["summaryModel"] = src.get("summaryModel", "")
         self.sessions.append(ses)
         self.active = len(self.sessions) - 1
         self._save_store()
@@ -1165,9 +4499,11 @@ class GlyphsGPTwithChat(object):
         if len(self.sessions) == 1:
             self.clear_chat()
             return
+        self.codexPool.close(self.sessions[idx].get("sid"))
         del self.sessions[idx]
         if self.active >= len(self.sessions):
             self.active = len(self.sessions) - 1
+        self._rebuild_snippet_index()
         self._save_store()
         self.send_tabs()
         self.send_state()
@@ -1186,6 +4522,9 @@ class GlyphsGPTwithChat(object):
 
     def clear_chat(self):
         self.cur()["history"] = []
+        self.cur()["summary"] = {}
+        self.codexPool.close(self.cur().get("sid"))
+        self._rebuild_snippet_index()
         self._save_store()
         self.send_hydrate()
 
@@ -1203,6 +4542,8 @@ class GlyphsGPTwithChat(object):
         if len(new) == len(old):
             return
         cur["history"] = new
+        self.snippets.remove(message_id)
+        self.codexPool.close(cur.get("sid"))
         self._save_store()
         self.send_hydrate()
 
@@ -1228,6 +4569,10 @@ class GlyphsGPTwithChat(object):
             cur["server"] = str(settings.get("server") or cur.get("server") or DEFAULT_SERVER)
         if "copyToMacro" in settings:
             cur["copyToMacro"] = bool(settings.get("copyToMacro"))
+        if "geometryContext" in settings:
+            cur["geometryContext"] = bool(settings.get("geometryContext"))
+        if "summaryModel" in settings:
+            cur["summaryModel"] = str(settings.get("summaryModel") or "").strip()
         self._save_store()
         self.send_state()
 
@@ -1301,9 +4646,37 @@ class GlyphsGPTwithChat(object):
     def send_state(self):
         self.send("state", self._session_ui_state())
 
-    def set_busy(self, busy, message=None):
+    def _provider_origin(self, provider, cur):
+        base = str(cur.get("apiBase") or "").strip()
+        if not base:
+            base = {"openai": "https://api.openai.com", "anthropic": "https://api.anthropic.com"}.get(provider, "http://127.0.0.1:1234")
+        return endpoint_origin(base)
+
+    def _busy_outlook(self, provider, cur, trace=None, label=None):
+        message = "Running %s…" % (label or provider)
+        outlook = latency_stats().outlook(self._provider_origin(provider, cur), cur.get("model") or None)
+        if outlook is None:
+            return message
+        p50, p95, degraded = outlook
+        if degraded:
+            return "%s ⚠ endpoint degraded: %s" % (message, degraded)
+        if p50 is not None:
+            message += " (usually ~%.1f s)" % (p50 / 1000.0)
+        if p95 and trace is not None:
+            timer = threading.Timer(p95 / 1000.0 * SLOW_RUN_FACTOR, lambda: callAfter(self._flag_slow_run, trace, provider, p95))
+            timer.daemon = True
+            timer.start()
+        return message
+
+    def _flag_slow_run(self, trace, provider, p95):
+        run = self._activeRun
+        if run is None or run.trace is not trace or run.stopped:
+            return
+        self.set_busy(True, "Running %s… ⚠ slower than usual (%.1f s so far, p95 %.1f s)" % (provider, time.monotonic() - trace.t0, p95 / 1000.0))
+
+    def set_busy(self, busy, message=None, stoppable=False):
         self._busy = bool(busy)
-        self.send("busy", {"busy": self._busy, "message": message or ("Running…" if busy else "Ready")})
+        self.send("busy", {"busy": self._busy, "message": message or ("Running…" if busy else "Ready"), "stoppable": bool(busy and stoppable)})
 
     def send_error(self, message, record=True):
         item_id = self._record("assistant", "ERROR\n" + str(message), "text") if record else ""
@@ -1375,47 +4748,258 @@ class GlyphsGPTwithChat(object):
             except Exception:
                 pass
             try:
-                if font.currentTab is not None and getattr(font.currentTab, "text", None):
-                    lines.append("Current tab text: %s" % font.currentTab.text)
+                if font.currentTab is not None and getattr(font.currentTab, "text", None):
+                    lines.append("Current tab text: %s" % font.currentTab.text)
+            except Exception:
+                pass
+            try:
+                self._sync_font_changes(font)
+                idx = font_index_for(font)
+                if idx is not None:
+                    lines.append(idx.summary(selected=selected))
+            except Exception:
+                pass
+        except Exception as e:
+            lines.append("Font context unavailable: %s" % e)
+        return "\n".join(lines)
+
+    def _prompt_context(self):
+        ctx = self._font_context()
+        if self.cur().get("geometryContext"):
+            try:
+                font = Glyphs.font
+                geo = selection_geometry_context(list(font.selectedLayers) if font is not None else [])
+            except Exception as e:
+                geo = "Geometry unavailable: %s" % e
+            if geo:
+                ctx += "\n\nSelected layer geometry (L/C/Q on-curve, o off-curve, Z closed path):\n" + geo
+        return ctx
+
+    def _mcp_is_alive(self):
+        return self.mcpMonitor.cached()
+
+    def _on_mcp_status(self, snapshot):
+        if not snapshot.get("alive"):
+            self.mcpClient.reset()
+        callAfter(self.send, "mcpStatus", snapshot)
+
+    def send_mcp_status(self):
+        self.send("mcpStatus", self.mcpMonitor.snapshot())
+
+    def _watch_document_changes(self, enable):
+        import GlyphsApp as GA
+        if getattr(self, "_docCallback", None) is None:
+            self._docCallback = self._on_document_change
+            self._updateCallback = self._on_interface_update
+        for event, callback in (("UPDATEINTERFACE", self._updateCallback), ("DOCUMENTACTIVATED", self._docCallback), ("DOCUMENTCLOSED", self._docCallback)):
+            try:
+                if enable:
+                    GA.Glyphs.addCallback(callback, getattr(GA, event))
+                else:
+                    GA.Glyphs.removeCallback(callback, getattr(GA, event))
             except Exception:
                 pass
-        except Exception as e:
-            lines.append("Font context unavailable: %s" % e)
-        return "\n".join(lines)
 
-    def _mcp_is_alive(self):
-        raw = http_get("http://127.0.0.1:9680/mcp/", headers={"Accept": "application/json"}, timeout=1.5)
-        return raw is not None
+    def _on_document_change(self, *args):
+        self.toolCache.invalidate("document changed")
+        mark_font_indexes_dirty()
+        self._fontToken = None
+
+    def _on_interface_update(self, *args):
+        # Fires on redraws and selection changes too; only note that the font
+        # may have changed and let _sync_font_changes() check the glyph stamps.
+        self._fontMaybeChanged = True
+
+    def _sync_font_changes(self, font):
+        """Flush the tool cache and font index if the font was edited since the last check."""
+        if not self._fontMaybeChanged and self._fontToken is not None:
+            return
+        self._fontMaybeChanged = False
+        try:
+            token = font_change_token(font)
+        except Exception:
+            token = None
+        if token is None or token != self._fontToken:
+            self.toolCache.invalidate("font edited")
+            mark_font_indexes_dirty()
+        self._fontToken = token
+
+    def _diagnostics(self):
+        cache = self.toolCache.snapshot()
+        stats = cache["stats"]
+        rows = [
+            ["Hit rate", "%.0f%% (%d hits / %d misses)" % (cache["hitRate"] * 100.0, stats["hits"], stats["misses"])],
+            ["Entries", "%d of %d" % (cache["entries"], self.toolCache.size)],
+            ["Font revision", str(cache["revision"])],
+            ["Invalidations", "%d%s" % (stats["invalidations"], (" · last: %s" % cache["lastInvalidation"]) if cache["lastInvalidation"] else "")],
+            ["Evictions", str(stats["evictions"])],
+        ]
+        for t in cache["tools"][:12]:
+            total = t["hits"] + t["misses"]
+            rows.append([t["tool"], "%d/%d hits" % (t["hits"], total)])
+        mcp = self.mcpMonitor.snapshot()
+        execRows = [
+            ["Last env build", "%.2f ms" % self._execEnvMs if self._execEnvMs is not None else "(not run yet)"],
+            ["Names resolved", "%d cached, %d unknown" % (len(_EXEC_NAMES), len(_EXEC_NAMES_MISSING))],
+            ["Compiled code cache", "%d of %d · %d hits / %d misses" % (len(_CODE_CACHE), CODE_CACHE_SIZE, _CODE_CACHE_STATS["hits"], _CODE_CACHE_STATS["misses"])],
+            ["Macro text view", "%d cached / %d lookups / %d tree walks" % (self._macroStats["hits"], self._macroStats["lookups"], self._macroStats["walks"])],
+        ]
+        return {"sections": [
+            {"title": "Tool result cache", "rows": rows},
+            {"title": "Run environment", "rows": execRows},
+            {"title": "Glyphs MCP", "rows": [["URL", str(mcp.get("url") or DEFAULT_GLYPHS_MCP_URL)], ["Status", {True: "reachable", False: "down"}.get(mcp.get("alive"), "checking")]]},
+        ] + self._usage_diagnostics() + self._latency_diagnostics() + self._cassette_diagnostics()}
+
+    def _latency_diagnostics(self):
+        rows = []
+        for row in latency_stats().snapshot()[:12]:
+            if row["p50"] is None:
+                text = "%d call(s), none succeeded" % row["calls"]
+            else:
+                text = "%d call(s) · p50 %.1f s · p99 %.1f s" % (row["calls"], row["p50"] / 1000.0, row["p99"] / 1000.0)
+                if row["samples"] >= LATENCY_MIN_SAMPLES:
+                    text += " · timeout %.0f s" % latency_stats().timeout_for(row["key"], 0)
+            if row["degraded"]:
+                text += " · ⚠ %s" % row["degraded"]
+            rows.append([row["key"], text])
+        return [{"title": "Provider latency", "rows": rows}] if rows else []
+
+    def _usage_diagnostics(self):
+        data = self.usageLedger.snapshot()
+        cur = self.cur()
+        tab = data["tabs"].get(cur.get("sid", ""))
+        rows = [["This tab", usage_summary(tab) if tab else "(no usage yet)"]]
+        if data["tabs"]:
+            total = {"cost": sum(float(b.get("cost") or 0.0) for b in data["tabs"].values())}
+            for key in _USAGE_FIELDS + ("calls", "asks", "unpriced"):
+                total[key] = sum(int(b.get(key) or 0) for b in data["tabs"].values())
+            rows.append(["All tabs", usage_summary(total)])
+        models = sorted(data["models"].items(), key=lambda kv: -float(kv[1].get("cost") or 0.0))
+        modelRows = [[name, usage_summary(bucket)] for name, bucket in models[:10]]
+        days = sorted(data["days"].items(), reverse=True)[:7]
+        dayRows = [[day, usage_summary(bucket)] for day, bucket in days]
+        sections = [{"title": "Token usage", "rows": rows}]
+        if modelRows:
+            sections.append({"title": "Usage by provider and model", "rows": modelRows})
+        if dayRows:
+            sections.append({"title": "Usage, last 7 days", "rows": dayRows})
+        return sections
+
+    def _cassette_diagnostics(self):
+        cassette = active_cassette()
+        if cassette is None:
+            return []
+        snap = cassette.snapshot()
+        rows = [["Mode", snap["mode"]], ["File", snap["path"]]]
+        if snap["mode"] == "replay":
+            rows.append(["Played", "%d of %d · %d unmatched" % (snap["played"], snap["available"], snap["misses"])])
+            rows.append(["Speed", "%gx" % snap["speed"] if snap["speed"] > 0 else "no delays"])
+        else:
+            rows.append(["Recorded", str(snap["recorded"])])
+        return [{"title": "Cassette", "rows": rows}]
+
+    def send_diagnostics(self):
+        self.send("diagnostics", self._diagnostics())
+
+    @objc.python_method
+    def _finish_mcp_down(self, run):
+        if self._activeRun is run:
+            self._activeRun = None
+        if run.trace is not None:
+            self._close_trace(run.trace, error=True)
+        self.set_busy(False, "Ready")
+        self.send_error(
+            "Glyphs MCP server is not responding at %s\n"
+            "In Glyphs, run: Edit → Start Glyphs MCP Server" % DEFAULT_GLYPHS_MCP_URL
+        )
 
     def _history_for_prompt(self, limit=12):
-        items = self.cur().get("history", [])[-limit:]
+        history = self.cur().get("history", [])
+        items = history[-limit:]
         out = []
+        if len(history) > limit:
+            summary = str((self.cur().get("summary") or {}).get("text") or "").strip()
+            if summary:
+                out.append("[EARLIER CONVERSATION SUMMARY]\n%s" % summary)
         for item in items:
-            if not isinstance(item, dict):
-                continue
-            role = str(item.get("role") or "assistant").upper()
-            kind = str(item.get("kind") or "text")
-            content = str(item.get("content") or "").strip()
-            if not content:
-                continue
-            if role == "SYSTEM" and (content.startswith("Execution output") or content == "Stopped."):
-                continue
-            if kind == "code":
-                content = "```python\n%s\n```" % content
-            out.append("[%s]\n%s" % (role, content))
+            text = self._format_history_item(item)
+            if text:
+                out.append(text)
         return "\n\n".join(out)
 
-    def _build_prompt(self, provider, mode, server, userPrompt):
-        ctx = self._font_context()
-        hist = self._history_for_prompt()
+    def _format_history_item(self, item):
+        if not isinstance(item, dict):
+            return ""
+        role = str(item.get("role") or "assistant").upper()
+        kind = str(item.get("kind") or "text")
+        content = str(item.get("content") or "").strip()
+        if not content:
+            return ""
+        if role == "SYSTEM" and (content.startswith("Execution output") or content == "Stopped."):
+            return ""
+        if kind == "code":
+            content = "```python\n%s\n```" % content
+        return "[%s]\n%s" % (role, content)
+
+    def _history_since(self, item_id, skip_id=None, limit=12):
+        """Formatted tab history after item_id, or None when item_id is gone or too far back."""
+        history = self.cur().get("history", [])
+        if not item_id:
+            return None
+        for pos in range(len(history) - 1, -1, -1):
+            if isinstance(history[pos], dict) and history[pos].get("id") == item_id:
+                break
+        else:
+            return None
+        items = [item for item in history[pos + 1:] if not (isinstance(item, dict) and item.get("id") == skip_id)]
+        if len(items) > limit:
+            return None
+        return "\n\n".join(text for text in (self._format_history_item(item) for item in items) if text)
+
+    def _outline_helpers_prompt(self):
+        if _numpy() is None:
+            return ""
+        return (
+            "For geometry over many nodes (bounds, overshoot checks, path direction, snapping, shifting), use "
+            "outlineArrays(layer) (or a list of layers; defaults to the selection). It returns OutlineArrays with "
+            ".xy (N x 2 NumPy array), .oncurve mask, .starts path offsets, .bounds(), .signed_areas() / .clockwise(), "
+            ".near_misses(y, tolerance), .snap(grid), .translate(dx, dy) and .write() to store changed nodes in bulk. "
+            "numpy is importable.\n"
+        )
+
+    def _build_prompt(self, provider, mode, server, userPrompt, history=True, context=None):
+        ctx = self._prompt_context() if context is None else context
+        if history is True:
+            hist = self._history_for_prompt()
+        else:
+            # A warm Codex session already holds the turns it ran; history carries the ones it missed.
+            hist = "(earlier turns kept in this Codex session)" + ("\n\n" + history if history else "")
         if mode == "code":
+            snippets = self._snippet_context(userPrompt or self._last_user_prompt())
             return (
                 "You are in CODE mode for Glyphs.\n"
                 "Return only Python code for Glyphs 3 Python 3.11.\n"
                 "Do NOT include explanation.\n"
                 "Do NOT include markdown fences unless necessary.\n"
                 "Include all required imports.\n"
-                "Prefer current font and current selection rather than hard-coded paths.\n\n"
+                "Prefer current font and current selection rather than hard-coded paths.\n"
+                "For edits over many glyphs, define a per-glyph function and call runBatch(fn, glyphs) (glyphs defaults to font.glyphs; "
+                "layers are accepted too). It processes chunks with interface updates off, one undo step per glyph, reports progress, "
+                "skips failing glyphs and returns {'done', 'total', 'failed', 'errors'}.\n%s\n"
+                "Glyphs context:\n%s\n\n"
+                "Relevant earlier snippets (adapt them when they fit):\n%s\n\n"
+                "Recent tab history:\n%s\n\n"
+                "Current request:\n%s"
+            ) % (self._outline_helpers_prompt(), ctx, snippets or "(none)", hist or "(none)", userPrompt)
+        if provider == "api_mcp":
+            return (
+                "You are controlling Glyphs through tools, which are available to you as functions.\n"
+                "Prefer the built-in tools (get_font_info, list_glyphs, get_layer, set_metrics, modify_layer, get_kerning, set_kerning, select_glyphs); "
+                "use Glyphs MCP tools only for what they do not cover.\n"
+                "Call tools whenever the request depends on the current font, selection, tab, layers, paths, or any mutable Glyphs state.\n"
+                "When several tool calls do not depend on each other, request them in the same turn.\n"
+                "Do not return Python code unless explicitly asked.\n"
+                "Return a concise summary of what you changed or found.\n\n"
                 "Glyphs context:\n%s\n\n"
                 "Recent tab history:\n%s\n\n"
                 "Current request:\n%s"
@@ -1441,7 +5025,7 @@ class GlyphsGPTwithChat(object):
         ) % (ctx, hist or "(none)", userPrompt)
 
     def _build_lmstudio_direct_system_prompt(self, plugin_id):
-        ctx = self._font_context()
+        ctx = self._prompt_context()
         hist = self._history_for_prompt()
         return (
             "You are controlling Glyphs through LM Studio with MCP access.\n"
@@ -1465,6 +5049,7 @@ class GlyphsGPTwithChat(object):
             "exec",
             "--skip-git-repo-check",
             "--dangerously-bypass-approvals-and-sandbox",
+            "--json",
             "--output-last-message", outputPath,
         ])
         if model:
@@ -1472,6 +5057,137 @@ class GlyphsGPTwithChat(object):
         cmd.append("-")
         return cmd
 
+    # ---------- rolling summary ----------
+    def _summary_pending(self, ses, window=SUMMARY_WINDOW):
+        history = [item for item in ses.get("history", []) if isinstance(item, dict)]
+        cutoff = len(history) - window
+        if cutoff <= 0:
+            return {}, []
+        summary = dict(ses.get("summary") or {})
+        upto = str(summary.get("upto") or "")
+        start = 0
+        if upto:
+            ids = [str(item.get("id") or "") for item in history]
+            if upto in ids:
+                start = ids.index(upto) + 1
+            else:
+                summary = {}
+        return summary, [dict(item) for item in history[start:cutoff]]
+
+    def _schedule_summary(self):
+        ses = self.cur()
+        if id(ses) in self._summarizing:
+            return
+        summary, pending = self._summary_pending(ses)
+        if len(pending) < SUMMARY_MIN_BATCH:
+            return
+        self._summarizing.add(id(ses))
+        thread = threading.Thread(target=self._run_summary_thread, args=(ses, summary, pending))
+        thread.daemon = True
+        thread.start()
+
+    def _run_summary_thread(self, ses, summary, pending, batch_size=20):
+        text = str(summary.get("text") or "")
+        upto = str(summary.get("upto") or "")
+        meter = RunUsage()
+        set_current_usage(meter)
+        try:
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                text = self._summarize_batch(ses, text, batch)
+                upto = str(batch[-1].get("id") or "")
+        except Exception:
+            print(traceback.format_exc())
+        finally:
+            set_current_usage(None)
+        callAfter(self._store_summary, ses, text, upto, meter.to_dict())
+
+    def _summarize_batch(self, ses, previous, items):
+        lines = []
+        for item in items:
+            role = str(item.get("role") or "assistant").upper()
+            content = str(item.get("content") or "").strip()
+            if not _summary_item_line(item):
+                continue
+            if len(content) > SUMMARY_ITEM_CHARS:
+                content = content[:SUMMARY_ITEM_CHARS] + "…"
+            lines.append("[%s]\n%s" % (role, content))
+        if not lines:
+            return previous
+        system = (
+            "You maintain the running summary of a Glyphs type design chat.\n"
+            "Merge the new turns into the current summary.\n"
+            "Keep decisions, glyph names, numeric values, scripts that were written and open tasks.\n"
+            "Drop small talk. Answer with the updated summary only, at most 200 words."
+        )
+        user = "Current summary:\n%s\n\nNew turns:\n%s" % (previous or "(none)", "\n\n".join(lines))
+        try:
+            text = self._call_summary_model(ses, system, user)
+        except Exception:
+            text = None
+        if not str(text or "").strip():
+            return extractive_summary(previous, items)
+        return trim_summary(text)
+
+    def _call_summary_model(self, ses, system, user):
+        provider = str(ses.get("provider") or DEFAULT_PROVIDER)
+        model = str(ses.get("summaryModel") or "").strip() or str(ses.get("model") or "").strip()
+        if provider == "codex" or not model or model.lower() == "local":
+            return None
+        base = str(ses.get("apiBase") or "")
+        key = str(ses.get("apiKey") or "")
+        messages = [{"role": "user", "content": user}]
+        if provider == "anthropic":
+            return self._call_anthropic(base, key, model, system, messages)
+        if provider == "openai_compat" and not base:
+            base = "http://127.0.0.1:1234/v1"
+        elif provider == "openai_compat" and self._is_lmstudio_base(base):
+            base = self._lmstudio_root(base) + "/v1"
+        try:
+            return self._call_openai_responses(base, key, model, system, messages, timeout=60)
+        except Exception as e:
+            if self._use_chat_completions_fallback(e):
+                return self._call_openai_like(base, key, model, system, messages)
+            raise
+
+    @objc.python_method
+    def _store_summary(self, ses, text, upto, usage=None):
+        self._summarizing.discard(id(ses))
+        if usage:
+            model = str(ses.get("summaryModel") or "").strip() or str(ses.get("model") or "").strip()
+            self._account_usage(str(ses.get("provider") or DEFAULT_PROVIDER), usage, ses=dict(ses, model=model))
+        if not any(s is ses for s in self.sessions):
+            return
+        if not text.strip() or upto not in [str(item.get("id") or "") for item in ses.get("history", []) if isinstance(item, dict)]:
+            return
+        ses["summary"] = {"text": trim_summary(text), "upto": upto}
+        self._save_store()
+
+    def _build_app_server_command(self, reasoning=DEFAULT_REASONING):
+        codex = self._codex_path()
+        if not codex:
+            raise RuntimeError("Could not find Codex CLI. Checked PATH and Codex.app bundled binary.")
+        cmd = [codex]
+        effort = normalize_reasoning_value("codex", reasoning)
+        if effort != "auto":
+            cmd.extend(["--config", 'model_reasoning_effort="%s"' % effort])
+        cmd.append("app-server")
+        return cmd
+
+    def _codex_env(self):
+        env = os.environ.copy()
+        env["PATH"] = ":".join([
+            "/Applications/Codex.app/Contents/Resources",
+            "/opt/homebrew/bin",
+            "/usr/local/bin",
+            env.get("PATH", ""),
+        ])
+        return env
+
+    def _codex_session_config(self, model):
+        reasoning = normalize_reasoning_value("codex", self.cur().get("reasoning", DEFAULT_REASONING))
+        return (str(model or ""), reasoning, self._codex_path() or "")
+
     def _extract_first_code_block(self, text):
         if not text:
             return ""
@@ -1480,8 +5196,8 @@ class GlyphsGPTwithChat(object):
             return m.group(1).strip()
         return ""
 
-    def _build_api_messages(self, mode):
-        system = self._build_prompt("api", mode, self.cur().get("server", DEFAULT_SERVER), "")
+    def _build_api_messages(self, mode, tools=False, context=None):
+        system = self._build_prompt("api_mcp" if tools else "api", mode, self.cur().get("server", DEFAULT_SERVER), "", context=context)
         system = re.sub(r"\n\nCurrent request:\n\s*$", "", system)
         messages = []
         for item in self.cur().get("history", [])[-14:]:
@@ -1503,8 +5219,11 @@ class GlyphsGPTwithChat(object):
         return system, messages
 
     def _http_post_json(self, url, headers, payload, timeout=90):
-        res = http_post_json(url, payload, headers=headers, timeout=timeout)
+        key = latency_key(url, payload)
+        timeout = latency_stats().timeout_for(key, timeout)
+        res = timed_call(key, lambda: http_post_json(url, payload, headers=headers, timeout=timeout))
         if isinstance(res, dict):
+            record_usage(res)
             return res
         raise RuntimeError("Invalid JSON from %s\n%s" % (url, str(res)[:1000]))
 
@@ -1692,6 +5411,10 @@ class GlyphsGPTwithChat(object):
         return {"type": "enabled", "budget_tokens": budget}, None, max(4096, budget + 1024)
 
     def _call_openai_responses(self, apiBase, apiKey, model, system, messages, tools=None, reasoning=DEFAULT_REASONING, temperature=None, timeout=180):
+        res = self._post_openai_responses(apiBase, apiKey, model, system, self._responses_input_from_messages(messages), tools=tools, reasoning=reasoning, temperature=temperature, timeout=timeout)
+        return self._extract_responses_text(res)
+
+    def _post_openai_responses(self, apiBase, apiKey, model, system, inputItems, tools=None, reasoning=DEFAULT_REASONING, temperature=None, timeout=180):
         base = self._normalize_openai_base(apiBase, "https://api.openai.com/v1")
         if not model:
             raise RuntimeError("Set a model in Settings.")
@@ -1701,7 +5424,7 @@ class GlyphsGPTwithChat(object):
         payload = {
             "model": model,
             "instructions": system,
-            "input": self._responses_input_from_messages(messages),
+            "input": inputItems,
             "text": {"format": {"type": "text"}},
         }
         effort = self._openai_reasoning_effort(reasoning)
@@ -1712,8 +5435,7 @@ class GlyphsGPTwithChat(object):
             payload["tool_choice"] = "auto"
         if temperature is not None:
             payload["temperature"] = temperature
-        res = self._http_post_json(base + "/responses", headers, payload, timeout=timeout)
-        return self._extract_responses_text(res)
+        return self._http_post_json(base + "/responses", headers, payload, timeout=timeout)
 
     def _call_openai_like(self, apiBase, apiKey, model, system, messages):
         base = self._normalize_openai_base(apiBase, "https://api.openai.com/v1")
@@ -1861,6 +5583,10 @@ class GlyphsGPTwithChat(object):
         raise RuntimeError("LM Studio returned no message.")
 
     def _call_anthropic(self, apiBase, apiKey, model, system, messages, reasoning=DEFAULT_REASONING):
+        res = self._post_anthropic_messages(apiBase, apiKey, model, system, messages, reasoning=reasoning)
+        return "".join(part.get("text") or "" for part in (res.get("content") or []) if isinstance(part, dict) and part.get("type") == "text")
+
+    def _post_anthropic_messages(self, apiBase, apiKey, model, system, messages, tools=None, reasoning=DEFAULT_REASONING):
         if not apiKey:
             raise RuntimeError("Set an Anthropic API key in Settings.")
         if not model:
@@ -1873,73 +5599,278 @@ class GlyphsGPTwithChat(object):
             payload["thinking"] = thinking
         if output_config is not None:
             payload["output_config"] = output_config
-        res = self._http_post_json(base + "/messages", headers, payload, timeout=120)
-        return "".join(part.get("text") or "" for part in (res.get("content") or []) if isinstance(part, dict) and part.get("type") == "text")
+        if tools:
+            payload["tools"] = tools
+        return self._http_post_json(base + "/messages", headers, payload, timeout=120)
+
+    # ---------- MCP tool loop ----------
+    def _mcp_tools_ready(self):
+        if self.mcpMonitor.cached() is False:
+            return False
+        try:
+            return bool(self.mcpClient.list_tools())
+        except Exception:
+            self.mcpClient.reset()
+            return False
+
+    def _call_on_main(self, fn, timeout=MCP_CALL_TIMEOUT_S):
+        if FN.NSThread.isMainThread():
+            return fn()
+        box = {}
+        done = threading.Event()
+
+        def _run():
+            try:
+                box["value"] = fn()
+            except BaseException as e:
+                box["error"] = e
+            finally:
+                done.set()
+
+        callAfter(_run)
+        if not done.wait(timeout):
+            raise RuntimeError("Glyphs did not respond within %.0f s." % timeout)
+        if "error" in box:
+            raise box["error"]
+        return box.get("value")
+
+    def _call_native_tool(self, name, args):
+        started = time.monotonic()
+        try:
+            result = self._call_on_main(lambda: run_native_tool(name, self._font_env(), args))
+            text, is_error = json.dumps(result, ensure_ascii=False, default=str), False
+        except Exception as e:
+            text, is_error = "%s: %s" % (type(e).__name__, e), True
+        if len(text) > MCP_TOOL_RESULT_CHARS:
+            text = text[:MCP_TOOL_RESULT_CHARS] + "\n...[truncated]"
+        return text, is_error, (time.monotonic() - started) * 1000.0
+
+    def _direct_tools(self):
+        specs = []
+        names = {}
+        for spec in NATIVE_TOOLS.values():
+            names[spec["name"]] = ("native", spec["name"], not spec["mutates"])
+            specs.append({"name": spec["name"], "description": spec["description"], "schema": spec["schema"]})
+        if not self._mcp_tools_ready():
+            return specs, names
+        for tool in self.mcpClient.list_tools():
+            fname = _mcp_tool_function_name(tool.get("name"))
+            if fname in names:
+                continue
+            names[fname] = ("mcp", str(tool.get("name")), mcp_tool_is_read_only(tool))
+            schema = tool.get("inputSchema")
+            if not isinstance(schema, dict) or schema.get("type") != "object":
+                schema = {"type": "object", "properties": {}}
+            specs.append({"name": fname, "description": str(tool.get("description") or "")[:1024], "schema": schema})
+        return specs, names
+
+    def _run_tool_calls(self, calls, names, report):
+        try:
+            self._call_on_main(lambda: self._sync_font_changes(Glyphs.font))
+        except Exception:
+            pass
+        cached = set()
+        trace = current_trace()
+
+        def _one(call):
+            if trace is None:
+                return _call(call)
+            started = time.monotonic()
+            try:
+                return _call(call)
+            finally:
+                trace.add("tool:%s" % call[1], started)
+
+        def _call(call):
+            call_id, fname, args = call
+            source, tool, read_only = names.get(fname, (None, None, False))
+            if tool is None:
+                return call_id, "Unknown tool: %s" % fname, True, 0.0
+            key = self.toolCache.key(source, tool, args)
+            revision = self.toolCache.revision
+            if read_only:
+                started = time.monotonic()
+                hit = self.toolCache.get(key)
+                if hit is not None:
+                    cached.add(call_id)
+                    return call_id, hit, False, (time.monotonic() - started) * 1000.0
+            else:
+                self.toolCache.invalidate("%s (before)" % tool)
+            if source == "native":
+                text, is_error, ms = self._call_native_tool(tool, args)
+            else:
+                text, is_error, ms = self.mcpClient.call_tool(tool, args)
+            if read_only and not is_error:
+                self.toolCache.put(key, text, revision)
+            elif not read_only:
+                self.toolCache.invalidate(tool)
+                mark_font_indexes_dirty()
+                self._fontMaybeChanged = True
+            return call_id, text, is_error, ms
+
+        if len(calls) == 1:
+            results = [_one(calls[0])]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(MCP_TOOL_MAX_PARALLEL, len(calls))) as pool:
+                results = list(pool.map(_one, calls))
+        for (_, fname, _), (call_id, _, is_error, ms) in zip(calls, results):
+            source, tool = names.get(fname, ("", fname, False))[:2]
+            hit = call_id in cached
+            report.append({"tool": tool, "source": source, "ms": round(ms, 1), "error": bool(is_error), "cached": hit})
+            callAfter(self.send, "progress", {"kind": "tool", "text": "%s %s%s · %s" % ("✗" if is_error else "✓", "mcp:" if source == "mcp" else "", tool, "cached" if hit else "%.0f ms" % ms)})
+        return results
+
+    def _openai_mcp_loop(self, base, key, model, system, messages, reasoning, report):
+        specs, names = self._direct_tools()
+        tools = [{"type": "function", "name": t["name"], "description": t["description"], "parameters": t["schema"]} for t in specs]
+        items = self._responses_input_from_messages(messages)
+        for _ in range(MCP_TOOL_MAX_STEPS):
+            res = self._post_openai_responses(base, key, model, system, items, tools=tools, reasoning=reasoning)
+            output = [o for o in (res.get("output") or []) if isinstance(o, dict)]
+            calls = []
+            for o in output:
+                if str(o.get("type") or "") != "function_call":
+                    continue
+                try:
+                    args = json.loads(o.get("arguments") or "{}")
+                except Exception:
+                    args = {}
+                calls.append((str(o.get("call_id") or ""), str(o.get("name") or ""), args if isinstance(args, dict) else {}))
+            if not calls:
+                return self._extract_responses_text(res)
+            items.extend(output)
+            for call_id, text, is_error, _ in self._run_tool_calls(calls, names, report):
+                items.append({"type": "function_call_output", "call_id": call_id, "output": ("ERROR: " + text) if is_error else text})
+        raise RuntimeError("Stopped after %d tool steps without a final answer." % MCP_TOOL_MAX_STEPS)
+
+    def _anthropic_mcp_loop(self, base, key, model, system, messages, reasoning, report):
+        specs, names = self._direct_tools()
+        tools = [{"name": t["name"], "description": t["description"], "input_schema": t["schema"]} for t in specs]
+        convo = list(messages)
+        for _ in range(MCP_TOOL_MAX_STEPS):
+            res = self._post_anthropic_messages(base, key, model, system, convo, tools=tools, reasoning=reasoning)
+            content = [c for c in (res.get("content") or []) if isinstance(c, dict)]
+            calls = [(str(c.get("id") or ""), str(c.get("name") or ""), c.get("input") if isinstance(c.get("input"), dict) else {}) for c in content if c.get("type") == "tool_use"]
+            if not calls:
+                return "".join(str(c.get("text") or "") for c in content if c.get("type") == "text")
+            convo.append({"role": "assistant", "content": content})
+            convo.append({"role": "user", "content": [
+                {"type": "tool_result", "tool_use_id": call_id, "content": text, "is_error": bool(is_error)}
+                for call_id, text, is_error, _ in self._run_tool_calls(calls, names, report)
+            ]})
+        raise RuntimeError("Stopped after %d tool steps without a final answer." % MCP_TOOL_MAX_STEPS)
+
+    def _call_with_mcp_tools(self, provider, cur, system, messages, reasoning):
+        report = []
+        model = cur.get("model", "")
+        key = cur.get("apiKey", "")
+        if provider == "anthropic":
+            text = self._anthropic_mcp_loop(cur.get("apiBase", ""), key, model, system, messages, reasoning, report)
+        else:
+            if not key:
+                raise RuntimeError("Set an OpenAI API key in Settings.")
+            text = self._openai_mcp_loop(cur.get("apiBase", ""), key, model, system, messages, reasoning, report)
+        if report:
+            total = sum(r["ms"] for r in report)
+            slowest = max(report, key=lambda r: r["ms"])
+            native = sum(1 for r in report if r["source"] == "native")
+            hits = sum(1 for r in report if r["cached"])
+            run = current_run()
+            if run is not None:
+                run.note = "Ready · %d tool call(s) (%d native, %d MCP, %d cached), %.0f ms total, slowest %s %.0f ms" % (len(report), native, len(report) - native, hits, total, slowest["tool"], slowest["ms"])
+        return text
+
+    def _call_provider(self, provider, mode, cur, system, messages, reasoning):
+        useTools = mode == "direct" and provider in ("openai", "anthropic")
+        if useTools:
+            return self._call_with_mcp_tools(provider, cur, system, messages, reasoning)
+        elif provider == "anthropic":
+            return self._call_anthropic(cur.get("apiBase", ""), cur.get("apiKey", ""), cur.get("model", ""), system, messages, reasoning=reasoning)
+        else:
+            base = cur.get("apiBase", "")
+            key = cur.get("apiKey", "")
+            if provider == "openai_compat" and not base:
+                base = "http://127.0.0.1:1234/v1"
+            elif provider == "openai_compat" and self._is_lmstudio_base(base):
+                base = self._lmstudio_root(base) + "/v1"
+            elif provider == "openai" and not key:
+                raise RuntimeError("Set an OpenAI API key in Settings.")
+
+            if provider == "openai":
+                try:
+                    return self._call_openai_responses(base, key, cur.get("model", ""), system, messages, reasoning=reasoning)
+                except Exception as e:
+                    lowered = str(e or "").lower()
+                    if mode == "direct" and ("provider returned no message" in lowered or "response incomplete" in lowered):
+                        return self._call_openai_like(base, key, cur.get("model", ""), system, messages)
+                    else:
+                        raise
+            elif provider == "openai_compat" and mode == "direct" and self._is_lmstudio_base(base):
+                try:
+                    return self._call_lmstudio_responses(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), system, messages, reasoning=reasoning)
+                except Exception as e:
+                    lowered = str(e or "").lower()
+                    if reasoning != DEFAULT_REASONING and self._reasoning_rejected(e):
+                        try:
+                            return self._call_lmstudio_responses(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), system, messages, reasoning=DEFAULT_REASONING)
+                        except Exception as e2:
+                            if self._use_chat_completions_fallback(e2) or "invalid type for 'input'" in str(e2 or "").lower() or "invalid_union" in str(e2 or "").lower():
+                                return self._call_lmstudio_chat(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), self._last_user_prompt())
+                            else:
+                                raise
+                    elif self._use_chat_completions_fallback(e) or "invalid type for 'input'" in lowered or "invalid_union" in lowered:
+                        return self._call_lmstudio_chat(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), self._last_user_prompt())
+                    else:
+                        raise
+            else:
+                try:
+                    return self._call_openai_responses(base, key, cur.get("model", ""), system, messages, reasoning=reasoning)
+                except Exception as e:
+                    if provider == "openai_compat" and reasoning != DEFAULT_REASONING and self._reasoning_rejected(e):
+                        try:
+                            return self._call_openai_responses(base, key, cur.get("model", ""), system, messages, reasoning=DEFAULT_REASONING)
+                        except Exception as e2:
+                            if self._use_chat_completions_fallback(e2):
+                                return self._call_openai_like(base, key, cur.get("model", ""), system, messages)
+                            else:
+                                raise
+                    elif self._use_chat_completions_fallback(e):
+                        return self._call_openai_like(base, key, cur.get("model", ""), system, messages)
+                    else:
+                        raise
 
-    def _run_api_thread(self, provider, mode, copyToMacro):
+    def _run_api_thread(self, run, provider, mode, copyToMacro, context=None):
         text = ""
         errorText = ""
+        callStart = None
+        trace, route = run.trace, run.route
+        set_current_run(run)
         try:
-            cur = self.cur()
-            system, messages = self._build_api_messages(mode)
+            cur = dict(run.ses, **route["settings"]) if route else run.ses
+            useTools = mode == "direct" and provider in ("openai", "anthropic")
+            with trace_span("prompt.build"):
+                system, messages = self._build_api_messages(mode, tools=useTools, context=context)
             reasoning = normalize_reasoning_value(provider, cur.get("reasoning", DEFAULT_REASONING))
-            if provider == "anthropic":
-                text = self._call_anthropic(cur.get("apiBase", ""), cur.get("apiKey", ""), cur.get("model", ""), system, messages, reasoning=reasoning)
-            else:
-                base = cur.get("apiBase", "")
-                key = cur.get("apiKey", "")
-                if provider == "openai_compat" and not base:
-                    base = "http://127.0.0.1:1234/v1"
-                elif provider == "openai_compat" and self._is_lmstudio_base(base):
-                    base = self._lmstudio_root(base) + "/v1"
-                elif provider == "openai" and not key:
-                    raise RuntimeError("Set an OpenAI API key in Settings.")
-
-                if provider == "openai":
-                    try:
-                        text = self._call_openai_responses(base, key, cur.get("model", ""), system, messages, reasoning=reasoning)
-                    except Exception as e:
-                        lowered = str(e or "").lower()
-                        if mode == "direct" and ("provider returned no message" in lowered or "response incomplete" in lowered):
-                            text = self._call_openai_like(base, key, cur.get("model", ""), system, messages)
-                        else:
-                            raise
-                elif provider == "openai_compat" and mode == "direct" and self._is_lmstudio_base(base):
-                    try:
-                        text = self._call_lmstudio_responses(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), system, messages, reasoning=reasoning)
-                    except Exception as e:
-                        lowered = str(e or "").lower()
-                        if reasoning != DEFAULT_REASONING and self._reasoning_rejected(e):
-                            try:
-                                text = self._call_lmstudio_responses(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), system, messages, reasoning=DEFAULT_REASONING)
-                            except Exception as e2:
-                                if self._use_chat_completions_fallback(e2) or "invalid type for 'input'" in str(e2 or "").lower() or "invalid_union" in str(e2 or "").lower():
-                                    text = self._call_lmstudio_chat(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), self._last_user_prompt())
-                                else:
-                                    raise
-                        elif self._use_chat_completions_fallback(e) or "invalid type for 'input'" in lowered or "invalid_union" in lowered:
-                            text = self._call_lmstudio_chat(base, key, cur.get("model", ""), cur.get("server", DEFAULT_SERVER), self._last_user_prompt())
-                        else:
-                            raise
-                else:
-                    try:
-                        text = self._call_openai_responses(base, key, cur.get("model", ""), system, messages, reasoning=reasoning)
-                    except Exception as e:
-                        if provider == "openai_compat" and reasoning != DEFAULT_REASONING and self._reasoning_rejected(e):
-                            try:
-                                text = self._call_openai_responses(base, key, cur.get("model", ""), system, messages, reasoning=DEFAULT_REASONING)
-                            except Exception as e2:
-                                if self._use_chat_completions_fallback(e2):
-                                    text = self._call_openai_like(base, key, cur.get("model", ""), system, messages)
-                                else:
-                                    raise
-                        elif self._use_chat_completions_fallback(e):
-                            text = self._call_openai_like(base, key, cur.get("model", ""), system, messages)
-                        else:
-                            raise
+            callStart = time.monotonic()
+            text = self._call_provider(provider, mode, cur, system, messages, reasoning)
         except Exception:
             errorText = traceback.format_exc()
-        callAfter(self._finish_run, provider, mode, text, "", "", errorText, copyToMacro)
+        if trace is not None:
+            if callStart is not None:
+                trace.add("provider.call", callStart)
+            trace.worker_done = time.monotonic()
+        set_current_run(None)
+        callAfter(self._finish_run, run, provider, mode, text, "", "", errorText, copyToMacro)
+
+    def _route_prompt(self, prompt, cur, context=""):
+        tier, reasons = classify_prompt(prompt, cur.get("mode"), len(context or ""), len(cur.get("history") or []))
+        cand, why = choose_route(tier, route_candidates(self.sessions), lambda c: self._provider_origin(c["provider"], c))
+        if cand is None:
+            self.send_error("Model is set to \"auto\", but %s. Set a concrete model in another tab (for example a local LM Studio model and a remote one) so auto can choose between them." % why)
+            return None
+        settings = {k: cand[k] for k in ("provider", "apiBase", "apiKey", "model", "reasoning")}
+        return {"provider": cand["provider"], "model": cand["model"], "tier": tier, "local": cand["local"], "settings": settings,
+                "reason": "%s → %s" % ("; ".join(reasons) or "default", why)}
 
     def _last_user_prompt(self):
         hist = self.cur().get("history", [])
@@ -1972,6 +5903,7 @@ class GlyphsGPTwithChat(object):
             "server": server,
             "model": model,
             "copyToMacro": copyToMacro,
+            "geometryContext": bool(payload.get("geometryContext", cur.get("geometryContext", False))),
             "provider": provider,
             "apiBase": str(payload.get("apiBase") or cur.get("apiBase") or ""),
             "apiKey": str(payload.get("apiKey") or cur.get("apiKey") or ""),
@@ -1985,28 +5917,150 @@ class GlyphsGPTwithChat(object):
             self.send_error("Empty prompt.")
             return
 
-        user_id = self._record("user", prompt, "text")
-        self.send("answerText", {"text": prompt, "id": user_id})
-
         provider = cur.get("provider", DEFAULT_PROVIDER)
-        if provider == "codex" and cur["mode"] == "direct" and not self._mcp_is_alive():
-            self.send_error(
-                "Glyphs MCP server is not responding at http://127.0.0.1:9680/mcp/\n"
-                "In Glyphs, run: Edit → Start Glyphs MCP Server"
-            )
-            return
-
-        if provider == "codex":
-            finalPrompt = self._build_prompt(provider, cur["mode"], server, prompt)
-            self.set_busy(True, "Running Codex…")
-            thread = threading.Thread(target=self._run_codex_thread, args=(cur["mode"], finalPrompt, model, copyToMacro, server))
-        else:
-            self.set_busy(True, "Running %s…" % provider)
-            thread = threading.Thread(target=self._run_api_thread, args=(provider, cur["mode"], copyToMacro))
+        route = None
+        context = None
+        if provider != "codex" and str(cur.get("model") or "").strip().lower() == ROUTER_MODEL:
+            # Built once here so the router sees the context this prompt will carry;
+            # the worker reuses it instead of building it again.
+            context = self._prompt_context()
+            route = self._route_prompt(prompt, cur, context)
+            if route is None:
+                return
+            provider = route["provider"]
+        trace = RunTrace(provider, cur["mode"])
+        run = AskRun(cur, trace, route)
+        self._activeRun = run
+        set_current_trace(trace)
+        try:
+            with trace.span("ask.record"):
+                user_id = self._record("user", prompt, "text")
+                self.send("answerText", {"text": prompt, "id": user_id})
+
+            checkMcp = provider == "codex" and cur["mode"] == "direct" and not self._mcp_is_alive()
+
+            if provider == "codex":
+                with trace.span("prompt.build"):
+                    finalPrompt = self._build_prompt(provider, cur["mode"], server, prompt)
+                    warmPrompt = None
+                    if not self.codexPool.unavailable and self.codexPool.live(cur.get("sid"), self._codex_session_config(model)):
+                        missed = self._history_since(self.codexPool.synced.get(cur.get("sid")), user_id)
+                        if missed is not None:
+                            warmPrompt = self._build_prompt(provider, cur["mode"], server, prompt, history=missed)
+                self.set_busy(True, "Running Codex…", stoppable=True)
+                thread = threading.Thread(target=self._run_codex_thread, args=(run, cur["mode"], finalPrompt, model, copyToMacro, server, warmPrompt, checkMcp))
+            else:
+                if route:
+                    self.set_busy(True, self._busy_outlook(provider, dict(cur, **route["settings"]), trace, "%s (auto → %s)" % (provider, route["model"])))
+                else:
+                    self.set_busy(True, self._busy_outlook(provider, cur, trace))
+                thread = threading.Thread(target=self._run_api_thread, args=(run, provider, cur["mode"], copyToMacro, context))
+        finally:
+            set_current_trace(None)
         thread.daemon = True
         thread.start()
 
-    def _run_codex_thread(self, mode, finalPrompt, model, copyToMacro, server):
+    def _run_codex_thread(self, run, mode, finalPrompt, model, copyToMacro, server, warmPrompt=None, checkMcp=False):
+        trace = run.trace
+        set_current_run(run)
+        try:
+            if checkMcp:
+                with trace_span("mcp.probe"):
+                    alive = self.mcpMonitor.probe()
+                if not alive:
+                    self.mcpMonitor.poke()
+                    callAfter(self._finish_mcp_down, run)
+                    return
+            cassette = active_cassette()
+            if cassette is None:
+                result = self._codex_result(mode, finalPrompt, model, server, warmPrompt)
+            else:
+                result = cassette.exchange("CODEX", model or "codex", {"mode": mode, "prompt": finalPrompt}, None, lambda: list(self._codex_result(mode, finalPrompt, model, server, warmPrompt)))
+        finally:
+            if trace is not None:
+                trace.worker_done = time.monotonic()
+            set_current_run(None)
+        outputText, stdoutText, stderrText, errorText = result
+        callAfter(self._finish_run, run, "codex", mode, outputText, stdoutText, stderrText, errorText, copyToMacro)
+
+    def _codex_result(self, mode, finalPrompt, model, server, warmPrompt=None):
+        result = None
+        if not self.codexPool.unavailable:
+            with trace_span("codex.session"):
+                result = self._run_codex_session(finalPrompt, model, warmPrompt)
+        if result is None:
+            with trace_span("codex.exec"):
+                result = self._run_codex_exec(mode, finalPrompt, model, server)
+        return result
+
+    def _run_codex_session(self, finalPrompt, model, warmPrompt=None):
+        run = current_run()
+        key = (run.ses if run is not None else self.cur()).get("sid")
+        config = self._codex_session_config(model)
+        reasoning = config[1]
+
+        def _factory():
+            return CodexAppServer(self._build_app_server_command(reasoning), self._workspace_dir(), self._codex_env(), model=model)
+
+        for attempt in (0, 1):
+            try:
+                session, cold = self.codexPool.acquire(key, config, _factory)
+            except Exception as e:
+                if not self.codexPool.stats["cold"]:
+                    self.codexPool.unavailable = str(e) or "app-server unavailable"
+                if run is not None:
+                    run.note = "Ready · codex exec (app-server unavailable)"
+                return None
+            prompt = finalPrompt if (cold or not warmPrompt) else warmPrompt
+            self.codexSession = session
+            try:
+                text, interrupted = session.run_turn(prompt, on_event=self._codex_progress_handler())
+            except CodexAppServerError as e:
+                if not e.started and attempt == 0:
+                    self.codexPool.close(key)
+                    continue
+                return "", "", session.stderr_tail(), str(e)
+            finally:
+                self.codexSession = None
+            if run is not None:
+                run.sessionTurn = True
+                if interrupted:
+                    run.stopped = True
+                elif cold:
+                    run.note = "Ready · Codex session started in %.1f s" % session.startup_s
+                else:
+                    run.note = "Ready · warm Codex session (saved ~%.1f s startup, %.1f s total)" % (self.codexPool.average_startup_s(), self.codexPool.saved_s())
+            return text, "", "", ""
+        return None
+
+    def _codex_progress_handler(self):
+        state = {"partial": [], "sent": 0.0}
+        meter = current_usage()
+
+        def _on_event(kind, data):
+            if meter is not None and kind in ("turn.completed", "thread/tokenUsage/updated"):
+                meter.add(normalize_usage(data))
+            progress = codex_event_progress(kind, data)
+            if progress is None:
+                return
+            category, text = progress
+            if category == "delta":
+                state["partial"].append(text)
+                now = time.monotonic()
+                if now - state["sent"] < CODEX_PROGRESS_INTERVAL_S:
+                    return
+                state["sent"] = now
+                callAfter(self.send, "progress", {"kind": "partial", "text": "".join(state["partial"])})
+                return
+            if category == "message":
+                state["partial"] = []
+                callAfter(self.send, "progress", {"kind": "partial", "text": text})
+                return
+            callAfter(self.send, "progress", {"kind": category, "text": text})
+
+        return _on_event
+
+    def _run_codex_exec(self, mode, finalPrompt, model, server):
         stdoutText = ""
         stderrText = ""
         outputText = ""
@@ -2017,15 +6071,9 @@ class GlyphsGPTwithChat(object):
             os.close(fd)
             tmp = outputPath
             cmd = self._build_command(mode, server, model, outputPath, self.cur().get("reasoning", DEFAULT_REASONING))
-            env = os.environ.copy()
-            env["PATH"] = ":".join([
-                "/Applications/Codex.app/Contents/Resources",
-                "/opt/homebrew/bin",
-                "/usr/local/bin",
-                env.get("PATH", ""),
-            ])
+            env = self._codex_env()
             cwd = self._workspace_dir()
-            self.codexProcess = subprocess.Popen(
+            proc = subprocess.Popen(
                 cmd,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
@@ -2033,12 +6081,52 @@ class GlyphsGPTwithChat(object):
                 cwd=cwd,
                 env=env,
                 text=True,
+                bufsize=1,
             )
-            stdoutText, stderrText = self.codexProcess.communicate(finalPrompt)
+            self.codexProcess = proc
+            stderrBuf = TailBuffer()
+            stdoutBuf = TailBuffer()
+
+            def _drain_stderr():
+                try:
+                    for line in proc.stderr:
+                        stderrBuf.append(line)
+                except Exception:
+                    pass
+
+            stderrThread = threading.Thread(target=_drain_stderr)
+            stderrThread.daemon = True
+            stderrThread.start()
+            try:
+                proc.stdin.write(finalPrompt)
+                proc.stdin.close()
+            except Exception:
+                pass
+            onEvent = self._codex_progress_handler()
+            lastMessage = ""
+            for line in proc.stdout:
+                raw = line.strip()
+                if not raw:
+                    continue
+                try:
+                    event = json.loads(raw)
+                except Exception:
+                    stdoutBuf.append(line)
+                    continue
+                if not isinstance(event, dict):
+                    continue
+                progress = codex_event_progress(event.get("type"), event)
+                if progress is not None and progress[0] == "message":
+                    lastMessage = progress[1]
+                onEvent(event.get("type"), event)
+            proc.wait()
+            stderrThread.join(1.0)
+            stdoutText = lastMessage or stdoutBuf.text()
+            stderrText = stderrBuf.text()
             if os.path.exists(outputPath):
                 with open(outputPath, "r", encoding="utf-8", errors="ignore") as f:
                     outputText = f.read()
-            if self.codexProcess.returncode not in (0, None):
+            if proc.returncode not in (0, None):
                 if not outputText.strip() and stderrText.strip():
                     errorText = stderrText.strip()
         except Exception:
@@ -2050,55 +6138,189 @@ class GlyphsGPTwithChat(object):
                     os.remove(tmp)
                 except Exception:
                     pass
-        callAfter(self._finish_run, "codex", mode, outputText, stdoutText, stderrText, errorText, copyToMacro)
+        return outputText, stdoutText, stderrText, errorText
 
     @objc.python_method
-    def _finish_run(self, provider, mode, outputText, stdoutText, stderrText, errorText, copyToMacro):
-        self.set_busy(False, "Ready")
+    def _finish_run(self, run, provider, mode, outputText, stdoutText, stderrText, errorText, copyToMacro):
+        if self._activeRun is run:
+            self._activeRun = None
+        trace = run.trace
+        if trace is not None and trace.worker_done is not None:
+            trace.add("main.dispatch", trace.worker_done)
+        set_current_trace(trace)
+        started = time.monotonic()
+        try:
+            item_id = self._finish_run_body(run, provider, mode, outputText, stdoutText, stderrText, errorText, copyToMacro)
+        finally:
+            set_current_trace(None)
+        if trace is not None:
+            trace.add("finish", started)
+            self._park_trace(trace, item_id, error=bool(errorText) or not item_id)
+
+    def _finish_run_body(self, run, provider, mode, outputText, stdoutText, stderrText, errorText, copyToMacro):
+        trace, route, note = run.trace, run.route, run.note
+        routeInfo = {k: route[k] for k in ("provider", "model", "tier", "reason")} if route else None
+        if routeInfo is not None:
+            note = "%s · auto → %s" % (note or "Ready", route["model"])
+        usage = self._account_usage(provider, run.meter.to_dict(), route, ses=run.ses)
+        if usage is not None:
+            note = "%s · %s→%s tokens · %s" % (note or "Ready", fmt_tokens(usage["input"]), fmt_tokens(usage["output"]), fmt_cost(usage["cost"]))
+        if run.stopped:
+            # The tab stayed busy ("Stopping…") until the worker returned.
+            self.send_system("Stopped.")
+            if not (outputText or "").strip():
+                self.set_busy(False, "Stopped")
+                return None
+            note = "Stopped"
+        self.set_busy(False, note or "Ready")
         if errorText:
             self.send_error(errorText)
-            return
+            return None
 
         text = (outputText or "").strip()
         if not text and (stdoutText or stderrText):
             text = ((stdoutText or "") + ("\n" + stderrText if stderrText else "")).strip()
         if not text:
             self.send_error("Provider returned no message.")
-            return
+            return None
 
+        traceId = trace.id if trace is not None else ""
         if mode == "code":
             code = extract_code_block(text)
-            item_id = self._record("assistant", code, "code")
-            self.send("answerCode", {"code": code, "id": item_id})
+            with trace_span("precompile"):
+                syntaxError = precompile_code(code) if PRECOMPILE_CODE_ANSWERS else None
+            meta = {}
+            if syntaxError:
+                meta["syntaxError"] = syntaxError
+            if usage is not None:
+                meta["usage"] = usage
+            if routeInfo is not None:
+                meta["route"] = routeInfo
+            with trace_span("history.record"):
+                item_id = self._record("assistant", code, "code", meta=meta or None)
+            with trace_span("ui.send"):
+                self.send("answerCode", {"code": code, "id": item_id, "syntaxError": syntaxError, "traceId": traceId, "route": routeInfo})
             if copyToMacro and code.strip():
-                self.copy_to_macro(code, announce=False)
+                self.copy_to_macro(code, announce=False, background=True)
         else:
-            item_id = self._record("assistant", text, "text")
-            self.send("answerText", {"text": text, "id": item_id})
+            meta = {}
+            if usage is not None:
+                meta["usage"] = usage
+            if routeInfo is not None:
+                meta["route"] = routeInfo
+            with trace_span("history.record"):
+                item_id = self._record("assistant", text, "text", meta=meta or None)
+            with trace_span("ui.send"):
+                self.send("answerText", {"text": text, "id": item_id, "traceId": traceId, "route": routeInfo})
             if copyToMacro:
                 code = self._extract_first_code_block(text)
                 if code:
-                    self.copy_to_macro(code, announce=False)
+                    self.copy_to_macro(code, announce=False, background=True)
+        if run.sessionTurn:
+            self.codexPool.mark_synced(run.ses.get("sid"), item_id)
+        self._schedule_summary()
+        return item_id
+
+    def _account_usage(self, provider, usage, route=None, ses=None):
+        if not usage:
+            return None
+        cur = ses if ses is not None else self.cur()
+        if route:
+            cur = dict(cur, **route["settings"])
+        model = cur.get("model", "") or ("codex default" if provider == "codex" else "")
+        local = provider == "openai_compat" and (not cur.get("apiBase") or _is_private_url(cur.get("apiBase")))
+        cost = usage_cost(usage, model, local=local)
+        self.usageLedger.add(cur.get("sid", ""), cur.get("name", ""), provider, model, usage, cost)
+        return dict(usage, provider=provider, model=model, cost=cost)
+
+    def _park_trace(self, trace, item_id, error=False):
+        if error or not item_id or not self._pageReady:
+            self._close_trace(trace, item_id, error=error)
+            return
+        self._pendingTraces[trace.id] = (trace, item_id)
+        while len(self._pendingTraces) > TRACE_PENDING_MAX:
+            old_id = next(iter(self._pendingTraces))
+            old, old_item = self._pendingTraces.pop(old_id)
+            self._close_trace(old, old_item)
+
+    def _close_trace(self, trace, item_id=None, error=False):
+        # The JSONL record is the durable copy; the item only carries the timing
+        # so a redraw can show it, and it reaches disk with the next regular save.
+        timing = trace.to_dict()
+        if item_id:
+            usage = None
+            for ses in self.sessions:
+                for item in ses.get("history", []):
+                    if isinstance(item, dict) and item.get("id") == item_id:
+                        meta = dict(item.get("meta") or {})
+                        meta["timing"] = timing
+                        item["meta"] = meta
+                        usage = meta.get("usage")
+                        break
+            self.send("timing", {"id": item_id, "timing": timing, "usage": usage})
+        record = dict(timing, item=item_id or "", error=bool(error))
+        threading.Thread(target=append_trace_record, args=(record,), daemon=True).start()
+
+    def on_rendered(self, traceId, renderMs):
+        entry = self._pendingTraces.pop(str(traceId or ""), None)
+        if entry is None:
+            return
+        trace, item_id = entry
+        now = time.monotonic()
+        trace.add("ui.render", now - max(0.0, float(renderMs or 0.0)) / 1000.0, now)
+        self._close_trace(trace, item_id)
 
     def stop_run(self):
+        runner = self._execRunner
+        if runner is not None:
+            runner.cancel()
+            return
+        run = self._activeRun
+        session = self.codexSession
         proc = self.codexProcess
-        if proc is None:
+        if run is None or (session is None and proc is None):
+            return
+        # The tab stays busy until the worker returns; _finish_run then reports "Stopped."
+        run.stopped = True
+        self.set_busy(True, "Stopping…")
+        if session is not None:
+            # turn/interrupt waits for the app-server's reply; keep it off the main thread.
+            threading.Thread(target=self._interrupt_codex_turn, args=(session, run.ses.get("sid")), daemon=True).start()
             return
         try:
             proc.terminate()
         except Exception:
             pass
-        self.codexProcess = None
-        self.send_system("Stopped.")
-        self.set_busy(False, "Stopped")
+
+    def _interrupt_codex_turn(self, session, key):
+        session.interrupt()
+        deadline = time.monotonic() + CODEX_STOP_GRACE_S
+        while session.busy and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if session.busy:
+            # Closing the process fails the pending turn, so the worker returns and the tab goes idle.
+            self.codexPool.close(key)
 
     # ---------- execution ----------
+    def _font_env(self):
+        """The font and selection names Run scripts and the native tools both see."""
+        import GlyphsApp as GA
+        font = GA.Glyphs.font
+        return {
+            "font": font,
+            "currentFont": font,
+            "selectedLayers": list(font.selectedLayers or []) if font is not None else [],
+            "currentTab": font.currentTab if font is not None else None,
+            "selectedFontMaster": font.selectedFontMaster if font is not None else None,
+        }
+
     def _build_exec_env(self):
         import GlyphsApp as GA
-        env = {
+        started = time.perf_counter()
+        env = ExecNamespace({
             "__builtins__": __builtins__,
             "__name__": "__main__",
-            "__file__": "<GlyphsGPT with Chat>",
+            "__file__": EXEC_FILENAME,
             "Glyphs": GA.Glyphs,
             "objc": objc,
             "AppKit": AK,
@@ -2113,28 +6335,23 @@ class GlyphsGPTwithChat(object):
             "threading": threading,
             "io": io,
             "contextlib": contextlib,
-        }
-        for module in (GA, AK, FN):
-            for name in dir(module):
-                if name.startswith("_"):
-                    continue
-                try:
-                    env[name] = getattr(module, name)
-                except Exception:
-                    pass
+        })
         try:
-            font = GA.Glyphs.font
-            env["font"] = font
-            env["currentFont"] = font
-            env["selectedLayers"] = list(font.selectedLayers) if font is not None else []
-            env["currentTab"] = font.currentTab if font is not None else None
-            env["selectedFontMaster"] = font.selectedFontMaster if font is not None else None
+            env.update(self._font_env())
+            font = env["font"]
+            env["fontIndex"] = lambda f=font: font_index_for(f)
+            env["runBatch"] = lambda fn, items=None, chunkSize=BATCH_CHUNK_SIZE, name="Batch edit", f=font: GlyphBatchRunner(f, self._batch_report, chunkSize).run(fn, items, name)
+            env["outlineArrays"] = lambda layers=None, sel=env["selectedLayers"]: outline_arrays(sel if layers is None else layers)
+            env["benchmarkOutline"] = lambda layers=None, repeat=3, sel=env["selectedLayers"]: benchmark_outline_helpers(sel if layers is None else layers, repeat)
         except Exception:
             env["font"] = None
             env["currentFont"] = None
             env["selectedLayers"] = []
             env["currentTab"] = None
             env["selectedFontMaster"] = None
+            env["fontIndex"] = lambda: None
+            env["runBatch"] = lambda fn, items=None, chunkSize=BATCH_CHUNK_SIZE, name="Batch edit": GlyphBatchRunner(None, self._batch_report, chunkSize).run(fn, items, name)
+        self._execEnvMs = (time.perf_counter() - started) * 1000.0
         return env
 
     def _append_to_macro_log(self, text):
@@ -2150,37 +6367,114 @@ class GlyphsGPTwithChat(object):
         except Exception:
             pass
 
-    def handle_exec(self, code):
-        code = str(code or "").replace("\r\n", "\n").strip()
+    def _pump_events(self):
+        app = AK.NSApplication.sharedApplication()
+        now = FN.NSDate.date()
+        for _ in range(64):
+            event = app.nextEventMatchingMask_untilDate_inMode_dequeue_(AK.NSEventMaskAny, now, FN.NSDefaultRunLoopMode, True)
+            if event is None:
+                break
+            app.sendEvent_(event)
+        FN.NSRunLoop.currentRunLoop().runMode_beforeDate_(FN.NSDefaultRunLoopMode, now)
+
+    def _exec_tick(self, runner, output):
+        text = output.take_pending()
+        if text:
+            self.send("progress", {"kind": "output", "text": text})
+        self.send("busy", {"busy": True, "message": "Running script… %.0f s" % runner.elapsed(), "stoppable": True})
+        try:
+            self._pump_events()
+        except Exception:
+            pass
+
+    def read_log(self, path, offset=0):
+        path = os.path.realpath(str(path or ""))
+        if os.path.dirname(path) != os.path.realpath(EXEC_LOG_DIR) or not os.path.isfile(path):
+            self.send("logPage", {"path": path, "offset": 0, "error": "This log file is no longer available."})
+            return
+        offset = max(0, int(offset or 0))
+        size = os.path.getsize(path)
+        with open(path, "rb") as fh:
+            fh.seek(offset)
+            data = fh.read(EXEC_LOG_PAGE_BYTES)
+        if offset + len(data) < size:
+            cut = data.rfind(b"\n")
+            if cut > 0:
+                data = data[:cut + 1]
+        self.send("logPage", {"path": path, "offset": offset, "next": offset + len(data), "size": size, "text": data.decode("utf-8", "replace")})
+
+    def _batch_report(self, text):
+        self.send("progress", {"kind": "batch", "text": text})
+
+    def _send_exec_output(self, out, meta=None, output=None):
+        log = output.finish() if output is not None else None
+        if log:
+            meta = dict(meta or {}, log=log)
+        item_id = self._record("system", "Execution output\n" + (out or "(no output)"), "text", meta=meta)
+        self.send("execResult", {"output": out or "(no output)", "id": item_id, "meta": meta or {}})
+        self._append_to_macro_log(out)
+
+    def _profile_meta(self, profiler, traceMemory):
+        snapshot = peak = None
+        if traceMemory and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        report = profile_report(profiler, snapshot, peak)
+        report["statsFile"] = save_profile_stats(profiler)
+        return {"profile": report}
+
+    def handle_exec(self, code, profile=False, traceMemory=False):
+        code = normalize_exec_source(code)
         if not code:
             self.send_error("Nothing to execute.", record=False)
             return
-        buf = io.StringIO()
+        if self._execRunner is not None or self._busy:
+            self.send_error("Wait for the current run to finish.", record=False)
+            return
+        output = ScriptOutput()
+        runner = ScriptRunner(on_tick=lambda r: self._exec_tick(r, output))
+        profiler = cProfile.Profile() if profile else None
+        traceMemory = bool(profile and traceMemory and not tracemalloc.is_tracing())
+        meta = None
+        self._execRunner = runner
+        self.set_busy(True, "Profiling script…" if profile else "Running script…", stoppable=True)
         try:
             env = self._build_exec_env()
-            compiled = compile(code, "<GlyphsGPT with Chat>", "exec")
-            with contextlib.redirect_stdout(buf), contextlib.redirect_stderr(buf):
-                exec(compiled, env, env)
-            out = buf.getvalue().strip()
-            if out:
-                item_id = self._record("system", "Execution output\n" + out, "text")
-                self.send("execResult", {"output": out, "id": item_id})
-                self._append_to_macro_log(out)
+            compiled = compile_cached(code)
+            env.preload(compiled)
+            if traceMemory:
+                tracemalloc.start()
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                try:
+                    runner.run(compiled, env, profiler=profiler)
+                finally:
+                    if profiler is not None:
+                        meta = self._profile_meta(profiler, traceMemory)
+            out = output.getvalue().strip()
+            if out or meta:
+                self._send_exec_output(out, meta, output)
+        except ScriptCancelled as e:
+            out = output.getvalue().strip()
+            self._send_exec_output(((out + "\n") if out else "") + "Stopped after %.1f s: %s" % (runner.elapsed(), e), meta, output)
         except SystemExit:
-            out = buf.getvalue().strip()
+            out = output.getvalue().strip()
             if out:
                 out += "\n"
             out += "SystemExit"
-            item_id = self._record("system", "Execution output\n" + out, "text")
-            self.send("execResult", {"output": out, "id": item_id})
-            self._append_to_macro_log(out)
+            self._send_exec_output(out, meta, output)
         except Exception:
-            out = buf.getvalue().strip()
+            out = output.getvalue().strip()
             tb = traceback.format_exc()
-            merged = ((out + "\n") if out else "") + tb
-            item_id = self._record("system", "Execution output\n" + merged, "text")
-            self.send("execResult", {"output": merged, "id": item_id})
-            self._append_to_macro_log(merged)
+            self._send_exec_output(((out + "\n") if out else "") + tb, meta, output)
+        finally:
+            output.finish()
+            if traceMemory and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._execRunner = None
+            self.toolCache.invalidate("script run")
+            mark_font_indexes_dirty()
+            self.set_busy(False, "Ready")
 
     def _walk_views(self, view):
         if view is None:
@@ -2202,7 +6496,53 @@ class GlyphsGPTwithChat(object):
         except Exception:
             pass
 
-    def _find_macro_text_view(self):
+    def _macro_view_valid(self, view):
+        try:
+            return view.window() is not None and bool(view.isEditable())
+        except Exception:
+            return False
+
+    def _invalidate_macro_view(self, *args):
+        self._macroViewRef = None
+        self._macroWalkFailed = False
+        observer = self._macroObserver
+        self._macroObserver = None
+        if observer is not None:
+            try:
+                FN.NSNotificationCenter.defaultCenter().removeObserver_(observer)
+            except Exception:
+                pass
+
+    def _cache_macro_view(self, view):
+        self._invalidate_macro_view()
+        try:
+            self._macroViewRef = objc.WeakRef(view)
+        except Exception:
+            return
+        try:
+            self._macroObserver = FN.NSNotificationCenter.defaultCenter().addObserverForName_object_queue_usingBlock_(
+                AK.NSWindowWillCloseNotification, view.window(), None, self._invalidate_macro_view)
+        except Exception:
+            self._macroObserver = None
+
+    def _macro_text_view(self, background=False):
+        ref = self._macroViewRef
+        view = ref() if ref is not None else None
+        if view is not None and self._macro_view_valid(view):
+            self._macroStats["hits"] += 1
+            return view
+        if ref is not None:
+            self._invalidate_macro_view()
+        self._macroStats["lookups"] += 1
+        walk = not (background and self._macroWalkFailed)
+        view = self._find_macro_text_view(walk=walk)
+        if view is not None:
+            self._cache_macro_view(view)
+        elif walk:
+            self._macroWalkFailed = True
+        return view
+
+    def _find_macro_text_view(self, walk=True):
         controller = None
         try:
             controller = Glyphs.delegate().macroPanelController()
@@ -2223,12 +6563,15 @@ class GlyphsGPTwithChat(object):
                 except Exception:
                     return candidate
 
+        if not walk:
+            return None
         try:
             window = controller.window()
         except Exception:
             window = None
         if window is None:
             return None
+        self._macroStats["walks"] += 1
 
         best = None
         bestScore = -1
@@ -2268,18 +6611,19 @@ class GlyphsGPTwithChat(object):
                 bestScore = score
         return best
 
-    def _set_text_view_string(self, textView, code):
+    def _set_text_view_string(self, textView, code, focus=True):
         try:
             if textView is None:
                 return False
-            try:
-                textView.window().makeKeyAndOrderFront_(None)
-            except Exception:
-                pass
-            try:
-                textView.window().makeFirstResponder_(textView)
-            except Exception:
-                pass
+            if focus:
+                try:
+                    textView.window().makeKeyAndOrderFront_(None)
+                except Exception:
+                    pass
+                try:
+                    textView.window().makeFirstResponder_(textView)
+                except Exception:
+                    pass
 
             current = ''
             try:
@@ -2326,7 +6670,7 @@ class GlyphsGPTwithChat(object):
         except Exception:
             return False
 
-    def copy_to_macro(self, code, announce=True):
+    def copy_to_macro(self, code, announce=True, background=False):
         code = (code or "").replace("\r\n", "\n").strip()
         if not code:
             self.send_error("Nothing to copy.", record=False)
@@ -2348,13 +6692,14 @@ class GlyphsGPTwithChat(object):
         except Exception:
             clipboardOK = False
 
-        self.open_macro()
+        if not background:
+            self.open_macro()
 
         def _finish_copy():
             inserted = False
             try:
-                textView = self._find_macro_text_view()
-                inserted = self._set_text_view_string(textView, code)
+                textView = self._macro_text_view(background=background)
+                inserted = self._set_text_view_string(textView, code, focus=not background)
             except Exception:
                 inserted = False
             if announce and not (clipboardOK or inserted):
@@ -2377,10 +6722,23 @@ def _get_app_singleton():
                 app.window.close()
         except Exception:
             pass
+        try:
+            if app is not None and getattr(app, 'codexPool', None) is not None:
+                app.codexPool.close_all()
+            if app is not None and getattr(app, '_macroObserver', None) is not None:
+                app._invalidate_macro_view()
+            if app is not None and getattr(app, 'mcpMonitor', None) is not None:
+                app.mcpMonitor.stop()
+            if app is not None and getattr(app, 'toolCache', None) is not None:
+                app._watch_document_changes(False)
+        except Exception:
+            pass
         app = GlyphsGPTwithChat()
         setattr(builtins, APP_SINGLETON_KEY, app)
     return app
 
 
-__GlyphsGPTwithChat__ = _get_app_singleton()
-__GlyphsGPTwithChat__.show()
+# GLYPHSGPT_HEADLESS=1 loads the module without opening the window (see benchmarks/).
+if not os.environ.get("GLYPHSGPT_HEADLESS"):
+    __GlyphsGPTwithChat__ = _get_app_singleton()
+    __GlyphsGPTwithChat__.show()
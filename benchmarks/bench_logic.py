@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for the pure-Python parts of GlyphsGPT with Chat.
+
+Runs without Glyphs (see headless.py) and times the state store, objc_to_py /
+jsonable, prompt and message building, Responses input/output conversion,
+extract_code_block and the provider fallback cascade at history sizes from 10
+to 100k messages.
+
+    python3 benchmarks/bench_logic.py                     # print a table
+    python3 benchmarks/bench_logic.py --save base.json    # record a baseline
+    python3 benchmarks/bench_logic.py --compare base.json # exit 1 on regressions
+
+Cases that only look at the tail of the history must also stay flat as the
+history grows; a case that scales with history size when it should not fails
+even without a baseline.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import headless  # noqa: E402
+
+SIZES = (10, 100, 1000, 10000, 100000)
+MIN_RUNS = 3
+MIN_SECONDS = 0.2
+NOISE_FLOOR_MS = 0.05
+FLAT_FACTOR = 3.0
+FLAT_SLACK_MS = 0.5
+
+
+def make_history(size):
+    history = []
+    for i in range(size):
+        if i % 4 == 0:
+            history.append({"id": "u%d" % i, "role": "user", "kind": "text", "content": "Make the overshoot of glyph %d match the x-height zone and keep the sidebearings." % i})
+        elif i % 4 == 1:
+            history.append({"id": "c%d" % i, "role": "assistant", "kind": "code", "content": "font = Glyphs.font\nfor layer in font.selectedLayers:\n    layer.LSB += %d\n    print(layer.parent.name, layer.width)" % (i % 7)})
+        elif i % 4 == 2:
+            history.append({"id": "s%d" % i, "role": "system", "kind": "text", "content": "Execution output:\na 520\nb 540"})
+        else:
+            history.append({"id": "a%d" % i, "role": "assistant", "kind": "text", "content": "Done. I adjusted %d layers; see the output above.\n```python\nprint(%d)\n```" % (i % 11, i)})
+    return history
+
+
+def make_responses_payload(size):
+    output = []
+    for i in range(max(1, size // 10)):
+        output.append({"type": "reasoning", "summary": [{"type": "summary_text", "text": "step %d" % i}]})
+    output.append({"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": "Line %d of the answer." % i} for i in range(size)]})
+    return {"output": output, "usage": {"input_tokens": size, "output_tokens": size}}
+
+
+def make_answer(size):
+    lines = ["Here is the script:", "```python"]
+    lines.extend("layer.paths[%d].reverse()" % i for i in range(size))
+    lines.extend(["```", "Run it with the glyphs selected."])
+    return "\n".join(lines)
+
+
+class FakeEndpoint(object):
+    """Mimics an OpenAI-compatible server that rejects `reasoning` and has no /responses."""
+
+    def __call__(self, url, headers, payload, timeout=90):
+        if url.endswith("/responses"):
+            if "reasoning" in payload:
+                raise RuntimeError("HTTP 400 from %s\nInvalid parameter: reasoning" % url)
+            raise RuntimeError("HTTP 404 from %s\nNot Found" % url)
+        return {"choices": [{"message": {"content": "print(Glyphs.font.familyName)"}}]}
+
+
+def build_cases(module):
+    """Yield (name, flat, setup(size) -> callable)."""
+
+    def session(size):
+        app = headless.make_app(module)
+        app.sessions[0]["history"] = make_history(size)
+        return app
+
+    def normalize(size):
+        app = headless.make_app(module)
+        raw = dict(app.sessions[0], history=make_history(size))
+        return lambda: app._normalize_session(raw, 1)
+
+    def save(size):
+        app = session(size)
+        return app._write_store
+
+    def load(size):
+        app = session(size)
+        app._write_store()
+        return app._load_store
+
+    def objc_to_py(size):
+        history = make_history(size)
+        return lambda: module.objc_to_py(history)
+
+    def jsonable(size):
+        history = make_history(size)
+        return lambda: module.jsonable(history)
+
+    def history_for_prompt(size):
+        app = session(size)
+        return app._history_for_prompt
+
+    def api_messages(size):
+        app = session(size)
+        return lambda: app._build_api_messages("code")
+
+    def responses_input(size):
+        app = session(size)
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": str(item["content"])} for i, item in enumerate(app.sessions[0]["history"])]
+        return lambda: app._responses_input_from_messages(messages)
+
+    def responses_text(size):
+        app = headless.make_app(module)
+        res = make_responses_payload(size)
+        return lambda: app._extract_responses_text(res)
+
+    def code_block(size):
+        text = make_answer(size)
+        return lambda: module.extract_code_block(text)
+
+    def cascade(size):
+        app = session(size)
+        app._http_post_json = FakeEndpoint()
+        cur = dict(app.sessions[0], provider="openai_compat", apiBase="http://127.0.0.1:8080/v1", model="local", reasoning="high")
+        system, messages = app._build_api_messages("code")
+        return lambda: app._call_provider("openai_compat", "code", cur, system, messages, "high")
+
+    return [
+        ("store.normalize", False, normalize),
+        ("store.save", False, save),
+        ("store.load", False, load),
+        ("objc_to_py", False, objc_to_py),
+        ("jsonable", False, jsonable),
+        ("history_for_prompt", True, history_for_prompt),
+        ("build_api_messages", True, api_messages),
+        ("responses_input", False, responses_input),
+        ("extract_responses_text", False, responses_text),
+        ("extract_code_block", False, code_block),
+        ("provider_cascade", True, cascade),
+    ]
+
+
+def measure(func):
+    times = []
+    deadline = time.perf_counter() + MIN_SECONDS
+    while len(times) < MIN_RUNS or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+
+def run(module, sizes, only=None):
+    results = {}
+    for name, flat, setup in build_cases(module):
+        if only and not any(token in name for token in only):
+            continue
+        row = results.setdefault(name, {"flat": flat, "ms": {}})
+        for size in sizes:
+            row["ms"][str(size)] = round(measure(setup(size)), 4)
+    return results
+
+
+def print_table(results, sizes):
+    print("%-24s" % "case" + "".join("%12s" % size for size in sizes) + "   (median ms)")
+    for name, row in results.items():
+        print("%-24s" % name + "".join("%12.3f" % row["ms"][str(size)] for size in sizes))
+
+
+def flat_failures(results, sizes):
+    failures = []
+    first, last = str(sizes[0]), str(sizes[-1])
+    for name, row in results.items():
+        if row["flat"] and row["ms"][last] > row["ms"][first] * FLAT_FACTOR + FLAT_SLACK_MS:
+            failures.append("%s grows with history: %.3f ms at %s vs %.3f ms at %s" % (name, row["ms"][last], last, row["ms"][first], first))
+    return failures
+
+
+def regressions(results, baseline, tolerance):
+    failures = []
+    for name, row in results.items():
+        base = (baseline.get(name) or {}).get("ms") or {}
+        for size, ms in row["ms"].items():
+            ref = base.get(size)
+            if ref is None:
+                continue
+            if ms > ref * tolerance and ms - ref > NOISE_FLOOR_MS:
+                failures.append("%s @ %s: %.3f ms vs baseline %.3f ms (x%.2f)" % (name, size, ms, ref, ms / ref if ref else float("inf")))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES), help="comma-separated history sizes")
+    parser.add_argument("--only", default="", help="comma-separated substrings of case names to run")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="fail if a case is slower than this baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown factor against the baseline")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    module = headless.load_script()
+    results = run(module, sizes, [s for s in args.only.split(",") if s.strip()])
+    print_table(results, sizes)
+
+    failures = flat_failures(results, sizes)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            failures += regressions(results, json.load(f), args.tolerance)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    for line in failures:
+        print("REGRESSION: " + line)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
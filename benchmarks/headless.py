@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Load "GlyphsGPT with Chat.py" outside Glyphs.
+
+Installs placeholder modules for objc, AppKit, Foundation, WebKit, PyObjCTools
+and GlyphsApp, then imports the script with GLYPHSGPT_HEADLESS=1 so the window
+is not created. Only the pure-Python parts (state store, prompt and message
+building, response parsing, the provider cascade) are meant to be exercised;
+anything that touches Cocoa gets an inert placeholder object.
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+import types
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "GlyphsGPTwithChat", "GlyphsGPT with Chat.py")
+
+
+class Placeholder(object):
+    """Accepts any call or attribute access and is falsy."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return Placeholder()
+
+    def __getattr__(self, name):
+        return Placeholder()
+
+    def __iter__(self):
+        return iter(())
+
+    def __bool__(self):
+        return False
+
+
+class _PlaceholderClass(type):
+    def __getattr__(cls, name):
+        return Placeholder()
+
+
+class _PlaceholderModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        value = _PlaceholderClass(name, (object,), {})
+        setattr(self, name, value)
+        return value
+
+
+class _NoSuchClass(Exception):
+    pass
+
+
+def _look_up_class(name):
+    raise _NoSuchClass(name)
+
+
+def install_placeholders():
+    objc = _PlaceholderModule("objc")
+    objc.nosuchclass_error = _NoSuchClass
+    objc.lookUpClass = _look_up_class
+    objc.python_method = lambda f: f
+    objc.super = super
+    objc.WeakRef = lambda obj: (lambda: obj)
+    sys.modules["objc"] = objc
+    for name in ("AppKit", "Foundation", "WebKit", "GlyphsApp"):
+        sys.modules[name] = _PlaceholderModule(name)
+    sys.modules["Foundation"].NSMakeRange = lambda loc, length: (loc, length)
+    sys.modules["GlyphsApp"].Glyphs = Placeholder()
+
+    tools = types.ModuleType("PyObjCTools")
+    helper = types.ModuleType("PyObjCTools.AppHelper")
+    helper.callAfter = lambda func, *args, **kwargs: func(*args, **kwargs)
+    tools.AppHelper = helper
+    sys.modules["PyObjCTools"] = tools
+    sys.modules["PyObjCTools.AppHelper"] = helper
+
+
+def load_script(home=None, path=SCRIPT_PATH):
+    """Import the script headless; state files go under `home` (a temp dir by default)."""
+    install_placeholders()
+    os.environ["GLYPHSGPT_HEADLESS"] = "1"
+    os.environ["HOME"] = home or tempfile.mkdtemp(prefix="glyphsgpt-headless-")
+    spec = importlib.util.spec_from_file_location("glyphsgpt_with_chat", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_app(module, sessions=None, active=0, mcp_url=None):
+    """An app built by the real __init__ in headless mode: no window, and the MCP monitor is not started."""
+    app = module.GlyphsGPTwithChat(headless=True)
+    # Start from the given tabs (or one empty tab), not whatever an earlier case saved under HOME.
+    app.sessions = sessions if sessions is not None else [app._default_session(1)]
+    app.active = active
+    app._rebuild_snippet_index()
+    if mcp_url:
+        app.mcpClient = module.McpClient(url=mcp_url)
+        app.mcpMonitor = module.McpHealthMonitor(url=mcp_url)
+    app.send = lambda *args, **kwargs: None
+    return app
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for the provider dispatch code against mock_provider.py.
+
+Each ask goes through the real path a tab takes after the prompt is recorded:
+_build_api_messages, then _call_provider (fallback cascade, tool loop,
+http_post_json, response parsing). Reports throughput, latency percentiles
+and errors grouped by their first line.
+
+    python3 benchmarks/load_test.py --provider openai --requests 200 --concurrency 8
+    python3 benchmarks/load_test.py --provider openai_compat --reject-reasoning --no-responses
+    python3 benchmarks/load_test.py --provider lmstudio --mode direct          # mock on :1234
+    python3 benchmarks/load_test.py --provider anthropic --mode direct --tool-calls --rate-429 0.1
+
+Pass --base to aim at an already running server instead of starting the mock.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import headless  # noqa: E402
+import mock_provider  # noqa: E402
+
+PROVIDERS = ("openai", "openai_compat", "lmstudio", "anthropic")
+LMSTUDIO_PORT = 1234
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def make_session(module, app, provider, mode, base, model, reasoning, history):
+    ses = app._default_session(1)
+    ses.update({
+        # LM Studio is the openai_compat provider pointed at port 1234.
+        "provider": "openai_compat" if provider == "lmstudio" else provider,
+        "mode": mode,
+        "apiBase": base,
+        "apiKey": "" if provider in ("openai_compat", "lmstudio") else "sk-mock",
+        "model": model,
+        "reasoning": module.normalize_reasoning_value(provider, reasoning),
+    })
+    for i in range(history):
+        ses["history"].append({"id": "h%d" % i, "role": "user" if i % 2 == 0 else "assistant", "kind": "text", "content": "Message %d about kerning and spacing." % i})
+    ses["history"].append({"id": "q", "role": "user", "kind": "text", "content": "Print the family name and glyph count."})
+    return ses
+
+
+def ask(app, mode):
+    cur = app.cur()
+    provider = cur["provider"]
+    useTools = mode == "direct" and provider in ("openai", "anthropic")
+    system, messages = app._build_api_messages(mode, tools=useTools)
+    return app._call_provider(provider, mode, cur, system, messages, cur.get("reasoning"))
+
+
+def run_load(app, mode, requests, concurrency):
+    latencies = []
+    errors = collections.Counter()
+
+    def _one(_):
+        start = time.perf_counter()
+        try:
+            text = ask(app, mode)
+            ok = bool(str(text or "").strip())
+            error = "" if ok else "empty answer"
+        except Exception as e:
+            error = (str(e).strip().splitlines() or [type(e).__name__])[0][:120]
+        return (time.perf_counter() - start) * 1000.0, error
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ms, error in pool.map(_one, range(requests)):
+            if error:
+                errors[error] += 1
+            else:
+                latencies.append(ms)
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+
+def report(latencies, errors, wall, requests):
+    ok = len(latencies)
+    print("requests      %d (%d ok, %d failed)" % (requests, ok, requests - ok))
+    print("wall time     %.2f s" % wall)
+    print("throughput    %.1f asks/s" % (ok / wall if wall else 0.0))
+    if latencies:
+        print("latency ms    p50 %.1f  p90 %.1f  p99 %.1f  max %.1f" % (percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99), max(latencies)))
+    for error, count in errors.most_common():
+        print("  %5d × %s" % (count, error))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fire asks through the real provider dispatch against a mock server.")
+    parser.add_argument("--provider", choices=PROVIDERS, default="openai")
+    parser.add_argument("--mode", choices=("code", "direct"), default="code")
+    parser.add_argument("--model", default="mock-fast")
+    parser.add_argument("--reasoning", default="auto")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--history", type=int, default=20, help="messages already in the tab")
+    parser.add_argument("--base", default="", help="use this API base instead of starting the mock")
+    parser.add_argument("--port", type=int, default=0, help="mock port (default %d, or %d for lmstudio)" % (mock_provider.DEFAULT_PORT, LMSTUDIO_PORT))
+    mock_provider.add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = None
+    base = args.base
+    port = args.port or (LMSTUDIO_PORT if args.provider == "lmstudio" else mock_provider.DEFAULT_PORT)
+    if not base:
+        server = mock_provider.serve(mock_provider.config_from_args(args), port=port)
+        base = "http://127.0.0.1:%d/v1" % port
+
+    module = headless.load_script()
+    app = headless.make_app(module, mcp_url=base.rsplit("/v1", 1)[0] + "/mcp/")
+    app.sessions = [make_session(module, app, args.provider, args.mode, base, args.model, args.reasoning, args.history)]
+    app.active = 0
+
+    latencies, errors, wall = run_load(app, args.mode, args.requests, args.concurrency)
+    print("%s / %s mode against %s, concurrency %d" % (args.provider, args.mode, base, args.concurrency))
+    report(latencies, errors, wall, args.requests)
+    if server is not None:
+        print("server        %s" % ", ".join("%s=%d" % kv for kv in sorted(server.config.stats.items())))
+        server.shutdown()
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the provider endpoints GlyphsGPT with Chat talks to.
+
+Serves, on one port:
+- POST /v1/responses          OpenAI Responses (also LM Studio's /v1/responses)
+- POST /v1/chat/completions   Chat Completions
+- POST /v1/messages           Anthropic Messages
+- POST /api/v1/chat           LM Studio native chat
+- GET  /v1/models             model list
+- POST /mcp/                  a minimal Glyphs MCP server (streamable HTTP, SSE replies)
+- GET  /_stats                request counters
+
+Requests with "stream": true get SSE in the provider's own event format.
+Latency, jitter and fault rates (429, 500, hung requests, malformed bodies) are
+set on the command line or per request with an `X-Mock-Fault` header
+(`429`, `500`, `timeout`, `malformed`). `--reject-reasoning` and
+`--no-responses` reproduce the errors that send the app down its fallback
+paths (_reasoning_rejected, _use_chat_completions_fallback).
+
+    python3 benchmarks/mock_provider.py --port 9690 --latency 0.2 --rate-429 0.05
+"""
+
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 9690
+DEFAULT_TEXT = "```python\nfont = Glyphs.font\nprint(font.familyName, len(font.glyphs))\n```"
+MCP_TOOLS = [
+    {"name": "get_font_info", "description": "Font family name, masters and glyph count.", "inputSchema": {"type": "object", "properties": {}}},
+    {"name": "list_glyphs", "description": "Glyph names.", "inputSchema": {"type": "object", "properties": {"limit": {"type": "integer"}}}},
+]
+
+
+class MockConfig(object):
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, rate_500=0.0, rate_timeout=0.0, rate_malformed=0.0,
+                 hang=30.0, reject_reasoning=False, no_responses=False, reject_input=False, tool_calls=False,
+                 text=DEFAULT_TEXT, stream_chunk=16, stream_delay=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.rate_timeout = rate_timeout
+        self.rate_malformed = rate_malformed
+        self.hang = hang
+        self.reject_reasoning = reject_reasoning
+        self.no_responses = no_responses
+        self.reject_input = reject_input
+        self.tool_calls = tool_calls
+        self.text = text
+        self.stream_chunk = stream_chunk
+        self.stream_delay = stream_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def pick_fault(self):
+        with self.lock:
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        for fault, rate in (("429", self.rate_429), ("500", self.rate_500), ("timeout", self.rate_timeout), ("malformed", self.rate_malformed)):
+            if roll < rate:
+                return fault, delay
+            roll -= rate
+        return "", delay
+
+
+def _usage(payload, text):
+    prompt_chars = len(json.dumps(payload.get("messages") or payload.get("input") or ""))
+    return max(1, prompt_chars // 4), max(1, len(text) // 4)
+
+
+def _has_tool_output(payload):
+    for item in payload.get("input") or []:
+        if isinstance(item, dict) and item.get("type") == "function_call_output":
+            return True
+    for msg in payload.get("messages") or []:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if isinstance(content, list) and any(isinstance(p, dict) and p.get("type") == "tool_result" for p in content):
+            return True
+    return False
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+
+    def log_message(self, *args):
+        pass
+
+    # ---------- plumbing ----------
+    def _send_json(self, status, obj, headers=None):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_raw(self, status, data, ctype="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_sse(self, headers=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.close_connection = True
+
+    def _sse(self, data, event=None):
+        chunk = ("event: %s\n" % event if event else "") + "data: %s\n\n" % (data if isinstance(data, str) else json.dumps(data))
+        self.wfile.write(chunk.encode("utf-8"))
+        self.wfile.flush()
+        if self.config.stream_delay:
+            time.sleep(self.config.stream_delay)
+
+    def _chunks(self, text):
+        size = max(1, int(self.config.stream_chunk))
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def _read_payload(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw.decode("utf-8") or "{}")
+        except Exception:
+            return None
+
+    def _apply_fault(self):
+        """Returns True when the request has been answered with a fault."""
+        cfg = self.config
+        fault, delay = cfg.pick_fault()
+        fault = self.headers.get("X-Mock-Fault") or fault
+        if delay:
+            time.sleep(delay)
+        if not fault:
+            return False
+        cfg.count("fault:" + fault)
+        if fault == "429":
+            self._send_json(429, {"error": {"type": "rate_limit_error", "message": "Rate limit reached. Please retry after 1s."}}, {"Retry-After": "1"})
+        elif fault == "500":
+            self._send_json(500, {"error": {"type": "server_error", "message": "The server had an error while processing your request."}})
+        elif fault == "timeout":
+            time.sleep(cfg.hang)
+            self.close_connection = True
+        elif fault == "malformed":
+            self._send_raw(200, b'{"id": "resp_truncated", "output": [{"type": "message", "content": [{"type": "output_te')
+        else:
+            return False
+        return True
+
+    # ---------- routes ----------
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        self.config.count("GET " + path)
+        if path == "/_stats":
+            with self.config.lock:
+                self._send_json(200, dict(self.config.stats))
+        elif path.rstrip("/") in ("/v1/models", "/api/v1/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock-fast", "object": "model"}, {"id": "mock-strong", "object": "model"}]})
+        elif path.startswith("/mcp"):
+            self._send_json(200, {"name": "mock-glyphs-mcp"})
+        else:
+            self._send_json(404, {"error": {"message": "Unknown path %s" % path}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        self.config.count("POST " + path)
+        payload = self._read_payload()
+        if path.startswith("/mcp"):
+            return self._mcp(payload or {})
+        if payload is None:
+            return self._send_json(400, {"error": {"message": "Could not parse JSON body."}})
+        if self._apply_fault():
+            return
+        if path.endswith("/responses"):
+            return self._responses(payload)
+        if path.endswith("/chat/completions"):
+            return self._chat_completions(payload)
+        if path.endswith("/messages"):
+            return self._anthropic(payload)
+        if path.endswith("/api/v1/chat"):
+            return self._lmstudio_chat(payload)
+        self._send_json(404, {"error": {"message": "Unknown path %s" % path}})
+
+    def _responses(self, payload):
+        cfg = self.config
+        if cfg.no_responses:
+            return self._send_json(404, {"error": {"message": "Not Found: unknown path /v1/responses"}})
+        if cfg.reject_reasoning and "reasoning" in payload:
+            return self._send_json(400, {"error": {"message": "Invalid parameter 'reasoning': unsupported for this model."}})
+        if cfg.reject_input and isinstance(payload.get("input"), list):
+            return self._send_json(400, {"error": {"message": "Invalid type for 'input': expected string (invalid_union)."}})
+        text = cfg.text
+        tokens_in, tokens_out = _usage(payload, text)
+        usage = {"input_tokens": tokens_in, "output_tokens": tokens_out, "total_tokens": tokens_in + tokens_out,
+                 "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0}}
+        if cfg.tool_calls and payload.get("tools") and not _has_tool_output(payload):
+            output = [{"type": "function_call", "call_id": "call_%s" % uuid.uuid4().hex[:8], "name": "get_font_info", "arguments": "{}"}]
+        else:
+            output = [{"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": text}]}]
+        res = {"id": "resp_%s" % uuid.uuid4().hex[:12], "object": "response", "status": "completed", "model": payload.get("model"), "output": output, "usage": usage}
+        if not payload.get("stream"):
+            return self._send_json(200, res)
+        self._start_sse()
+        self._sse({"type": "response.created", "response": dict(res, status="in_progress", output=[])}, "response.created")
+        if output[0]["type"] == "message":
+            for part in self._chunks(text):
+                self._sse({"type": "response.output_text.delta", "delta": part}, "response.output_text.delta")
+        self._sse({"type": "response.completed", "response": res}, "response.completed")
+
+    def _chat_completions(self, payload):
+        text = self.config.text
+        tokens_in, tokens_out = _usage(payload, text)
+        cid = "chatcmpl-%s" % uuid.uuid4().hex[:12]
+        if not payload.get("stream"):
+            return self._send_json(200, {
+                "id": cid, "object": "chat.completion", "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": tokens_in, "completion_tokens": tokens_out, "total_tokens": tokens_in + tokens_out},
+            })
+        self._start_sse()
+        for part in self._chunks(text):
+            self._sse({"id": cid, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}]})
+        self._sse({"id": cid, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self._sse("[DONE]")
+
+    def _anthropic(self, payload):
+        cfg = self.config
+        text = cfg.text
+        tokens_in, tokens_out = _usage(payload, text)
+        usage = {"input_tokens": tokens_in, "output_tokens": tokens_out, "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        if cfg.tool_calls and payload.get("tools") and not _has_tool_output(payload):
+            content = [{"type": "tool_use", "id": "toolu_%s" % uuid.uuid4().hex[:8], "name": "get_font_info", "input": {}}]
+            stop = "tool_use"
+        else:
+            content = [{"type": "text", "text": text}]
+            stop = "end_turn"
+        res = {"id": "msg_%s" % uuid.uuid4().hex[:12], "type": "message", "role": "assistant", "model": payload.get("model"), "content": content, "stop_reason": stop, "usage": usage}
+        if not payload.get("stream"):
+            return self._send_json(200, res)
+        self._start_sse()
+        self._sse({"type": "message_start", "message": dict(res, content=[], stop_reason=None)}, "message_start")
+        self._sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, "content_block_start")
+        for part in self._chunks(text):
+            self._sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": part}}, "content_block_delta")
+        self._sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self._sse({"type": "message_delta", "delta": {"stop_reason": stop}, "usage": {"output_tokens": tokens_out}}, "message_delta")
+        self._sse({"type": "message_stop"}, "message_stop")
+
+    def _lmstudio_chat(self, payload):
+        text = self.config.text
+        tokens_in, tokens_out = _usage(payload, text)
+        self._send_json(200, {
+            "model_instance_id": payload.get("model"),
+            "output": [
+                {"type": "tool_call", "tool": "get_font_info", "arguments": {}, "output": "{}", "provider_info": {"type": "ephemeral_mcp", "server_label": "glyphs-mcp"}},
+                {"type": "message", "content": text},
+            ],
+            "stats": {"input_tokens": tokens_in, "total_output_tokens": tokens_out},
+        })
+
+    def _mcp(self, payload):
+        method = payload.get("method")
+        if "id" not in payload:
+            self.send_response(202)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if method == "initialize":
+            result = {"protocolVersion": payload.get("params", {}).get("protocolVersion", "2025-03-26"), "capabilities": {"tools": {}}, "serverInfo": {"name": "mock-glyphs-mcp", "version": "0"}}
+        elif method == "tools/list":
+            result = {"tools": MCP_TOOLS}
+        elif method == "tools/call":
+            name = (payload.get("params") or {}).get("name")
+            result = {"content": [{"type": "text", "text": json.dumps({"tool": name, "familyName": "Mock Sans", "glyphs": 3})}]}
+        else:
+            return self._send_json(200, {"jsonrpc": "2.0", "id": payload["id"], "error": {"code": -32601, "message": "Method not found: %s" % method}})
+        self._start_sse({"Mcp-Session-Id": "mock-session"})
+        self._sse({"jsonrpc": "2.0", "id": payload["id"], "result": result}, "message")
+
+
+def serve(config=None, port=DEFAULT_PORT, host="127.0.0.1"):
+    """Start the server on a daemon thread and return it; `server.config` holds the live settings."""
+    handler = type("BoundMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.config = handler.config
+    thread = threading.Thread(target=server.serve_forever, name="mock-provider", daemon=True)
+    thread.start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="± seconds of random latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="fraction of requests that hang")
+    parser.add_argument("--rate-malformed", type=float, default=0.0, help="fraction of requests with a truncated body")
+    parser.add_argument("--hang", type=float, default=30.0, help="seconds a hung request is held open")
+    parser.add_argument("--reject-reasoning", action="store_true", help="reject the reasoning parameter on /responses")
+    parser.add_argument("--no-responses", action="store_true", help="answer /responses with 404")
+    parser.add_argument("--reject-input", action="store_true", help="reject list-typed input on /responses like older LM Studio builds")
+    parser.add_argument("--tool-calls", action="store_true", help="answer the first tool-enabled turn with a tool call")
+    parser.add_argument("--text", default=DEFAULT_TEXT, help="answer text")
+    parser.add_argument("--stream-chunk", type=int, default=16, help="characters per SSE delta")
+    parser.add_argument("--stream-delay", type=float, default=0.0, help="seconds between SSE events")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible fault patterns")
+
+
+def config_from_args(args):
+    return MockConfig(
+        latency=args.latency, jitter=args.jitter, rate_429=args.rate_429, rate_500=args.rate_500,
+        rate_timeout=args.rate_timeout, rate_malformed=args.rate_malformed, hang=args.hang,
+        reject_reasoning=args.reject_reasoning, no_responses=args.no_responses, reject_input=args.reject_input,
+        tool_calls=args.tool_calls, text=args.text, stream_chunk=args.stream_chunk, stream_delay=args.stream_delay, seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI, Anthropic, LM Studio and Glyphs MCP endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    server = serve(config_from_args(args), port=args.port, host=args.host)
+    print("Mock provider on http://%s:%d (OpenAI/LM Studio base: http://%s:%d/v1, MCP: http://%s:%d/mcp/)" % (args.host, args.port, args.host, args.port, args.host, args.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()